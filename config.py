@@ -2,4 +2,105 @@
 db_params = {
     "db_file": "db/messages.db",
     "init_script": "db/init_db.sql",
+    # Optional sharded storage of messages and reactions: "" (single database file),
+    # "chat" (one file per chat), "month" (one file per month) or "chat_month".
+    "sharding": "",
+    "shard_dir": "db/shards",
+    # Maximum number of read-only connections used by the read APIs.
+    "read_pool_size": 4,
+    # Seconds to wait for a free read connection or a locked database.
+    "busy_timeout": 30.0,
+}
+
+# Params for the Telegram client.
+client_params = {
+    # Number of messages requested per history page.
+    "page_size": 100,
+    # Attempts to repeat a request after a flood wait or a lost connection.
+    "max_retries": 5,
+    # Delay before the first reconnect in seconds, doubled on every further attempt.
+    "retry_delay": 1.0,
+    # Longest flood wait in seconds to sit out; longer ones fail the export.
+    "max_flood_wait": 300,
+    # Seconds a stored user profile is reused instead of being fetched again.
+    "profile_ttl": 7 * 24 * 3600,
+}
+
+# Params for the live tail mode.
+live_params = {
+    # Maximum age of a batch of live updates in seconds before it is written to the database.
+    "flush_interval": 5.0,
+    # Maximum number of live updates in a batch.
+    "flush_size": 500,
+    # Attempts to repeat a failed batch write before the live tail stops.
+    "max_retries": 5,
+    # Delay before the first repeat in seconds, doubled on every further attempt.
+    "retry_delay": 1.0,
+}
+
+# Params for the compression of message texts.
+compression_params = {
+    # Compress texts of new messages. Existing texts are compressed by `python -m src.cli compress`.
+    "enabled": False,
+    "level": 9,
+    # Maximum size of a per-chat dictionary in bytes (zlib uses at most 32 KiB).
+    "dict_size": 16384,
+    # Number of messages of a chat written before its dictionary is trained.
+    "train_threshold": 1000,
+    # Maximum number of messages used to train a dictionary.
+    "train_sample": 5000,
+}
+
+# Params for the database maintenance.
+maintenance_params = {
+    # Seconds a maintenance run may spend on batched tasks.
+    "time_budget": 60.0,
+    # Number of rows per maintenance transaction.
+    "batch_size": 500,
+    # Number of pages freed per incremental vacuum step.
+    "vacuum_pages": 256,
+    # Retention period in months by chat ID, e.g. {-1001234567890: 12}. Older messages are
+    # moved to compressed per-chat archive files.
+    "retention": {},
+    "archive_dir": "db/archive",
+}
+
+# Params for the word and bigram statistics of message texts.
+text_stats_params = {
+    # Index the texts of saved messages. Existing messages are indexed by
+    # `python -m src.cli text-stats --rebuild`.
+    "enabled": False,
+    "lowercase": True,
+    "min_token_len": 2,
+    "skip_numbers": True,
+    "bigrams": True,
+    # Space-separated tokens that are not counted.
+    "stop_words": (
+        "the and for are but not you all any can was this that with have from "
+        "they will what there is it to of in on at be as an or if so do и в во "
+        "не что он на я с со как а то все она так его но да ты к у же вы за бы "
+        "по только ее мне было вот от меня еще нет о из ему теперь когда даже "
+        "ну ли если уже или ни быть был него до вас нибудь уж вам там потом "
+        "себя ничего ей может они тут где есть надо ней для мы тебя их чем была "
+        "сам чтоб без будто это этот эта эти тоже просто"
+    ),
+}
+
+interaction_params = {
+    # Weights of a reply and of a reaction in the combined interaction matrix.
+    "reply_weight": 1.0,
+    "reaction_weight": 1.0,
+    # Rows fetched from the database at once while loading edges.
+    "chunk_size": 100000,
+    # Number of interaction graphs kept in memory.
+    "cache_size": 16,
+}
+
+query_cache_params = {
+    # Cache results of the read APIs of `MsgController`, invalidated per chat on every write.
+    "enabled": True,
+    # Maximum estimated memory of the cached results, least recently used results are evicted.
+    "max_bytes": 64 * 2**20,
+    # Results estimated larger than this are not cached.
+    "max_entry_bytes": 8 * 2**20,
 }
@@ -0,0 +1,172 @@
+from typing import Dict, List, Tuple
+from datetime import datetime
+import os
+import re
+
+from db.compression import TextCompressor
+from db.init_db import init_schema
+from db.sqlite_connector import QueryError, SQLiteConnector
+from src.models import Msg, MsgReaction
+
+
+class ArchiveStore:
+    """
+    Compressed per-chat archive files for messages moved out of the live database by retention rules.
+
+    Each chat is archived to `<archive_dir>/chat_<chat_id>.db`, a database with the regular schema
+    whose message texts are always compressed with a dictionary trained for the archive.
+    Archives can be queried like the live database through `get_messages`.
+
+    Example of usage:
+        >>> store = ArchiveStore("db/archive", "db/init_db.sql", compression_params)
+        >>> store.save(chat_id, messages)
+        >>> old_messages = store.get_messages(chat_id, end_date=datetime(2023, 1, 1))
+    """
+
+    _FILE_RE = re.compile(r"^chat_(-?\d+)\.db$")
+
+    def __init__(self, archive_dir: str, init_script: str, compression_params: Dict):
+        self.archive_dir = archive_dir
+        self.init_script = init_script
+        self.compression_params = dict(compression_params, enabled=True)
+        self._connections: Dict[int, Tuple[SQLiteConnector, TextCompressor]] = {}
+
+    def path(self, chat_id: int) -> str:
+        return os.path.join(self.archive_dir, f"chat_{chat_id}.db")
+
+    def chats(self) -> List[int]:
+        """Returns the IDs of the archived chats."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+
+        return sorted(
+            int(match.group(1))
+            for match in map(self._FILE_RE.match, os.listdir(self.archive_dir))
+            if match
+        )
+
+    def save(
+        self, chat_id: int, messages: List[Msg], reactions: List[MsgReaction]
+    ) -> Tuple[int, str]:
+        """
+        Writes messages and their reactions to the archive of the chat in one transaction.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        conn, compressor = self._open(chat_id, create=True)
+
+        if compressor.dictionary(chat_id) is None:
+            # The first batch is the training sample of the archive dictionary.
+            compressor.train(chat_id, [msg.msg_text for msg in messages])
+
+        try:
+            with conn.transaction():
+                for msg in messages:
+                    status_code, status_message = conn.execute_query(
+                        """
+                        insert or replace into messages (chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id)
+                        values(?, ?, ?, ?, ?, ?)
+                        """,
+                        (
+                            msg.chat_id,
+                            msg.user_id,
+                            msg.msg_id,
+                            compressor.encode(chat_id, msg.msg_text),
+                            msg.msg_dt,
+                            msg.reply_to_msg_id,
+                        ),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                for mr in reactions:
+                    status_code, status_message = conn.execute_query(
+                        """
+                        insert or replace into reactions (chat_id, msg_id, user_id, emoticon)
+                        values(?, ?, ?, ?)
+                        """,
+                        (mr.chat_id, mr.msg_id, mr.user_id, mr.emoticon),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        return 0, "OK"
+
+    def get_messages(
+        self, chat_id: int, start_date: datetime = None, end_date: datetime = None
+    ) -> List[Msg]:
+        """
+        Returns the archived messages of a chat between the dates, ordered by message ID.
+        Reactions are not loaded.
+        """
+        if not os.path.exists(self.path(chat_id)):
+            return []
+
+        conn, compressor = self._open(chat_id)
+
+        status_code, status_message, rows = conn.execute_read_query(
+            """
+            select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+            from messages
+            where chat_id = ? and (? is null or msg_dt >= ?) and (? is null or msg_dt <= ?)
+            order by msg_id
+            """,
+            (chat_id, start_date, start_date, end_date, end_date),
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        return [
+            Msg(
+                chat_id,
+                user_id,
+                msg_id,
+                compressor.decode(chat_id, msg_text),
+                datetime.fromisoformat(msg_dt),
+                reply_to_msg_id,
+                [],
+            )
+            for chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id in rows
+        ]
+
+    def close(self):
+        for conn, _ in self._connections.values():
+            conn.close()
+
+        self._connections = {}
+
+    def _open(
+        self, chat_id: int, create: bool = False
+    ) -> Tuple[SQLiteConnector, TextCompressor]:
+        if chat_id in self._connections:
+            return self._connections[chat_id]
+
+        path = self.path(chat_id)
+
+        if not os.path.exists(path):
+            if not create:
+                raise FileNotFoundError(f"Archive `{path}` not found.")
+
+            os.makedirs(self.archive_dir, exist_ok=True)
+
+            if init_schema(path, self.init_script) != 0:
+                raise RuntimeError(f"Archive `{path}` could not be created.")
+
+        conn = SQLiteConnector(path)
+        status_code, status_message = conn.connect()
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        self._connections[chat_id] = (
+            conn,
+            TextCompressor(conn, self.compression_params),
+        )
+
+        return self._connections[chat_id]
@@ -0,0 +1,431 @@
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from collections import Counter
+import zlib
+from loguru import logger
+
+from db.sqlite_connector import QueryError
+
+
+class TextCompressor:
+    """
+    Transparent compression of message texts with per-chat preset dictionaries.
+
+    Chat messages are short and repetitive, so compressing each one on its own gains little.
+    A dictionary of frequent phrases is trained for every chat and used as the zlib preset
+    dictionary (raw deflate, no header and checksum). Compressed texts are stored as BLOBs
+    prefixed with the varint-encoded version of the chat dictionary, plain texts stay TEXT,
+    so both kinds can live in the same `msg_text` column and old databases stay readable.
+
+    Dictionaries are kept in the `text_dicts` table of the main database. A chat gets its first
+    dictionary once `train_threshold` of its messages have been passed to `prepare` in the
+    process; older messages are compressed by `migrate`.
+
+    Attributes:
+        conn: The main database connection (`ConnectionManager` or `SQLiteConnector`).
+        enabled (bool): Whether new texts are compressed.
+        level (int): The zlib compression level.
+        dict_size (int): Maximum size of a trained dictionary in bytes.
+        train_threshold (int): Number of written messages of a chat after which a dictionary is trained.
+        train_sample (int): Maximum number of texts used for training.
+    """
+
+    # zlib looks back at most 32 KiB, a longer dictionary would not be used.
+    MAX_DICT_SIZE = 32768
+
+    def __init__(self, conn, params: Dict):
+        self.conn = conn
+        self.enabled = params["enabled"]
+        self.level = params["level"]
+        self.dict_size = min(params["dict_size"], self.MAX_DICT_SIZE)
+        self.train_threshold = params["train_threshold"]
+        self.train_sample = params["train_sample"]
+
+        # chat_id -> (version, primed compressor)
+        self._compressors: Dict[int, Tuple[int, object]] = {}
+        # (chat_id, version) -> primed decompressor
+        self._decompressors: Dict[Tuple[int, int], object] = {}
+        self._dictionaries: Dict[Tuple[int, int], bytes] = {}
+        self._samples: Dict[int, List[str]] = {}
+
+        if self.enabled:
+            status_code, status_message = self.create_table()
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+        self.load()
+
+    def create_table(self) -> Tuple[int, str]:
+        """Creates the dictionaries table in databases created before compression was added."""
+        return self.conn.execute_query("""
+            create table if not exists text_dicts (
+                chat_id integer not null,
+                dict_version integer not null,
+                dict_data blob not null,
+                created_at timestamp not null default current_timestamp,
+                primary key (chat_id, dict_version)
+            )
+            """)
+
+    def load(self):
+        """Loads the stored dictionaries."""
+        status_code, _, rows = self.conn.execute_read_query(
+            "select chat_id, dict_version, dict_data from text_dicts order by chat_id, dict_version"
+        )
+
+        if status_code != 0:
+            # No dictionaries table, i.e. compression has never been enabled.
+            return
+
+        for chat_id, version, data in rows:
+            self._register(chat_id, version, data)
+
+    def dictionary(self, chat_id: int) -> Optional[Tuple[int, bytes]]:
+        """Returns the version and data of the current dictionary of the chat, if any."""
+        if chat_id not in self._compressors:
+            return None
+
+        version = self._compressors[chat_id][0]
+
+        return version, self._dictionaries[(chat_id, version)]
+
+    def prepare(self, texts: Iterable[Tuple[int, str]]):
+        """
+        Collects the texts of a batch about to be written as training samples and trains the
+        dictionaries of the chats that reach `train_threshold`.
+
+        Must be called before the transaction of the batch is opened. Every new dictionary is
+        committed on its own, so it is stored before any text compressed with it, also when
+        the texts go to shards that commit before the main database.
+
+        Args:
+            texts (Iterable[Tuple[int, str]]): Pairs of chat ID and message text.
+        """
+        if not self.enabled:
+            return
+
+        for chat_id, text in texts:
+            if chat_id not in self._compressors:
+                self._collect(chat_id, text)
+
+    def encode(self, chat_id: int, text: str) -> Union[str, bytes]:
+        """
+        Compresses a message text if compression is enabled, the chat has a dictionary and
+        compression pays off.
+
+        Returns:
+            Union[str, bytes]: The value to store in `msg_text`.
+        """
+        if not self.enabled or chat_id not in self._compressors:
+            return text
+
+        return self.compress(chat_id, text)
+
+    def compress(self, chat_id: int, text: str) -> Union[str, bytes]:
+        """Compresses a text with the current dictionary of the chat, keeping it plain if that is shorter."""
+        version, template = self._compressors[chat_id]
+
+        raw = text.encode("utf-8")
+        compressor = template.copy()
+        data = _encode_varint(version) + compressor.compress(raw) + compressor.flush()
+
+        return data if len(data) < len(raw) else text
+
+    def decode(self, chat_id: int, value: Union[str, bytes]) -> str:
+        """
+        Restores a message text stored by `encode`.
+        """
+        if not isinstance(value, bytes):
+            return value
+
+        version, offset = _decode_varint(value)
+        decompressor = self._decompressors.get((chat_id, version))
+
+        if decompressor is None:
+            # The dictionary may have been trained by another process.
+            self.load()
+            decompressor = self._decompressors[(chat_id, version)]
+
+        decompressor = decompressor.copy()
+
+        return (decompressor.decompress(value[offset:]) + decompressor.flush()).decode(
+            "utf-8"
+        )
+
+    def train(self, chat_id: int, texts: Iterable[str]) -> Tuple[int, str]:
+        """
+        Trains a new dictionary for the chat and stores it.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        data = train_dictionary(texts, self.dict_size)
+
+        if not data:
+            return 1, f"Not enough text to train a dictionary for chat {chat_id}."
+
+        current = self.dictionary(chat_id)
+        version = current[0] + 1 if current else 1
+
+        status_code, status_message = self.conn.execute_query(
+            "insert into text_dicts (chat_id, dict_version, dict_data) values (?, ?, ?)",
+            (chat_id, version, data),
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+        # Inside a transaction the texts compressed with the new dictionary are committed
+        # together with it; if it is rolled back, the dictionary must not be used.
+        self._register(chat_id, version, data)
+        self.conn.on_rollback(lambda: self._unregister(chat_id, version))
+
+        logger.info(
+            f"Trained text dictionary v{version} for chat {chat_id} ({len(data)} bytes)."
+        )
+
+        return 0, "OK"
+
+    def _collect(self, chat_id: int, text: str):
+        samples = self._samples.setdefault(chat_id, [])
+
+        if len(samples) < self.train_sample:
+            samples.append(text)
+
+        if len(samples) >= self.train_threshold:
+            status_code, status_message = self.train(chat_id, samples)
+
+            if status_code != 0:
+                logger.warning(status_message)
+
+            del self._samples[chat_id]
+
+    def _register(self, chat_id: int, version: int, data: bytes):
+        self._dictionaries[(chat_id, version)] = data
+        self._decompressors[(chat_id, version)] = zlib.decompressobj(-15, zdict=data)
+
+        current = self._compressors.get(chat_id)
+
+        if current is None or current[0] < version:
+            self._compressors[chat_id] = (
+                version,
+                zlib.compressobj(self.level, zlib.DEFLATED, -15, 9, zdict=data),
+            )
+
+    def _unregister(self, chat_id: int, version: int):
+        logger.warning(
+            f"Text dictionary v{version} for chat {chat_id} dropped, its transaction was rolled back."
+        )
+
+        self._dictionaries.pop((chat_id, version), None)
+        self._decompressors.pop((chat_id, version), None)
+
+        current = self._compressors.get(chat_id)
+
+        if current is None or current[0] != version:
+            return
+
+        # Fall back to the newest stored dictionary of the chat, if any.
+        del self._compressors[chat_id]
+        versions = [v for c_id, v in self._dictionaries if c_id == chat_id]
+
+        if versions:
+            version = max(versions)
+            self._register(chat_id, version, self._dictionaries[(chat_id, version)])
+
+
+def train_dictionary(texts: Iterable[str], dict_size: int) -> bytes:
+    """
+    Builds a zlib preset dictionary from sample texts.
+
+    Word sequences of one to three words are scored by how many bytes they would save
+    (occurrences times length). The best ones are concatenated up to `dict_size` bytes with
+    the most valuable at the end, where deflate reaches them with the shortest distances.
+
+    Args:
+        texts (Iterable[str]): Sample texts.
+        dict_size (int): Maximum size of the dictionary in bytes.
+
+    Returns:
+        bytes: The dictionary, empty if the texts have no repeated content.
+    """
+    counts = Counter()
+
+    for text in texts:
+        words = text.split()
+
+        for n in (1, 2, 3):
+            for i in range(len(words) - n + 1):
+                counts[" ".join(words[i : i + n])] += 1
+
+    scored = sorted(
+        (
+            (count * len(phrase.encode("utf-8")), phrase)
+            for phrase, count in counts.items()
+            if count > 1
+        ),
+        reverse=True,
+    )
+
+    chosen = []
+    size = 0
+
+    for _, phrase in scored:
+        data = (phrase + " ").encode("utf-8")
+
+        if size + len(data) > dict_size:
+            continue
+
+        chosen.append(data)
+        size += len(data)
+
+    return b"".join(reversed(chosen))
+
+
+def migrate(
+    compressor: TextCompressor,
+    connections: List,
+    chat_id: int = None,
+    decompress: bool = False,
+    batch_size: int = 1000,
+) -> Tuple[int, str]:
+    """
+    Compresses (or restores) the texts already stored in the given databases.
+
+    Chats without a dictionary get one trained from their newest messages first.
+    Every batch is committed on its own, so the migration can run alongside ingest.
+
+    Args:
+        compressor (TextCompressor): The compressor of the main database.
+        connections (List): Connections to the databases holding messages (main database or shards).
+        chat_id (int, optional): Migrate only this chat. Defaults to all chats.
+        decompress (bool, optional): Store all texts plain again instead. Defaults to False.
+        batch_size (int, optional): Number of messages per transaction. Defaults to 1000.
+
+    Returns:
+        Tuple[int, str]: A tuple containing a status code and a message.
+    """
+    status_code, status_message = compressor.create_table()
+
+    if status_code != 0:
+        return status_code, status_message
+
+    changed = 0
+    bytes_before = 0
+    bytes_after = 0
+
+    for conn in connections:
+        status_code, status_message, rows = conn.execute_read_query(
+            "select distinct chat_id from messages where ? is null or chat_id = ?",
+            (chat_id, chat_id),
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+        for (row_chat_id,) in rows:
+            if not decompress and compressor.dictionary(row_chat_id) is None:
+                status_code, status_message, sample = conn.execute_read_query(
+                    """
+                    select msg_text from messages
+                    where chat_id = ? and typeof(msg_text) = 'text'
+                    order by msg_id desc limit ?
+                    """,
+                    (row_chat_id, compressor.train_sample),
+                )
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                status_code, status_message = compressor.train(
+                    row_chat_id, [text for (text,) in sample]
+                )
+
+                if status_code != 0:
+                    logger.warning(status_message)
+                    continue
+
+            last_msg_id = None
+
+            while True:
+                status_code, status_message, batch = conn.execute_read_query(
+                    """
+                    select msg_id, msg_text from messages
+                    where chat_id = ? and (? is null or msg_id > ?)
+                    order by msg_id limit ?
+                    """,
+                    (row_chat_id, last_msg_id, last_msg_id, batch_size),
+                )
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                if not batch:
+                    break
+
+                last_msg_id = batch[-1][0]
+
+                try:
+                    with conn.transaction():
+                        for msg_id, value in batch:
+                            text = compressor.decode(row_chat_id, value)
+                            new_value = (
+                                text
+                                if decompress
+                                else compressor.compress(row_chat_id, text)
+                            )
+
+                            bytes_before += _stored_size(value)
+                            bytes_after += _stored_size(new_value)
+
+                            if new_value == value:
+                                continue
+
+                            status_code, status_message = conn.execute_query(
+                                "update messages set msg_text = ? where chat_id = ? and msg_id = ?",
+                                (new_value, row_chat_id, msg_id),
+                            )
+
+                            if status_code != 0:
+                                raise QueryError(status_message)
+
+                            changed += 1
+                except QueryError as e:
+                    return 1, str(e)
+
+    return (
+        0,
+        f"Migrated {changed} messages, text size {bytes_before} -> {bytes_after} bytes.",
+    )
+
+
+def _stored_size(value: Union[str, bytes]) -> int:
+    return len(value) if isinstance(value, bytes) else len(value.encode("utf-8"))
+
+
+def _encode_varint(value: int) -> bytes:
+    data = bytearray()
+
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+
+        if value:
+            data.append(byte | 0x80)
+        else:
+            data.append(byte)
+            return bytes(data)
+
+
+def _decode_varint(data: bytes) -> Tuple[int, int]:
+    value = 0
+    shift = 0
+
+    for offset, byte in enumerate(data):
+        value |= (byte & 0x7F) << shift
+        shift += 7
+
+        if not byte & 0x80:
+            return value, offset + 1
+
+    raise ValueError("Invalid compressed text header")
@@ -1,56 +1,691 @@
-from typing import List, Tuple
-from tqdm import tqdm
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+import os
+import sqlite3
 from loguru import logger
 
-from config import db_params
+from config import (
+    db_params,
+    compression_params,
+    maintenance_params,
+    text_stats_params,
+    query_cache_params,
+)
 from src.models import Msg, MsgReaction, User
-from db.sqlite_connector import SQLiteConnector
+from db.sqlite_connector import QueryError, SQLiteConnector
+from db.pool import ConnectionManager
+from db.shards import ShardRouter
+from db.compression import TextCompressor
+from db.archive import ArchiveStore
+from db.text_stats import TextStats
+from db.profiles import ProfileStore
+from db.query_cache import (
+    QueryCache,
+    bump_chat_versions,
+    create_versions_table,
+    make_key,
+)
 
 
 class MsgController:
-    def __init__(self):
-        self.conn = SQLiteConnector(db_params["db_file"])
+    def __init__(
+        self, db_file: str = None, shard_dir: str = None, archive_dir: str = None
+    ):
+        """
+        Opens the database.
+
+        Args:
+            db_file (str, optional): The path to the database file. Defaults to `db_params["db_file"]`.
+            shard_dir (str, optional): The directory of the shards. Defaults to `db_params["shard_dir"]`.
+            archive_dir (str, optional): The directory of the chat archives.
+                                         Defaults to `maintenance_params["archive_dir"]`.
+        """
+        self.conn = ConnectionManager(
+            db_file or db_params["db_file"],
+            db_params["read_pool_size"],
+            db_params["busy_timeout"],
+        )
         status_code, status_message = self.conn.connect()
 
         if status_code != 0:
             raise RuntimeError(status_message)
 
-    def save_data(self, messages: List[Msg], users: List[User]) -> Tuple[int, str]:
+        status_code, status_message = create_versions_table(self.conn)
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        self.cache = None
+
+        if query_cache_params["enabled"]:
+            self.cache = QueryCache(
+                db_file or db_params["db_file"],
+                query_cache_params["max_bytes"],
+                query_cache_params["max_entry_bytes"],
+            )
+            status_code, status_message = self.cache.connect()
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+        self.compressor = TextCompressor(self.conn, compression_params)
+        self.text_stats = TextStats(self.conn, text_stats_params)
+        self.archive = ArchiveStore(
+            archive_dir or maintenance_params["archive_dir"],
+            db_params["init_script"],
+            compression_params,
+        )
+        self.router = None
+
+        if db_params.get("sharding"):
+            # Shard writes are serialized by the lock of the main writer, which `_transaction`
+            # holds for the whole batch.
+            self.router = ShardRouter(
+                shard_dir or db_params["shard_dir"],
+                db_params["sharding"],
+                db_params["init_script"],
+                self.conn.write_lock,
+            )
+
+            status_code, status_message, rows = self.conn.execute_read_query(
+                "select exists (select 1 from messages)"
+            )
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+            if rows[0][0]:
+                # Sharded reads do not see the main database, the export would start over.
+                logger.error(
+                    "The main database holds messages written before sharding."
+                )
+                raise RuntimeError(
+                    "Sharding is enabled, but the main database still holds messages. "
+                    "Move them into the shards with `python -m src.cli shards --migrate`."
+                )
+
+        # Databases created before profiles get their users moved, with the first and last
+        # activity read from the shards when sharding is enabled.
+        self.profiles = ProfileStore(self.conn)
+        status_code, status_message = self.profiles.migrate(self.router)
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+    def close(self):
+        """Closes the database connections."""
+        self.conn.close()
+        self.archive.close()
+
+        if self.cache is not None:
+            self.cache.close()
+
+        if self.router is not None:
+            self.router.close()
+
+    def save_data(
+        self, messages: List[Msg], users: List[User], progress: bool = True
+    ) -> Tuple[int, str]:
+        # tqdm is imported lazily so that read-only users of the controller start fast.
+        from tqdm import tqdm
+
+        paths = set([])
+
+        if self.router is not None:
+            messages = [msg for msg in messages if self._writable(msg)]
+            paths = set(
+                [self.router.shard_path(msg.chat_id, msg.msg_dt) for msg in messages]
+            )
+
         msg_qty = len(messages)
         reactions_qty = sum([len(msg.reactions) for msg in messages])
         users_qty = len(users)
 
-        for msg in tqdm(messages, "Saving messages"):
-            status_code, status_message = self._save_single_message(msg)
+        # New text dictionaries are committed before the texts compressed with them.
+        self.compressor.prepare([(msg.chat_id, msg.msg_text) for msg in messages])
 
-            if status_code == 0:
-                for reaction in msg.reactions:
-                    status_code, status_message = self._save_single_reaction(reaction)
+        # All writes of the batch are committed at once, readers see either none or all of them.
+        try:
+            with self._transaction(paths):
+                if self.text_stats.enabled:
+                    status_code, status_message = self._index_texts(messages)
 
                     if status_code != 0:
-                        logger.error(f"Error during reaction saving: {status_message}")
-                        logger.error(f"Reaction data: {reaction}")
-                        return status_code, status_message
+                        logger.error(
+                            f"Error during text statistics update: {status_message}"
+                        )
+                        raise QueryError(status_message)
 
-            else:
-                logger.error(f"Error during message saving: {status_message}")
-                logger.error(f"Message data: {msg}")
-                return status_code, status_message
+                for msg in tqdm(messages, "Saving messages", disable=not progress):
+                    conn = self._message_conn(msg)
+                    status_code, status_message = self._save_single_message(msg, conn)
 
-        for user in tqdm(users, "Saving users"):
-            status_code, status_message = self._save_single_user(user)
+                    if status_code != 0:
+                        logger.error(f"Error during message saving: {status_message}")
+                        logger.error(f"Message data: {msg}")
+                        raise QueryError(status_message)
 
-            if status_code != 0:
-                logger.error(f"Error during user saving: {status_message}")
-                logger.error(f"User data: {user}")
-                return status_code, status_message
+                    # The reactions of a message are its current set, e.g. after an edit.
+                    status_code, status_message = self._replace_message_reactions(
+                        msg.chat_id, msg.msg_id, msg.reactions, conn
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                status_code, status_message = self.profiles.save(
+                    users, self._activity(messages)
+                )
+
+                if status_code != 0:
+                    logger.error(f"Error during user saving: {status_message}")
+                    raise QueryError(status_message)
+
+                status_code, status_message = bump_chat_versions(
+                    self.conn,
+                    [msg.chat_id for msg in messages]
+                    + [user.chat_id for user in users],
+                )
+
+                if status_code != 0:
+                    raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
 
         return (
             0,
             f"Successfully saved in database {msg_qty} messages, {reactions_qty} reactions and {users_qty} users.",
         )
 
-    def _save_single_message(self, msg: Msg) -> Tuple[int, str]:
+    def execute_read_query(
+        self, query: str, params: Tuple = None, cached: bool = True
+    ) -> Tuple[int, str, List]:
+        """
+        Runs a read query against the main database on a pooled read-only connection.
+        The result is cached until the next write to the database; pass `cached=False`
+        for queries whose result changes without writes, e.g. ones using `date('now')`.
+
+        Returns:
+            Tuple[int, str, List]: A tuple containing a status code, a message and the fetched rows.
+        """
+        if self.cache is None or not cached:
+            return self.conn.execute_read_query(query, params)
+
+        def run() -> List:
+            status_code, status_message, rows = self.conn.execute_read_query(
+                query, params
+            )
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+            return rows
+
+        try:
+            return (
+                0,
+                "OK",
+                self.cache.execute(make_key("query", query, params), None, run),
+            )
+        except RuntimeError as e:
+            return 1, str(e), []
+
+    def get_messages(
+        self,
+        chat_id: int,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        include_archive: bool = False,
+    ) -> List[Msg]:
+        """
+        Returns the stored messages of a chat between the dates, ordered by message ID.
+        With `include_archive`, messages moved to the chat archive by retention rules are included.
+        Reactions are not loaded.
+        """
+        query = """
+            select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+            from {shard}.messages
+            where chat_id = ? and (? is null or msg_dt >= ?) and (? is null or msg_dt <= ?)
+        """
+
+        rows = self._read(
+            query,
+            (chat_id, start_date, start_date, end_date, end_date),
+            chat_id,
+            start_date,
+            end_date,
+        )
+
+        messages = [self._to_msg(row) for row in rows]
+
+        if include_archive:
+            messages += self.archive.get_messages(chat_id, start_date, end_date)
+
+        return sorted(messages, key=lambda msg: msg.msg_id)
+
+    def get_message(self, chat_id: int, msg_id: int) -> Optional[Msg]:
+        """
+        Returns a single stored message, or None if it is not stored. Reactions are not loaded.
+        """
+        query = """
+            select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+            from {shard}.messages
+            where chat_id = ? and msg_id = ?
+        """
+
+        def run() -> List:
+            # Shards are read through read-only connections, never the shard writers.
+            return self._read(query, (chat_id, msg_id), chat_id, cached=False)
+
+        if self.cache is None:
+            rows = run()
+        else:
+            rows = self.cache.execute(
+                make_key("message", chat_id, msg_id), chat_id, run
+            )
+
+        return self._to_msg(rows[0]) if rows else None
+
+    def get_stats(self, chat_id: int = None) -> List[Tuple]:
+        """
+        Returns per-chat totals: chat ID, messages, authors, reactions, first and last message date.
+        """
+        query = """
+            select m.chat_id, count(*), min(m.msg_dt), max(m.msg_dt),
+                (select count(*) from {shard}.reactions r where r.chat_id = m.chat_id)
+            from {shard}.messages m
+            where ? is null or m.chat_id = ?
+            group by m.chat_id
+        """
+
+        authors_query = """
+            select distinct chat_id, user_id from {shard}.messages
+            where ? is null or chat_id = ?
+        """
+
+        # Aggregates are computed per shard and combined here.
+        totals = {}
+
+        for row_chat_id, messages, first_dt, last_dt, reactions in self._read(
+            query, (chat_id, chat_id), chat_id
+        ):
+            total = totals.setdefault(row_chat_id, [0, set([]), 0, first_dt, last_dt])
+            total[0] += messages
+            total[2] += reactions
+            total[3] = min(total[3], first_dt)
+            total[4] = max(total[4], last_dt)
+
+        for row_chat_id, user_id in self._read(
+            authors_query, (chat_id, chat_id), chat_id
+        ):
+            totals[row_chat_id][1].add(user_id)
+
+        return [
+            (row_chat_id, messages, len(authors), reactions, first_dt, last_dt)
+            for row_chat_id, (
+                messages,
+                authors,
+                reactions,
+                first_dt,
+                last_dt,
+            ) in sorted(totals.items())
+        ]
+
+    def get_profiles(
+        self, max_age: Optional[float] = None
+    ) -> Dict[int, Tuple[str, str, str, datetime]]:
+        """
+        Returns the stored user profiles as (user name, first name, last name, fetch time) by
+        user ID, optionally only those fetched within the last `max_age` seconds.
+        """
+        return self.profiles.get_profiles(max_age)
+
+    def get_watermark(self, chat_id: int) -> int:
+        """
+        Returns the ID of the newest stored message of a chat, or 0 if the chat is empty.
+        """
+        query = "select max(msg_id) from {shard}.messages where chat_id = ?"
+
+        rows = self._read(query, (chat_id,), chat_id)
+
+        return max([row[0] or 0 for row in rows], default=0)
+
+    def get_chat_version(self, chat_id: int) -> int:
+        """
+        Returns the version of the stored data of a chat from the `chat_versions` table. Every
+        write of messages or reactions of the chat increases it, so results computed from them
+        can be cached under it. Reading it is a single primary key lookup.
+        """
+        status_code, status_message, rows = self.conn.execute_read_query(
+            "select version from chat_versions where chat_id = ?", (chat_id,)
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        return rows[0][0] if rows else 0
+
+    def iter_rows(
+        self,
+        query: str,
+        params: Tuple,
+        chat_id: int = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        chunk_size: int = 100000,
+    ) -> Iterator[List]:
+        """
+        Like `_read`, but yields the rows in lists of at most `chunk_size` rows instead of
+        fetching them all at once. With sharding enabled the shards are read one after another.
+        """
+        try:
+            if self.router is None:
+                with self.conn.reader() as conn:
+                    yield from conn.iter_read_query(
+                        query.format(shard="main"), params, chunk_size
+                    )
+
+                return
+
+            for shard in self.router.list_shards(chat_id, start_date, end_date):
+                conn = SQLiteConnector(
+                    f"file:{os.path.abspath(shard.path)}?mode=ro", uri=True
+                )
+                status_code, status_message = conn.connect()
+
+                if status_code != 0:
+                    raise RuntimeError(status_message)
+
+                try:
+                    yield from conn.iter_read_query(
+                        query.format(shard="main"), params, chunk_size
+                    )
+                finally:
+                    conn.close()
+        except sqlite3.Error as e:
+            raise RuntimeError(f'The error "{e}" occurred') from e
+
+    def replace_reactions(
+        self, chat_id: int, reactions: Dict[int, List[MsgReaction]]
+    ) -> Tuple[int, str]:
+        """
+        Replaces all stored reactions of messages with the given ones, in one transaction.
+
+        Args:
+            chat_id (int): The chat ID.
+            reactions (Dict[int, List[MsgReaction]]): The current reactions by message ID.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        targets = []
+        paths = []
+
+        for msg_id, msg_reactions in reactions.items():
+            if self.router is None:
+                conn = self.conn
+            else:
+                path = self.router.find_message_shard(chat_id, msg_id)
+
+                if path is None:
+                    # The message is not stored, so there is nothing to attach reactions to.
+                    continue
+
+                if self.router.is_sealed(path):
+                    logger.warning(
+                        f"Reactions of message {msg_id} of chat {chat_id} not saved, "
+                        f"shard `{path}` is sealed."
+                    )
+                    continue
+
+                paths.append(path)
+                conn = self.router.connection(path)
+
+            targets.append((conn, msg_id, msg_reactions))
+
+        if not targets:
+            return 0, "OK"
+
+        try:
+            with self._transaction(paths):
+                for conn, msg_id, msg_reactions in targets:
+                    status_code, status_message = self._replace_message_reactions(
+                        chat_id, msg_id, msg_reactions, conn
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                status_code, status_message = bump_chat_versions(self.conn, [chat_id])
+
+                if status_code != 0:
+                    raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        return 0, "OK"
+
+    def delete_messages(self, chat_id: int, msg_ids: List[int]) -> Tuple[int, str]:
+        """
+        Deletes messages of a chat together with their reactions.
+        """
+        paths = []
+
+        if self.router is None:
+            connections = [self.conn]
+        else:
+            for shard in self.router.list_shards(chat_id):
+                if not shard.read_only:
+                    paths.append(shard.path)
+                elif self.router.count_messages(shard.path, chat_id, msg_ids):
+                    logger.warning(
+                        f"Messages of chat {chat_id} not deleted from sealed shard `{shard.path}`."
+                    )
+
+            connections = [self.router.connection(path) for path in paths]
+
+        try:
+            with self._transaction(paths):
+                if self.text_stats.enabled:
+                    stored = self._stored_messages(chat_id, msg_ids)
+                    status_code, status_message = self.text_stats.update(
+                        [], list(stored.values())
+                    )
+
+                    if status_code != 0:
+                        logger.error(
+                            f"Error during text statistics update: {status_message}"
+                        )
+                        raise QueryError(status_message)
+
+                for conn in connections:
+                    for msg_id in msg_ids:
+                        for query in (
+                            "delete from reactions where chat_id = ? and msg_id = ?",
+                            "delete from messages where chat_id = ? and msg_id = ?",
+                        ):
+                            status_code, status_message = conn.execute_query(
+                                query, (chat_id, msg_id)
+                            )
+
+                            if status_code != 0:
+                                logger.error(
+                                    f"Error during message deletion: {status_message}"
+                                )
+                                raise QueryError(status_message)
+
+                status_code, status_message = bump_chat_versions(self.conn, [chat_id])
+
+                if status_code != 0:
+                    raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        return 0, "OK"
+
+    def _index_texts(self, messages: List[Msg]) -> Tuple[int, str]:
+        """
+        Updates the text statistics for a batch of messages about to be saved. Messages stored
+        before with a different text (edits, re-exports) have their old counts replaced.
+        """
+        latest = {}
+
+        for msg in messages:
+            latest[(msg.chat_id, msg.msg_id)] = msg
+
+        added = []
+        removed = []
+        chat_ids = set([chat_id for chat_id, _ in latest])
+
+        for chat_id in chat_ids:
+            msg_ids = [msg_id for c_id, msg_id in latest if c_id == chat_id]
+            stored = self._stored_messages(chat_id, msg_ids)
+
+            for msg_id in msg_ids:
+                msg = latest[(chat_id, msg_id)]
+                old = stored.get(msg_id)
+
+                if old is not None:
+                    if (old.msg_text, old.user_id, old.msg_dt) == (
+                        msg.msg_text,
+                        msg.user_id,
+                        msg.msg_dt,
+                    ):
+                        continue
+
+                    removed.append(old)
+
+                added.append(msg)
+
+        return self.text_stats.update(added, removed)
+
+    def _stored_messages(self, chat_id: int, msg_ids: List[int]) -> Dict[int, Msg]:
+        """Returns the stored versions of the given messages of a chat by message ID."""
+        stored = {}
+
+        # Stay below the limit of 999 bound parameters of older SQLite versions.
+        for i in range(0, len(msg_ids), 500):
+            chunk = tuple(msg_ids[i : i + 500])
+            placeholders = ", ".join(["?"] * len(chunk))
+            query = f"""
+                select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+                from {{shard}}.messages
+                where chat_id = ? and msg_id in ({placeholders})
+            """
+
+            # Only read while saving or deleting these messages, not worth caching.
+            for row in self._read(query, (chat_id,) + chunk, chat_id, cached=False):
+                msg = self._to_msg(row)
+                stored[msg.msg_id] = msg
+
+        return stored
+
+    def _activity(
+        self, messages: List[Msg]
+    ) -> Dict[Tuple[int, int], Tuple[datetime, datetime]]:
+        """Returns the first and last message or reaction time by (chat ID, user ID)."""
+        activity = {}
+
+        for msg in messages:
+            events = [(msg.user_id, msg.msg_dt)] + [
+                (mr.user_id, mr.dt) for mr in msg.reactions
+            ]
+
+            for user_id, dt in events:
+                key = (msg.chat_id, user_id)
+                first_seen, last_seen = activity.get(key, (dt, dt))
+                activity[key] = (min(first_seen, dt), max(last_seen, dt))
+
+        return activity
+
+    def _to_msg(self, row: Tuple) -> Msg:
+        """Builds a message from a `messages` row, decompressing its text."""
+        chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id = row
+
+        return Msg(
+            chat_id,
+            user_id,
+            msg_id,
+            self.compressor.decode(chat_id, msg_text),
+            datetime.fromisoformat(msg_dt),
+            reply_to_msg_id,
+            [],
+        )
+
+    @contextmanager
+    def _transaction(self, paths: Iterable[str] = ()):
+        """
+        Opens one transaction on the main database and one on each of the given shards.
+        The shards commit first and the main database last, so the chat versions bumped there
+        become visible only after the data. Everything is rolled back if the block raises.
+        """
+        with ExitStack() as stack:
+            stack.enter_context(self.conn.transaction())
+
+            for path in sorted(set(paths)):
+                stack.enter_context(self.router.connection(path).transaction())
+
+            yield
+
+    def _writable(self, msg: Msg) -> bool:
+        """Checks that the shard of the message is not sealed, logging skipped messages."""
+        path = self.router.shard_path(msg.chat_id, msg.msg_dt)
+
+        if self.router.is_sealed(path):
+            logger.warning(
+                f"Message {msg.msg_id} of chat {msg.chat_id} not saved, shard `{path}` is sealed."
+            )
+            return False
+
+        return True
+
+    def _message_conn(self, msg: Msg) -> SQLiteConnector:
+        """Returns the connection to the database or shard the message belongs to."""
+        if self.router is None:
+            return self.conn
+
+        return self.router.connection(self.router.shard_path(msg.chat_id, msg.msg_dt))
+
+    def _read(
+        self,
+        query: str,
+        params: Tuple,
+        chat_id: int = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        cached: bool = True,
+    ) -> List:
+        """
+        Runs a read query against the message tables, referred to as `{shard}.messages`
+        and `{shard}.reactions`. With sharding enabled the query runs against every shard
+        that can hold the chat and date range and the rows are concatenated.
+        Results are cached per chat, or until any write if `chat_id` is None.
+        """
+
+        def run() -> List:
+            if self.router is None:
+                status_code, status_message, result = self.conn.execute_read_query(
+                    query.format(shard="main"), params
+                )
+            else:
+                status_code, status_message, result = self.router.query(
+                    query, params, chat_id, start_date, end_date
+                )
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+            return result
+
+        if self.cache is None or not cached:
+            return run()
+
+        key = make_key("read", query, params, start_date, end_date)
+
+        return self.cache.execute(key, chat_id, run)
+
+    def _save_single_message(self, msg: Msg, conn: SQLiteConnector) -> Tuple[int, str]:
         query = """
             insert or replace into messages (chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id)
             values(?, ?, ?, ?, ?, ?)
@@ -60,16 +695,44 @@ class MsgController:
             msg.chat_id,
             msg.user_id,
             msg.msg_id,
-            msg.msg_text,
+            self.compressor.encode(msg.chat_id, msg.msg_text),
             msg.msg_dt,
             msg.reply_to_msg_id,
         )
 
-        status_code, status_message = self.conn.execute_query(query, params)
+        status_code, status_message = conn.execute_query(query, params)
 
         return status_code, status_message
 
-    def _save_single_reaction(self, mr: MsgReaction) -> Tuple[int, str]:
+    def _replace_message_reactions(
+        self,
+        chat_id: int,
+        msg_id: int,
+        reactions: List[MsgReaction],
+        conn: SQLiteConnector,
+    ) -> Tuple[int, str]:
+        """Replaces the stored reactions of a message. Must run inside a transaction."""
+        status_code, status_message = conn.execute_query(
+            "delete from reactions where chat_id = ? and msg_id = ?", (chat_id, msg_id)
+        )
+
+        if status_code != 0:
+            logger.error(f"Error during reaction deletion: {status_message}")
+            return status_code, status_message
+
+        for reaction in reactions:
+            status_code, status_message = self._save_single_reaction(reaction, conn)
+
+            if status_code != 0:
+                logger.error(f"Error during reaction saving: {status_message}")
+                logger.error(f"Reaction data: {reaction}")
+                return status_code, status_message
+
+        return 0, "OK"
+
+    def _save_single_reaction(
+        self, mr: MsgReaction, conn: SQLiteConnector
+    ) -> Tuple[int, str]:
         query = """
             insert or replace into reactions (chat_id, msg_id, user_id, emoticon)
             values(?, ?, ?, ?)
@@ -82,24 +745,6 @@ class MsgController:
             mr.emoticon,
         )
 
-        status_code, status_message = self.conn.execute_query(query, params)
-
-        return status_code, status_message
-
-    def _save_single_user(self, u: User) -> Tuple[int, str]:
-        query = """
-            insert or replace into users (chat_id, user_id, user_name, first_name, last_name)
-            values(?, ?, ?, ?, ?)
-        """
-
-        params = (
-            u.chat_id,
-            u.user_id,
-            u.user_name,
-            u.first_name,
-            u.last_name,
-        )
-
-        status_code, status_message = self.conn.execute_query(query, params)
+        status_code, status_message = conn.execute_query(query, params)
 
         return status_code, status_message
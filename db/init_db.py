@@ -22,8 +22,6 @@ def create_database(drop_if_exists: bool = False) -> int:
              3 indicates an SQLite execution error,
              4 indicates a general execution error.
     """
-    result = 0
-
     db_path = db_params["db_file"]
     init_script = db_params["init_script"]
 
@@ -37,6 +35,25 @@ def create_database(drop_if_exists: bool = False) -> int:
             print(f"Database at {db_path} already exists. Operation terminated.")
             return 1
 
+    return init_schema(db_path, init_script)
+
+
+def init_schema(db_path: str, init_script: str) -> int:
+    """
+    Executes the initialization script against a SQLite database, creating the file if needed.
+
+    Args:
+        db_path (str): The path to the SQLite database file.
+        init_script (str): The path to the initialization script.
+
+    Returns:
+        int: Status code where 0 indicates success,
+             2 indicates an error occurred while reading the initialization script,
+             3 indicates an SQLite execution error,
+             4 indicates a general execution error.
+    """
+    result = 0
+
     # Attempt to read the initialization script
     try:
         with open(init_script, "r") as file:
@@ -46,9 +63,6 @@ def create_database(drop_if_exists: bool = False) -> int:
         logger.exception(f"An error occurred: {str(e)}")
         return 2
 
-    if result != 0:
-        return result
-
     # Attempt to connect to the SQLite database
     conn = sqlite3.connect(db_path)
 
@@ -85,11 +99,12 @@ if __name__ == "__main__":
         raise RuntimeError(
             "Incorrect usage. Please provide all required arguments.\n"
             "Usage: python init_db.py <drop_db_if_exists>\n"
+            "Consider `python -m src.cli init` instead.\n"
         )
 
     _, drop_db_if_exists = sys.argv
 
-    result = create_database(bool(drop_db_if_exists))
+    result = create_database(drop_db_if_exists.lower() in ("1", "true", "yes"))
 
     if result == 0:
         logger.info("The database was created successfully.")
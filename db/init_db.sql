@@ -1,13 +1,32 @@
--- create users table
-create table users (
-    chat_id integer not null default (0),
-    user_id integer not null default (0),
-	user_name text not null default (''),
-	first_name text not null default (''),
-	last_name text not null default (''),
-    primary key (chat_id, user_id)
+-- allow reclaiming free pages in small steps with `pragma incremental_vacuum`
+pragma auto_vacuum = incremental;
+
+-- create user profiles table, one row per user
+create table profiles (
+    user_id integer primary key,
+    user_name text not null default '',
+    first_name text not null default '',
+    last_name text not null default '',
+    updated_at timestamp not null default current_timestamp
 );
 
+-- create chat membership table with the first and last activity of a user in a chat
+create table chat_members (
+    chat_id integer not null,
+    user_id integer not null,
+    first_seen timestamp,
+    last_seen timestamp,
+    primary key (chat_id, user_id)
+) without rowid;
+
+create index chat_members_user_idx on chat_members (user_id);
+
+-- users of a chat with their profiles, as stored before profiles were shared between chats
+create view users as
+select m.chat_id, m.user_id, p.user_name, p.first_name, p.last_name
+from chat_members m
+join profiles p on p.user_id = m.user_id;
+
 -- create messages table
 create table messages (
     chat_id integer not null default 0,
@@ -17,7 +36,7 @@ create table messages (
     msg_dt timestamp not null default current_timestamp,
     reply_to_msg_id integer,
     primary key (chat_id, msg_id),
-    constraint messages_fk foreign key (chat_id, user_id) references users(chat_id, user_id)
+    constraint messages_fk foreign key (chat_id, user_id) references chat_members(chat_id, user_id)
 );
 
 -- create indexes for messages table
@@ -33,8 +52,40 @@ create table reactions (
     msg_id integer not null default 0,
     emoticon text not null default '',
     constraint reactions_fk1 foreign key (chat_id, msg_id) references messages(chat_id, msg_id)
-    constraint reactions_fk2 foreign key (chat_id, user_id) references users(chat_id, user_id)
+    constraint reactions_fk2 foreign key (chat_id, user_id) references chat_members(chat_id, user_id)
 );
 
--- create index for reactions table
+-- create indexes for reactions table
 create index reactions_comp_idx on reactions (chat_id, msg_id);
+create unique index reactions_uniq_idx on reactions (chat_id, msg_id, user_id, emoticon);
+
+-- create table of per-chat dictionaries for compressed message texts
+create table text_dicts (
+    chat_id integer not null,
+    dict_version integer not null,
+    dict_data blob not null,
+    created_at timestamp not null default current_timestamp,
+    primary key (chat_id, dict_version)
+);
+
+-- create tables of word and bigram statistics
+create table terms (
+    term_id integer primary key,
+    term text not null,
+    n integer not null
+);
+
+create table term_counts (
+    chat_id integer not null,
+    day text not null,
+    user_id integer not null,
+    term_id integer not null,
+    cnt integer not null,
+    primary key (chat_id, day, user_id, term_id)
+) without rowid;
+
+-- create table of per-chat data versions, bumped on every write to invalidate query caches
+create table chat_versions (
+    chat_id integer primary key,
+    version integer not null
+);
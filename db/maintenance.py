@@ -0,0 +1,382 @@
+from typing import Dict, List, Tuple
+from datetime import datetime
+import calendar
+import time
+from loguru import logger
+
+from db.archive import ArchiveStore
+from db.compression import TextCompressor
+from db.query_cache import bump_chat_versions
+from db.sqlite_connector import QueryError
+from src.models import Msg, MsgReaction
+
+# `pragma auto_vacuum` value of databases that support incremental vacuum.
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Maintenance:
+    """
+    Online maintenance of a database: each task works in small batches, every batch is its own
+    short transaction, so ingest running in another process only waits for a batch at a time.
+
+    Tasks:
+        dedupe_reactions      Removes duplicate reactions and adds the unique index that prevents them.
+        apply_retention       Moves messages older than N months of a chat into its archive file.
+        incremental_vacuum    Returns free pages to the file system in bounded time slices.
+        optimize              Refreshes the query planner statistics.
+
+    Tasks that change messages or reactions bump the versions of the affected chats, so query
+    caches of running processes drop their results.
+
+    Attributes:
+        conn (SQLiteConnector): Connection to the main database.
+        deadline (float): `time.monotonic()` value after which batched tasks stop.
+        batch_size (int): Number of rows per transaction.
+    """
+
+    def __init__(self, conn, time_budget: float, batch_size: int = 500):
+        self.conn = conn
+        self.deadline = time.monotonic() + time_budget
+        self.batch_size = batch_size
+
+    def time_left(self) -> bool:
+        return time.monotonic() < self.deadline
+
+    def dedupe_reactions(self, connections: List) -> Tuple[int, str]:
+        """
+        Deletes duplicate reactions, keeping the oldest row, and creates the unique index
+        that turns `insert or replace` of an existing reaction into an update.
+
+        Args:
+            connections (List): Connections to the databases holding reactions (main database or shards).
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        deleted = 0
+
+        for conn in connections:
+            while self.time_left():
+                status_code, status_message, rows = conn.execute_read_query(
+                    """
+                    select r.id, r.chat_id from reactions r
+                    where exists (
+                        select 1 from reactions d
+                        where d.chat_id = r.chat_id and d.msg_id = r.msg_id
+                            and d.user_id = r.user_id and d.emoticon = r.emoticon
+                            and d.id < r.id
+                    )
+                    limit ?
+                    """,
+                    (self.batch_size,),
+                )
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                if not rows:
+                    status_code, status_message = conn.execute_query("""
+                        create unique index if not exists reactions_uniq_idx
+                        on reactions (chat_id, msg_id, user_id, emoticon)
+                        """)
+
+                    if status_code != 0:
+                        return status_code, status_message
+
+                    break
+
+                placeholders = ", ".join(["?"] * len(rows))
+
+                # The chat versions change in the transaction of the main database, which
+                # commits after the one of a shard, so caches never keep pre-delete rows.
+                try:
+                    with self.conn.transaction(), conn.transaction():
+                        status_code, status_message = conn.execute_query(
+                            f"delete from reactions where id in ({placeholders})",
+                            tuple(row[0] for row in rows),
+                        )
+
+                        if status_code != 0:
+                            raise QueryError(status_message)
+
+                        status_code, status_message = bump_chat_versions(
+                            self.conn, [row[1] for row in rows]
+                        )
+
+                        if status_code != 0:
+                            raise QueryError(status_message)
+                except QueryError as e:
+                    return 1, str(e)
+
+                deleted += len(rows)
+
+        return 0, f"Deleted {deleted} duplicate reactions."
+
+    def apply_retention(
+        self,
+        connections: List,
+        compressor: TextCompressor,
+        archive: ArchiveStore,
+        rules: Dict[int, int],
+    ) -> Tuple[int, str]:
+        """
+        Moves messages older than the retention period of their chat, with their reactions,
+        into the chat archive. A batch is committed to the archive before it is deleted from
+        the live database, so an interrupted run never loses messages.
+
+        Args:
+            connections (List): Connections to the databases holding messages (main database or shards).
+            compressor (TextCompressor): The compressor of the main database.
+            archive (ArchiveStore): The archive to move the messages to.
+            rules (Dict[int, int]): Retention period in months by chat ID.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        moved = 0
+
+        for chat_id, months in rules.items():
+            cutoff = months_ago(months)
+
+            for conn in connections:
+                while self.time_left():
+                    status_code, status_message, rows = conn.execute_read_query(
+                        """
+                        select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+                        from messages
+                        where chat_id = ? and msg_dt < ?
+                        order by msg_dt
+                        limit ?
+                        """,
+                        (chat_id, cutoff, self.batch_size),
+                    )
+
+                    if status_code != 0:
+                        return status_code, status_message
+
+                    if not rows:
+                        break
+
+                    messages = [
+                        Msg(
+                            row_chat_id,
+                            user_id,
+                            msg_id,
+                            compressor.decode(row_chat_id, msg_text),
+                            datetime.fromisoformat(msg_dt),
+                            reply_to_msg_id,
+                            [],
+                        )
+                        for row_chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id in rows
+                    ]
+                    msg_ids = tuple(msg.msg_id for msg in messages)
+                    placeholders = ", ".join(["?"] * len(msg_ids))
+
+                    status_code, status_message, reaction_rows = (
+                        conn.execute_read_query(
+                            f"""
+                        select msg_id, user_id, emoticon from reactions
+                        where chat_id = ? and msg_id in ({placeholders})
+                        """,
+                            (chat_id,) + msg_ids,
+                        )
+                    )
+
+                    if status_code != 0:
+                        return status_code, status_message
+
+                    msg_dts = {msg.msg_id: msg.msg_dt for msg in messages}
+                    reactions = [
+                        MsgReaction(chat_id, msg_id, user_id, msg_dts[msg_id], emoticon)
+                        for msg_id, user_id, emoticon in reaction_rows
+                    ]
+
+                    status_code, status_message = archive.save(
+                        chat_id, messages, reactions
+                    )
+
+                    if status_code != 0:
+                        return status_code, status_message
+
+                    try:
+                        with self.conn.transaction(), conn.transaction():
+                            for table in ("reactions", "messages"):
+                                status_code, status_message = conn.execute_query(
+                                    f"delete from {table} where chat_id = ? and msg_id in ({placeholders})",
+                                    (chat_id,) + msg_ids,
+                                )
+
+                                if status_code != 0:
+                                    raise QueryError(status_message)
+
+                            status_code, status_message = bump_chat_versions(
+                                self.conn, [chat_id]
+                            )
+
+                            if status_code != 0:
+                                raise QueryError(status_message)
+                    except QueryError as e:
+                        return 1, str(e)
+
+                    moved += len(messages)
+
+        return 0, f"Archived {moved} messages."
+
+    def incremental_vacuum(self, pages_per_step: int = 256) -> Tuple[int, str]:
+        """
+        Returns free pages of the main database to the file system, a few at a time, until
+        there are none left or the time budget is spent.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        status_code, status_message, rows = self.conn.execute_read_query(
+            "pragma auto_vacuum"
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+        if rows[0][0] != AUTO_VACUUM_INCREMENTAL:
+            # Databases created before incremental vacuum was added; not an error of the run.
+            logger.warning(
+                "Incremental vacuum is not enabled for this database. "
+                "Run `maintenance --enable-incremental-vacuum` once (a blocking full VACUUM)."
+            )
+            return 0, "Skipped, incremental vacuum is not enabled."
+
+        freed = 0
+
+        while self.time_left():
+            status_code, status_message, rows = self.conn.execute_read_query(
+                "pragma freelist_count"
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+            if rows[0][0] == 0:
+                break
+
+            pages = min(pages_per_step, rows[0][0])
+
+            # The pragma frees one page per step, so it has to be fetched to the end.
+            status_code, status_message, _ = self.conn.execute_read_query(
+                f"pragma incremental_vacuum({pages})"
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+            freed += pages
+
+        return 0, f"Freed {freed} pages."
+
+    def enable_incremental_vacuum(self) -> Tuple[int, str]:
+        """
+        Switches the main database to incremental auto-vacuum. This needs one full VACUUM,
+        which blocks writers for its whole duration.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        for query in ("pragma auto_vacuum = incremental", "vacuum"):
+            status_code, status_message = self.conn.execute_query(query)
+
+            if status_code != 0:
+                return status_code, status_message
+
+        return 0, "Incremental vacuum enabled."
+
+    def optimize(self, connections: List, full: bool = False) -> Tuple[int, str]:
+        """
+        Refreshes the query planner statistics of the given databases, so that the composite
+        indexes are used. Tables without statistics are analyzed first: a bare `pragma optimize`
+        on a fresh connection only considers the tables that connection has queried, so tables
+        and indexes created later would never be analyzed. `full` runs a complete ANALYZE.
+
+        Sealed shards are analyzed when they are sealed, they cannot be written to afterwards.
+
+        Args:
+            connections (List): Connections to the main database and the writable shards.
+            full (bool, optional): Run a complete ANALYZE. Defaults to False.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        analyzed = 0
+
+        for conn in connections:
+            if full:
+                status_code, status_message = conn.execute_query("analyze")
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                continue
+
+            status_code, status_message, tables = self._tables_without_stats(conn)
+
+            if status_code != 0:
+                return status_code, status_message
+
+            # Sample at most this many index rows per table, so a large table stays quick.
+            queries = ["pragma analysis_limit = 1000"]
+            queries += [f'analyze "{table}"' for table, in tables]
+
+            for query in queries:
+                status_code, status_message, _ = conn.execute_read_query(query)
+
+                if status_code != 0:
+                    return status_code, status_message
+
+            # 0x10000 makes SQLite 3.46+ check all tables, not only the queried ones.
+            status_code, status_message, _ = conn.execute_read_query(
+                "pragma optimize = 0x10002"
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+            analyzed += len(tables)
+
+        return 0, f"Planner statistics updated, {analyzed} tables analyzed."
+
+    def _tables_without_stats(self, conn) -> Tuple[int, str, List[str]]:
+        status_code, status_message, rows = conn.execute_read_query(
+            "select name from sqlite_master where type = 'table' and name = 'sqlite_stat1'"
+        )
+
+        if status_code != 0:
+            return status_code, status_message, []
+
+        query = """
+            select name from sqlite_master
+            where type = 'table' and name not like 'sqlite_%'
+        """
+
+        if rows:
+            query += " and name not in (select tbl from sqlite_stat1)"
+
+        return conn.execute_read_query(query + " order by name")
+
+
+def months_ago(months: int, now: datetime = None) -> datetime:
+    """Returns the start of the day `months` calendar months before `now`."""
+    now = now or datetime.now()
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    month += 1
+    day = min(now.day, calendar.monthrange(year, month)[1])
+
+    return datetime(year, month, day)
+
+
+def log_result(task: str, result: Tuple[int, str]) -> int:
+    status_code, status_message = result
+
+    if status_code == 0:
+        logger.info(f"{task}: {status_message}")
+    else:
+        logger.error(f"{task}: {status_message}")
+
+    return status_code
@@ -0,0 +1,298 @@
+from typing import Callable, Dict, List, Tuple
+from contextlib import contextmanager
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from db.sqlite_connector import SQLiteConnector
+
+
+class ConnectionManager:
+    """
+    Manages one writer connection and a bounded pool of read-only connections to a SQLite database.
+
+    The database is switched to WAL mode, so readers never wait for the writer and each read
+    sees a consistent snapshot of the last committed data while ingest is writing. The writer
+    is shared between threads behind a lock. The manager exposes the same `execute_query` and
+    `execute_read_query` methods as `SQLiteConnector` and can be used in its place.
+
+    Attributes:
+        db_file (str): The path to the SQLite database file.
+        pool_size (int): The maximum number of read-only connections.
+        timeout (float): Seconds to wait for a free reader or a locked database.
+
+    Example of usage:
+        >>> manager = ConnectionManager("db/messages.db", pool_size=4)
+        >>> status_code, status_message = manager.connect()
+
+        >>> # Several queries against one snapshot
+        >>> with manager.reader() as conn:
+        ...     _, _, messages = conn.execute_read_query("select count(*) from messages")
+        ...     _, _, reactions = conn.execute_read_query("select count(*) from reactions")
+
+        >>> # From asyncio code
+        >>> status_code, status_message, rows = await manager.aexecute_read_query(query, params)
+
+        >>> manager.stats()
+        >>> manager.close()
+    """
+
+    def __init__(self, db_file: str, pool_size: int = 4, timeout: float = 30.0):
+        """
+        Initialize the ConnectionManager.
+
+        Args:
+            db_file (str): The path to the SQLite database file.
+            pool_size (int, optional): The maximum number of read-only connections. Defaults to 4.
+            timeout (float, optional): Seconds to wait for a free reader or a locked database.
+                                       Defaults to 30.0.
+        """
+        if pool_size < 1:
+            raise ValueError("Invalid pool size")
+
+        self.db_file = db_file
+        self.pool_size = pool_size
+        self.timeout = timeout
+
+        self.writer = None
+        self._write_lock = threading.RLock()
+
+        self._idle = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._readers: List[SQLiteConnector] = []
+
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "acquisitions": 0,
+            "waits": 0,
+            "timeouts": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "writes": 0,
+            "write_wait_time": 0.0,
+        }
+
+    def connect(self) -> Tuple[int, str]:
+        """
+        Open the writer connection and switch the database to WAL mode.
+        Readers are opened on demand.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        self.writer = SQLiteConnector(
+            self.db_file, check_same_thread=False, timeout=self.timeout
+        )
+        status_code, status_message = self.writer.connect()
+
+        if status_code != 0:
+            return status_code, status_message
+
+        status_code, status_message, _ = self.writer.execute_read_query(
+            "pragma journal_mode = wal"
+        )
+
+        return status_code, status_message
+
+    def close(self):
+        """Close the writer and all readers. Readers still borrowed are closed when returned."""
+        with self._pool_lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+            self._readers = []
+
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def execute_query(
+        self, query: str, params: Tuple = None, commit: bool = True
+    ) -> Tuple[int, str]:
+        """
+        Execute a modification query on the writer connection.
+        Inside `transaction()` the query is committed with the transaction.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        with self._locked_writer():
+            self._count("writes")
+
+            return self.writer.execute_query(query, params, commit)
+
+    def execute_read_query(
+        self, query: str, params: Tuple = None
+    ) -> Tuple[int, str, List]:
+        """
+        Execute a read query on a pooled read-only connection.
+
+        Returns:
+            Tuple[int, str, List]: A tuple containing a status code, a message and the fetched rows.
+        """
+        try:
+            with self.reader() as conn:
+                return conn.execute_read_query(query, params)
+        except (TimeoutError, RuntimeError) as e:
+            return 1, str(e), []
+        except sqlite3.Error as e:
+            return 1, f'The error "{e}" occurred', []
+
+    async def aexecute_query(self, query: str, params: Tuple = None) -> Tuple[int, str]:
+        """Asyncio version of `execute_query`, run in the default executor."""
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, self.execute_query, query, params)
+
+    async def aexecute_read_query(
+        self, query: str, params: Tuple = None
+    ) -> Tuple[int, str, List]:
+        """Asyncio version of `execute_read_query`, run in the default executor."""
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(None, self.execute_read_query, query, params)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group the writes made inside the block into one transaction.
+        The transaction is rolled back if the block raises.
+        """
+        with self._locked_writer():
+            with self.writer.transaction():
+                yield self
+
+    @property
+    def write_lock(self) -> threading.RLock:
+        """The lock held while the writer is in use. Holding it also serializes writes to other databases, e.g. shards."""
+        return self._write_lock
+
+    def on_commit(self, callback: Callable[[], None]):
+        """Runs `callback` once the current write transaction has been committed, see `SQLiteConnector.on_commit`."""
+        with self._locked_writer() as writer:
+            writer.on_commit(callback)
+
+    def on_rollback(self, callback: Callable[[], None]):
+        """Runs `callback` if the current write transaction is rolled back."""
+        with self._locked_writer() as writer:
+            writer.on_rollback(callback)
+
+    @contextmanager
+    def reader(self):
+        """
+        Borrow a read-only connection. All queries made inside the block see the same snapshot.
+
+        Raises:
+            TimeoutError: If no reader becomes free within `timeout` seconds.
+            RuntimeError: If a new reader cannot be opened.
+            sqlite3.Error: If the snapshot cannot be started.
+        """
+        conn = self._acquire()
+
+        try:
+            conn.connection.execute("begin")
+            yield conn
+        finally:
+            self._release(conn)
+
+    def stats(self) -> Dict:
+        """
+        Returns pool metrics: pool size, open/idle/busy readers, acquisition and wait counters.
+        """
+        with self._pool_lock:
+            created = len(self._readers)
+
+        idle = self._idle.qsize()
+
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        metrics.update(
+            {
+                "pool_size": self.pool_size,
+                "readers": created,
+                "idle": idle,
+                "in_use": created - idle,
+            }
+        )
+
+        return metrics
+
+    @contextmanager
+    def _locked_writer(self):
+        started = time.monotonic()
+
+        with self._write_lock:
+            self._count("write_wait_time", time.monotonic() - started)
+
+            yield self.writer
+
+    def _acquire(self) -> SQLiteConnector:
+        started = time.monotonic()
+        self._count("acquisitions")
+
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._pool_lock:
+            if len(self._readers) < self.pool_size:
+                conn = self._open_reader()
+                self._readers.append(conn)
+
+                return conn
+
+        self._count("waits")
+
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count("timeouts")
+            raise TimeoutError(
+                f"No free read connection within {self.timeout} seconds."
+            )
+
+        waited = time.monotonic() - started
+        self._count("wait_time", waited)
+
+        with self._metrics_lock:
+            self._metrics["max_wait_time"] = max(self._metrics["max_wait_time"], waited)
+
+        return conn
+
+    def _release(self, conn: SQLiteConnector):
+        if conn.connection.in_transaction:
+            conn.connection.rollback()
+
+        with self._pool_lock:
+            # Readers borrowed while the manager was closed are not pooled anymore.
+            if any(reader is conn for reader in self._readers):
+                self._idle.put(conn)
+                return
+
+        conn.close()
+
+    def _count(self, name: str, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def _open_reader(self) -> SQLiteConnector:
+        conn = SQLiteConnector(
+            f"file:{os.path.abspath(self.db_file)}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            timeout=self.timeout,
+        )
+        status_code, status_message = conn.connect()
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        return conn
@@ -0,0 +1,261 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+from loguru import logger
+
+from db.sqlite_connector import QueryError
+from src.models import User
+
+
+class ProfileStore:
+    """
+    User profiles stored once per user, and the chats each user is active in.
+
+    `profiles` holds one row per user with the last fetched name and its fetch time;
+    `chat_members` maps users to chats with the first and last time they were seen there.
+    The `users` view joins both into the former `(chat_id, user_id, ...)` table, so existing
+    read queries keep working.
+
+    Attributes:
+        conn: The main database connection (`ConnectionManager` or `SQLiteConnector`).
+    """
+
+    SCHEMA = (
+        """
+        create table if not exists profiles (
+            user_id integer primary key,
+            user_name text not null default '',
+            first_name text not null default '',
+            last_name text not null default '',
+            updated_at timestamp not null default current_timestamp
+        )
+        """,
+        """
+        create table if not exists chat_members (
+            chat_id integer not null,
+            user_id integer not null,
+            first_seen timestamp,
+            last_seen timestamp,
+            primary key (chat_id, user_id)
+        ) without rowid
+        """,
+        "create index if not exists chat_members_user_idx on chat_members (user_id)",
+    )
+
+    USERS_VIEW = """
+        create view if not exists users as
+        select m.chat_id, m.user_id, p.user_name, p.first_name, p.last_name
+        from chat_members m
+        join profiles p on p.user_id = m.user_id
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def migrate(self, router=None) -> Tuple[int, str]:
+        """
+        Moves the per-chat `users` table of databases created before profiles were added into
+        `profiles` and `chat_members`, and replaces it with the `users` view. First and last
+        activity are taken from the stored messages. Does nothing if there is no `users` table.
+
+        Args:
+            router (ShardRouter, optional): The shard router if sharding is enabled, the messages
+                                            are then read from the shards. Defaults to None.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        status_code, status_message, rows = self.conn.execute_read_query(
+            "select type from sqlite_master where name = 'users'"
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+        if not rows or rows[0][0] != "table":
+            return 0, "OK"
+
+        for query in self.SCHEMA:
+            status_code, status_message = self.conn.execute_query(query)
+
+            if status_code != 0:
+                return status_code, status_message
+
+        activity = {}
+
+        if router is not None:
+            # Aggregates are computed per shard and combined here.
+            status_code, status_message, rows = router.query("""
+                select chat_id, user_id, min(msg_dt), max(msg_dt) from {shard}.messages
+                group by chat_id, user_id
+                """)
+
+            if status_code != 0:
+                return status_code, status_message
+
+            for chat_id, user_id, first_seen, last_seen in rows:
+                current = activity.get((chat_id, user_id), (first_seen, last_seen))
+                activity[(chat_id, user_id)] = (
+                    min(current[0], first_seen),
+                    max(current[1], last_seen),
+                )
+
+        members_query = (
+            """
+            insert or ignore into chat_members (chat_id, user_id, first_seen, last_seen)
+            select u.chat_id, u.user_id, min(m.msg_dt), max(m.msg_dt)
+            from users u
+            left join messages m on m.chat_id = u.chat_id and m.user_id = u.user_id
+            group by u.chat_id, u.user_id
+            """
+            if router is None
+            else "insert or ignore into chat_members (chat_id, user_id) select chat_id, user_id from users"
+        )
+        queries = [
+            # A user may have been stored with a different name in every chat,
+            # the copy written last is kept.
+            (
+                """
+                insert or ignore into profiles (user_id, user_name, first_name, last_name)
+                select user_id, user_name, first_name, last_name from users
+                where rowid in (select max(rowid) from users group by user_id)
+                """,
+                None,
+            ),
+            (members_query, None),
+        ]
+        queries += [
+            (
+                "update chat_members set first_seen = ?, last_seen = ? where chat_id = ? and user_id = ?",
+                (first_seen, last_seen) + key,
+            )
+            for key, (first_seen, last_seen) in activity.items()
+        ]
+        queries += [("drop table users", None), (self.USERS_VIEW, None)]
+
+        try:
+            with self.conn.transaction():
+                for query, params in queries:
+                    status_code, status_message = self.conn.execute_query(query, params)
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        logger.info("Users moved to the profiles and chat_members tables.")
+
+        return 0, "OK"
+
+    def save(
+        self,
+        users: List[User],
+        activity: Dict[Tuple[int, int], Tuple[datetime, datetime]],
+    ) -> Tuple[int, str]:
+        """
+        Stores user profiles and chat memberships.
+
+        A profile is only replaced by a newer one: users reused from the database carry the
+        time their profile was fetched (`User.updated_at`) and leave the stored row as it is,
+        so it still expires after the client's `profile_ttl`. Memberships are stored for all users.
+
+        Args:
+            users (List[User]): Fetched users; a user listed for several chats is stored once.
+            activity (Dict[Tuple[int, int], Tuple[datetime, datetime]]): First and last activity
+                by (chat ID, user ID); stored activity is only ever widened.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        profiles = {user.user_id: user for user in users}
+        members = dict(activity)
+
+        for user in users:
+            members.setdefault((user.chat_id, user.user_id), (None, None))
+
+        now = datetime.now()
+
+        try:
+            with self.conn.transaction():
+                for user in profiles.values():
+                    status_code, status_message = self.conn.execute_query(
+                        """
+                        insert into profiles (user_id, user_name, first_name, last_name, updated_at)
+                        values (?, ?, ?, ?, ?)
+                        on conflict (user_id) do update set
+                            user_name = excluded.user_name,
+                            first_name = excluded.first_name,
+                            last_name = excluded.last_name,
+                            updated_at = excluded.updated_at
+                        where excluded.updated_at > profiles.updated_at
+                        """,
+                        (
+                            user.user_id,
+                            user.user_name,
+                            user.first_name,
+                            user.last_name,
+                            # Users unpickled from files written before `updated_at` was added lack it.
+                            getattr(user, "updated_at", None) or now,
+                        ),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                for (chat_id, user_id), (first_seen, last_seen) in members.items():
+                    status_code, status_message = self.conn.execute_query(
+                        """
+                        insert into chat_members (chat_id, user_id, first_seen, last_seen)
+                        values (?, ?, ?, ?)
+                        on conflict (chat_id, user_id) do update set
+                            first_seen = coalesce(
+                                min(first_seen, excluded.first_seen), first_seen, excluded.first_seen
+                            ),
+                            last_seen = coalesce(
+                                max(last_seen, excluded.last_seen), last_seen, excluded.last_seen
+                            )
+                        """,
+                        (chat_id, user_id, first_seen, last_seen),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        return 0, "OK"
+
+    def get_profiles(
+        self, max_age: Optional[float] = None
+    ) -> Dict[int, Tuple[str, str, str, datetime]]:
+        """
+        Returns the stored profiles as (user name, first name, last name, fetch time) by user ID.
+
+        Args:
+            max_age (float, optional): Only return profiles fetched within this many seconds.
+                                       Defaults to all profiles.
+        """
+        cutoff = (
+            None if max_age is None else datetime.now() - timedelta(seconds=max_age)
+        )
+
+        status_code, status_message, rows = self.conn.execute_read_query(
+            """
+            select user_id, user_name, first_name, last_name, updated_at from profiles
+            where ? is null or updated_at >= ?
+            """,
+            (cutoff, cutoff),
+        )
+
+        if status_code != 0:
+            logger.warning(f"Stored profiles could not be read: {status_message}")
+            return {}
+
+        return {
+            user_id: (
+                user_name,
+                first_name,
+                last_name,
+                datetime.fromisoformat(updated_at),
+            )
+            for user_id, user_name, first_name, last_name, updated_at in rows
+        }
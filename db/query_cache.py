@@ -0,0 +1,284 @@
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+from collections import OrderedDict
+import re
+import sys
+import threading
+
+from db.sqlite_connector import SQLiteConnector
+
+_QUERY_RE = re.compile(r"('(?:[^']|'')*')|\s+")
+
+
+class QueryCache:
+    """
+    Memory-bounded LRU cache of read query results, invalidated per chat.
+
+    Every write of chat data bumps the version of the chat in the `chat_versions` table in the
+    same transaction (`bump_chat_versions`). Before each lookup the cache checks
+    `pragma data_version` on its own connection, which changes whenever any connection, in this
+    process or another one, has committed to the database. Only then is `chat_versions` read,
+    and the results of the chats whose version moved are dropped. Results not tied to a chat
+    are dropped on every commit.
+
+    A result is stored only if no invalidation of its chat happened while the query ran
+    (generation counters), so a query that raced with an ingest never fills the cache with
+    data older than the commit.
+
+    Attributes:
+        db_file (str): The path to the SQLite database file.
+        max_bytes (int): Maximum estimated size of the cached results.
+        max_entry_bytes (int): Results larger than this are not cached.
+
+    Example of usage:
+        >>> cache = QueryCache("db/messages.db", max_bytes=64 * 2**20)
+        >>> rows = cache.execute(make_key(query, params), chat_id, lambda: run(query, params))
+        >>> cache.stats()
+    """
+
+    def __init__(
+        self, db_file: str, max_bytes: int, max_entry_bytes: Optional[int] = None
+    ):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = (
+            max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        )
+
+        self._lock = threading.Lock()
+        self._watcher: Optional[SQLiteConnector] = None
+        self._data_version = None
+        self._chat_versions: Dict[int, int] = {}
+
+        # key -> (chat_id, rows, size); chat_id None means the result may span all chats.
+        self._entries: "OrderedDict[Hashable, Tuple[Optional[int], List, int]]" = (
+            OrderedDict()
+        )
+        self._bytes = 0
+
+        # Bumped on invalidation; a result computed across a bump is not stored.
+        self._generation = 0
+        self._epoch = 0
+        self._chat_generations: Dict[int, int] = {}
+
+        self._metrics = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations": 0,
+            "discarded": 0,
+            "uncacheable": 0,
+        }
+
+    def connect(self) -> Tuple[int, str]:
+        """
+        Opens the connection that watches the database for commits.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        self._watcher = SQLiteConnector(self.db_file, check_same_thread=False)
+        status_code, status_message = self._watcher.connect()
+
+        if status_code != 0:
+            return status_code, status_message
+
+        return create_versions_table(self._watcher)
+
+    def close(self):
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def execute(
+        self, key: Hashable, chat_id: Optional[int], run: Callable[[], List]
+    ) -> List:
+        """
+        Returns the cached rows for `key`, or runs the query and caches its rows.
+
+        Args:
+            key (Hashable): Identifies the query and its parameters, see `make_key`.
+            chat_id (Optional[int]): The chat the rows belong to; None if they may belong to any chat.
+            run (Callable[[], List]): Runs the query and returns the rows, raising on errors.
+
+        Returns:
+            List: The rows. The list is a copy and may be modified by the caller.
+        """
+        with self._lock:
+            self._sync()
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._metrics["hits"] += 1
+
+                return list(entry[1])
+
+            self._metrics["misses"] += 1
+            generation = self._current_generation(chat_id)
+
+        rows = run()
+
+        with self._lock:
+            self._put(key, chat_id, generation, rows)
+
+        return list(rows)
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        """Drops the cached results of a chat, or all results if `chat_id` is None."""
+        with self._lock:
+            self._invalidate(chat_id)
+
+    def stats(self) -> Dict:
+        """Returns hit, miss, eviction and invalidation counters and the size of the cache."""
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics.update(
+                {
+                    "entries": len(self._entries),
+                    "bytes": self._bytes,
+                    "max_bytes": self.max_bytes,
+                }
+            )
+
+        return metrics
+
+    def _sync(self):
+        """Invalidates the results of the chats changed by commits since the last check."""
+        status_code, status_message, rows = self._watcher.execute_read_query(
+            "pragma data_version"
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        if rows[0][0] == self._data_version:
+            return
+
+        status_code, status_message, versions = self._watcher.execute_read_query(
+            "select chat_id, version from chat_versions"
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        if self._data_version is not None:
+            self._generation += 1
+            self._drop(lambda chat_id: chat_id is None)
+
+            for chat_id, version in versions:
+                if self._chat_versions.get(chat_id) != version:
+                    self._invalidate(chat_id)
+
+        self._data_version = rows[0][0]
+        self._chat_versions = dict(versions)
+
+    def _invalidate(self, chat_id: Optional[int]):
+        self._metrics["invalidations"] += 1
+        self._generation += 1
+
+        if chat_id is None:
+            self._epoch += 1
+            self._chat_generations.clear()
+            self._drop(lambda _: True)
+        else:
+            self._chat_generations[chat_id] = self._chat_generations.get(chat_id, 0) + 1
+            self._drop(lambda entry_chat_id: entry_chat_id in (chat_id, None))
+
+    def _current_generation(self, chat_id: Optional[int]) -> Tuple:
+        if chat_id is None:
+            return (self._generation,)
+
+        return (self._epoch, self._chat_generations.get(chat_id, 0))
+
+    def _put(
+        self, key: Hashable, chat_id: Optional[int], generation: Tuple, rows: List
+    ):
+        if generation != self._current_generation(chat_id):
+            # The chat was invalidated while the query ran, the rows may predate the commit.
+            self._metrics["discarded"] += 1
+            return
+
+        size = _estimate_size(rows)
+
+        if size > self.max_entry_bytes:
+            self._metrics["uncacheable"] += 1
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[2]
+
+        self._entries[key] = (chat_id, rows, size)
+        self._bytes += size
+
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self._metrics["evictions"] += 1
+
+    def _drop(self, predicate: Callable[[Optional[int]], bool]):
+        for key in [key for key, entry in self._entries.items() if predicate(entry[0])]:
+            self._bytes -= self._entries.pop(key)[2]
+
+
+def make_key(*parts) -> Tuple:
+    """
+    Builds a cache key from a query and its parameters. Whitespace outside string
+    literals is collapsed, so differently formatted copies of a query share results.
+    """
+    return tuple(
+        normalize_query(part) if isinstance(part, str) else _freeze(part)
+        for part in parts
+    )
+
+
+def normalize_query(query: str) -> str:
+    return _QUERY_RE.sub(lambda match: match.group(1) or " ", query).strip()
+
+
+def create_versions_table(conn) -> Tuple[int, str]:
+    """Creates the chat versions table in databases created before it was added."""
+    return conn.execute_query("""
+        create table if not exists chat_versions (
+            chat_id integer primary key,
+            version integer not null
+        )
+        """)
+
+
+def bump_chat_versions(conn, chat_ids: Iterable[int]) -> Tuple[int, str]:
+    """
+    Marks the data of the chats as changed for the query caches of all processes.
+    Call it in the transaction that writes the data.
+
+    Returns:
+        Tuple[int, str]: A tuple containing a status code and a message.
+    """
+    for chat_id in sorted(set(chat_ids)):
+        status_code, status_message = conn.execute_query(
+            """
+            insert into chat_versions (chat_id, version) values (?, 1)
+            on conflict (chat_id) do update set version = version + 1
+            """,
+            (chat_id,),
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+    return 0, "OK"
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+
+def _estimate_size(rows: List) -> int:
+    size = sys.getsizeof(rows)
+
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+    return size
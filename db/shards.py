@@ -0,0 +1,586 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import os
+import re
+import shutil
+import sqlite3
+import stat
+import threading
+from loguru import logger
+
+from db.init_db import init_schema
+from db.query_cache import bump_chat_versions
+from db.sqlite_connector import QueryError, SQLiteConnector
+
+
+class Shard:
+    """Describes a single shard file."""
+
+    def __init__(self, path: str, chat_id: Optional[int], month: Optional[str]):
+        """
+        Initializes a Shard instance.
+
+        Args:
+            path (str): The path to the shard file.
+            chat_id (Optional[int]): The chat stored in the shard, or None if the shard holds all chats.
+            month (Optional[str]): The month stored in the shard as `YYYY-MM`, or None if the shard holds all months.
+        """
+        self.path = path
+        self.chat_id = chat_id
+        self.month = month
+
+    @property
+    def read_only(self) -> bool:
+        """Whether the shard has been sealed, i.e. its file has no write permission bits."""
+        return not os.stat(self.path).st_mode & (
+            stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+        )
+
+    def overlaps(self, start_date: datetime = None, end_date: datetime = None) -> bool:
+        """Checks whether the shard may contain messages between the dates."""
+        if self.month is None:
+            return True
+
+        if start_date is not None and self.month < start_date.strftime("%Y-%m"):
+            return False
+
+        if end_date is not None and self.month > end_date.strftime("%Y-%m"):
+            return False
+
+        return True
+
+
+class ShardRouter:
+    """
+    Routes messages to SQLite shard files partitioned by chat and/or month.
+
+    Supported layouts:
+        chat        `<shard_dir>/chat_<chat_id>.db`
+        month       `<shard_dir>/<YYYY-MM>.db`
+        chat_month  `<shard_dir>/chat_<chat_id>/<YYYY-MM>.db`
+
+    Messages and their reactions are written to the shard of the message, users stay in the
+    main database. Shards are created on first write and use WAL mode; sealed shards are
+    switched back to a rollback journal and are not written to anymore. Reads attach the
+    shards that can hold the requested chat and date range and run the query against each
+    of them.
+
+    Example of usage:
+        >>> router = ShardRouter("db/shards", "chat_month", "db/init_db.sql")
+        >>> conn = router.connection(router.shard_path(chat_id, msg_dt))
+        >>> status_code, status_message, rows = router.query(
+        ...     "select msg_id, msg_text from {shard}.messages where chat_id = ?",
+        ...     (chat_id,),
+        ...     chat_id=chat_id,
+        ...     start_date=datetime(2024, 1, 1),
+        ... )
+    """
+
+    LAYOUTS = ("chat", "month", "chat_month")
+
+    # SQLite allows at most 10 attached databases per connection by default.
+    MAX_ATTACHED = 10
+
+    _CHAT_RE = re.compile(r"^chat_(-?\d+)$")
+    _CHAT_FILE_RE = re.compile(r"^chat_(-?\d+)\.db$")
+    _MONTH_FILE_RE = re.compile(r"^(\d{4}-\d{2})\.db$")
+
+    def __init__(
+        self,
+        shard_dir: str,
+        layout: str,
+        init_script: str,
+        lock: threading.RLock = None,
+    ):
+        """
+        Initializes a ShardRouter instance.
+
+        Args:
+            shard_dir (str): The directory of the shards.
+            layout (str): One of `chat`, `month` or `chat_month`.
+            init_script (str): The schema script used to create new shards.
+            lock (threading.RLock, optional): Guards the shard write connections, which may be
+                                              used from any thread. Pass the lock of the main
+                                              writer so that a batch holds one lock for all files.
+        """
+        if layout not in self.LAYOUTS:
+            raise ValueError(f"Invalid sharding layout: {layout}")
+
+        self.shard_dir = shard_dir
+        self.layout = layout
+        self.init_script = init_script
+        self.lock = lock if lock is not None else threading.RLock()
+        self.connections: Dict[str, SQLiteConnector] = {}
+
+    def shard_path(self, chat_id: int, dt: datetime) -> str:
+        """Returns the path of the shard for a message of the chat sent at `dt`."""
+        month = dt.strftime("%Y-%m")
+
+        if self.layout == "chat":
+            return os.path.join(self.shard_dir, f"chat_{chat_id}.db")
+
+        if self.layout == "month":
+            return os.path.join(self.shard_dir, f"{month}.db")
+
+        return os.path.join(self.shard_dir, f"chat_{chat_id}", f"{month}.db")
+
+    def connection(self, path: str) -> SQLiteConnector:
+        """
+        Returns a write connection to the shard, creating the shard if it does not exist.
+        The connection may be used from any thread while `lock` is held.
+        """
+        with self.lock:
+            conn = self.connections.get(path)
+
+            if conn is not None:
+                return conn
+
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                if init_schema(path, self.init_script) != 0:
+                    raise RuntimeError(f"Shard `{path}` could not be created.")
+
+                logger.info(f"Shard `{path}` created.")
+
+            conn = SQLiteConnector(path, check_same_thread=False)
+            status_code, status_message = conn.connect()
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+            status_code, status_message, _ = conn.execute_read_query(
+                "pragma journal_mode = wal"
+            )
+
+            if status_code != 0:
+                conn.close()
+                raise RuntimeError(status_message)
+
+            self.connections[path] = conn
+
+            return conn
+
+    def is_sealed(self, path: str) -> bool:
+        """Whether the shard exists and has been sealed, i.e. must not be written to."""
+        return os.path.exists(path) and Shard(path, None, None).read_only
+
+    def list_shards(
+        self,
+        chat_id: int = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+    ) -> List[Shard]:
+        """
+        Lists the existing shards that can hold messages of the chat between the dates.
+
+        Args:
+            chat_id (int, optional): The chat ID. Defaults to all chats.
+            start_date (datetime, optional): The start of the date range.
+            end_date (datetime, optional): The end of the date range.
+
+        Returns:
+            List[Shard]: The shards ordered by chat and month.
+        """
+        shards = []
+
+        if not os.path.isdir(self.shard_dir):
+            return shards
+
+        for name in sorted(os.listdir(self.shard_dir)):
+            path = os.path.join(self.shard_dir, name)
+
+            if self.layout == "chat":
+                match = self._CHAT_FILE_RE.match(name)
+
+                if match:
+                    shards.append(Shard(path, int(match.group(1)), None))
+
+            elif self.layout == "month":
+                match = self._MONTH_FILE_RE.match(name)
+
+                if match:
+                    shards.append(Shard(path, None, match.group(1)))
+
+            else:
+                match = self._CHAT_RE.match(name)
+
+                if match and os.path.isdir(path):
+                    for month_name in sorted(os.listdir(path)):
+                        month_match = self._MONTH_FILE_RE.match(month_name)
+
+                        if month_match:
+                            shards.append(
+                                Shard(
+                                    os.path.join(path, month_name),
+                                    int(match.group(1)),
+                                    month_match.group(1),
+                                )
+                            )
+
+        return [
+            shard
+            for shard in shards
+            if (chat_id is None or shard.chat_id is None or shard.chat_id == chat_id)
+            and shard.overlaps(start_date, end_date)
+        ]
+
+    def query(
+        self,
+        query: str,
+        params: Tuple = None,
+        chat_id: int = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+    ) -> Tuple[int, str, List]:
+        """
+        Runs a row-level read query against every shard that can hold the requested data.
+
+        The query refers to the shard schema as `{shard}`, e.g. `select * from {shard}.messages`.
+        Shards are attached read-only in groups and the per-shard results are concatenated,
+        so aggregates are computed per shard and have to be combined by the caller.
+
+        Returns:
+            Tuple[int, str, List]: A tuple containing a status code, a message and the fetched rows.
+        """
+        shards = self.list_shards(chat_id, start_date, end_date)
+        params = tuple(params or ())
+        rows = []
+
+        reader = SQLiteConnector("file::memory:", uri=True)
+        status_code, status_message = reader.connect()
+
+        if status_code != 0:
+            return status_code, status_message, []
+
+        try:
+            for i in range(0, len(shards), self.MAX_ATTACHED):
+                group = shards[i : i + self.MAX_ATTACHED]
+                aliases = [f"s{j}" for j in range(len(group))]
+
+                for alias, shard in zip(aliases, group):
+                    status_code, status_message = reader.execute_query(
+                        f"attach database ? as {alias}",
+                        (f"file:{os.path.abspath(shard.path)}?mode=ro",),
+                    )
+
+                    if status_code != 0:
+                        return status_code, status_message, []
+
+                union = " union all ".join(
+                    f"select * from ({query.format(shard=alias)})" for alias in aliases
+                )
+
+                status_code, status_message, result = reader.execute_read_query(
+                    union, params * len(aliases)
+                )
+
+                if status_code != 0:
+                    return status_code, status_message, []
+
+                rows.extend(result)
+
+                for alias in aliases:
+                    reader.execute_query(f"detach database {alias}")
+        finally:
+            reader.close()
+
+        return 0, "OK", rows
+
+    def find_message_shard(self, chat_id: int, msg_id: int) -> Optional[str]:
+        """Returns the path of the shard holding the message, or None if it is not stored."""
+        for shard in reversed(self.list_shards(chat_id)):
+            conn = SQLiteConnector(
+                f"file:{os.path.abspath(shard.path)}?mode=ro", uri=True
+            )
+
+            if conn.connect()[0] != 0:
+                continue
+
+            try:
+                status_code, _, result = conn.execute_read_query(
+                    "select 1 from messages where chat_id = ? and msg_id = ?",
+                    (chat_id, msg_id),
+                )
+            finally:
+                conn.close()
+
+            if status_code == 0 and result:
+                return shard.path
+
+        return None
+
+    def count_messages(self, path: str, chat_id: int, msg_ids: List[int]) -> int:
+        """Returns how many of the given messages of the chat the shard holds."""
+        conn = SQLiteConnector(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+
+        if conn.connect()[0] != 0:
+            return 0
+
+        count = 0
+
+        try:
+            # Stay below the limit of 999 bound parameters of older SQLite versions.
+            for i in range(0, len(msg_ids), 500):
+                chunk = tuple(msg_ids[i : i + 500])
+                placeholders = ", ".join(["?"] * len(chunk))
+                status_code, _, result = conn.execute_read_query(
+                    f"select count(*) from messages where chat_id = ? and msg_id in ({placeholders})",
+                    (chat_id,) + chunk,
+                )
+
+                if status_code == 0:
+                    count += result[0][0]
+        finally:
+            conn.close()
+
+        return count
+
+    def migrate(self, conn, batch_size: int = 1000) -> Tuple[int, str]:
+        """
+        Moves the messages and reactions stored in the main database, i.e. written before
+        sharding was enabled, into their shards.
+
+        Every batch is first committed to the shards and then deleted from the main database.
+        Rows are copied with `insert or replace`, so an interrupted run can simply be repeated.
+
+        Args:
+            conn: The main database connection (`ConnectionManager` or `SQLiteConnector`).
+            batch_size (int, optional): Number of messages per transaction. Defaults to 1000.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        moved = 0
+
+        while True:
+            status_code, status_message, rows = conn.execute_read_query(
+                """
+                select chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id
+                from messages order by chat_id, msg_id limit ?
+                """,
+                (batch_size,),
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+            if not rows:
+                break
+
+            # The batch holds a contiguous range of message IDs of every chat in it.
+            ranges: Dict[int, Tuple[int, int]] = {}
+            paths: Dict[Tuple[int, int], str] = {}
+
+            for chat_id, _, msg_id, _, msg_dt, _ in rows:
+                low, _ = ranges.get(chat_id, (msg_id, msg_id))
+                ranges[chat_id] = (low, msg_id)
+                paths[(chat_id, msg_id)] = self.shard_path(
+                    chat_id, datetime.fromisoformat(msg_dt)
+                )
+
+            for path in set(paths.values()):
+                if self.is_sealed(path):
+                    return (
+                        1,
+                        f"Shard `{path}` is sealed, messages cannot be moved into it.",
+                    )
+
+            reactions = []
+
+            for chat_id, (low, high) in ranges.items():
+                status_code, status_message, result = conn.execute_read_query(
+                    """
+                    select chat_id, msg_id, user_id, emoticon from reactions
+                    where chat_id = ? and msg_id between ? and ?
+                    """,
+                    (chat_id, low, high),
+                )
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                reactions.extend(result)
+
+            try:
+                for path in sorted(set(paths.values())):
+                    shard = self.connection(path)
+
+                    with self.lock, shard.transaction():
+                        for row in rows:
+                            if paths[(row[0], row[2])] != path:
+                                continue
+
+                            status_code, status_message = shard.execute_query(
+                                """
+                                insert or replace into messages
+                                (chat_id, user_id, msg_id, msg_text, msg_dt, reply_to_msg_id)
+                                values (?, ?, ?, ?, ?, ?)
+                                """,
+                                row,
+                            )
+
+                            if status_code != 0:
+                                raise QueryError(status_message)
+
+                        for reaction in reactions:
+                            # Reactions of messages that are not stored have nowhere to go.
+                            if paths.get((reaction[0], reaction[1])) != path:
+                                continue
+
+                            status_code, status_message = shard.execute_query(
+                                """
+                                insert or replace into reactions (chat_id, msg_id, user_id, emoticon)
+                                values (?, ?, ?, ?)
+                                """,
+                                reaction,
+                            )
+
+                            if status_code != 0:
+                                raise QueryError(status_message)
+
+                with conn.transaction():
+                    for chat_id, (low, high) in ranges.items():
+                        for query in (
+                            "delete from reactions where chat_id = ? and msg_id between ? and ?",
+                            "delete from messages where chat_id = ? and msg_id between ? and ?",
+                        ):
+                            status_code, status_message = conn.execute_query(
+                                query, (chat_id, low, high)
+                            )
+
+                            if status_code != 0:
+                                raise QueryError(status_message)
+
+                    status_code, status_message = bump_chat_versions(conn, ranges)
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+            except QueryError as e:
+                return 1, str(e)
+
+            moved += len(rows)
+            logger.info(f"Moved {moved} messages into the shards ...")
+
+        return 0, f"Moved {moved} messages from the main database into the shards."
+
+    def seal(self, shard: Shard) -> Tuple[int, str]:
+        """
+        Compacts and analyzes a shard that is no longer written to and makes it read-only.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        with self.lock:
+            conn = self.connections.pop(shard.path, None)
+
+            if conn is not None:
+                conn.close()
+
+        conn = SQLiteConnector(shard.path)
+        status_code, status_message = conn.connect()
+
+        if status_code != 0:
+            return status_code, status_message
+
+        try:
+            # The statistics cannot be refreshed once the shard is read-only.
+            status_code, status_message = conn.execute_query("vacuum")
+
+            if status_code == 0:
+                status_code, status_message = conn.execute_query("analyze")
+
+            if status_code == 0:
+                # A read-only file can only be opened in rollback journal mode without
+                # its `-wal` and `-shm` files.
+                status_code, status_message, _ = conn.execute_read_query(
+                    "pragma journal_mode = delete"
+                )
+        finally:
+            conn.close()
+
+        if status_code != 0:
+            return status_code, status_message
+
+        mode = os.stat(shard.path).st_mode
+        os.chmod(shard.path, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+        return 0, f"Shard `{shard.path}` sealed."
+
+    def analyze_sealed(self, shard: Shard) -> Tuple[int, str]:
+        """
+        Analyzes a sealed shard that has no planner statistics yet, e.g. one sealed before
+        `seal` analyzed them. The shard is made writable for the duration.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        try:
+            source = sqlite3.connect(f"file:{shard.path}?mode=ro", uri=True)
+
+            try:
+                has_stats = source.execute(
+                    "select 1 from sqlite_master where name = 'sqlite_stat1'"
+                ).fetchall()
+            finally:
+                source.close()
+        except sqlite3.Error as e:
+            return 1, f'The error "{e}" occurred while reading `{shard.path}`.'
+
+        if has_stats:
+            return 0, f"Shard `{shard.path}` already has statistics."
+
+        mode = os.stat(shard.path).st_mode
+        os.chmod(shard.path, mode | stat.S_IWUSR)
+        conn = SQLiteConnector(shard.path)
+
+        try:
+            status_code, status_message = conn.connect()
+
+            if status_code == 0:
+                status_code, status_message = conn.execute_query("analyze")
+        finally:
+            conn.close()
+            os.chmod(shard.path, mode)
+
+        if status_code != 0:
+            return status_code, status_message
+
+        return 0, f"Shard `{shard.path}` analyzed."
+
+    def backup(self, shard: Shard, backup_dir: str) -> Tuple[int, str]:
+        """
+        Copies a shard into `backup_dir`, keeping its path relative to the shard directory.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        target = os.path.join(backup_dir, os.path.relpath(shard.path, self.shard_dir))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        if shard.read_only:
+            # Sealed shards are not written to anymore, a plain copy is consistent.
+            shutil.copy2(shard.path, target)
+            return 0, f"Shard `{shard.path}` copied to `{target}`."
+
+        try:
+            source = sqlite3.connect(shard.path)
+            destination = sqlite3.connect(target)
+
+            with destination:
+                source.backup(destination)
+
+            source.close()
+            destination.close()
+        except sqlite3.Error as e:
+            return 1, f'The error "{e}" occurred during backup of `{shard.path}`.'
+
+        return 0, f"Shard `{shard.path}` backed up to `{target}`."
+
+    def close(self):
+        """Closes all shard connections."""
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+
+            self.connections = {}
@@ -1,8 +1,16 @@
-from typing import Tuple, List
+from typing import Callable, Iterator, Tuple, List
+from contextlib import contextmanager
 import sqlite3
 from sqlite3 import Error
 
 
+class QueryError(Exception):
+    """
+    A failed query inside `transaction()`. Raising it from the block rolls the transaction back;
+    callers catch it outside the block and return `(1, str(e))`.
+    """
+
+
 class SQLiteConnector:
     """
     A class to handle SQLite database connections and operations.
@@ -42,15 +50,31 @@ class SQLiteConnector:
         >>> db_connector.close()
     """
 
-    def __init__(self, db_file: str):
+    def __init__(
+        self,
+        db_file: str,
+        uri: bool = False,
+        check_same_thread: bool = True,
+        timeout: float = 5.0,
+    ):
         """
         Initialize the SQLiteConnector with the path to the database file.
 
         Args:
             db_file (str): The path to the SQLite database file.
+            uri (bool, optional): Whether `db_file` is a `file:` URI. Defaults to False.
+            check_same_thread (bool, optional): Whether only the creating thread may use the connection.
+                                                Defaults to True.
+            timeout (float, optional): Seconds to wait for a locked database. Defaults to 5.0.
         """
         self.db_file = db_file
+        self.uri = uri
+        self.check_same_thread = check_same_thread
+        self.timeout = timeout
         self.connection = None
+        self._tx_depth = 0
+        self._on_commit: List[Callable[[], None]] = []
+        self._on_rollback: List[Callable[[], None]] = []
 
     def connect(self) -> Tuple[int, str]:
         """
@@ -62,7 +86,12 @@ class SQLiteConnector:
                 (0, 'OK') if successful, (1, 'error message') if an error occurs.
         """
         try:
-            self.connection = sqlite3.connect(self.db_file)
+            self.connection = sqlite3.connect(
+                self.db_file,
+                uri=self.uri,
+                check_same_thread=self.check_same_thread,
+                timeout=self.timeout,
+            )
         except Error as e:
             return 1, f'Error "{e}" occurred during database connection.'
 
@@ -74,14 +103,19 @@ class SQLiteConnector:
         """
         if self.connection:
             self.connection.close()
+            self.connection = None
 
-    def execute_query(self, query: str, params: Tuple = None) -> Tuple[int, str]:
+    def execute_query(
+        self, query: str, params: Tuple = None, commit: bool = True
+    ) -> Tuple[int, str]:
         """
         Execute a modification query against the SQLite database.
 
         Args:
             query (str): The SQL query to execute.
             params (Tuple, optional): Parameters to bind to the SQL query.
+            commit (bool, optional): Whether to commit right away. Defaults to True.
+                                     Inside `transaction()` the query is committed with the transaction.
 
         Returns:
             Tuple[int, str]:
@@ -91,12 +125,61 @@ class SQLiteConnector:
         try:
             cursor = self.connection.cursor()
             cursor.execute(query, params or ())
-            self.connection.commit()
+
+            if commit and self._tx_depth == 0:
+                self.connection.commit()
         except Error as e:
             return 1, f'The error "{e}" occurred'
 
         return 0, "OK"
 
+    @contextmanager
+    def transaction(self):
+        """
+        Group the modification queries made inside the block into one transaction.
+        The transaction is rolled back if the block raises, e.g. `QueryError` for a failed
+        query; returning from the block commits it.
+        """
+        self._tx_depth += 1
+        committed = False
+
+        try:
+            yield self
+
+            if self._tx_depth == 1:
+                self.connection.commit()
+                committed = True
+        except BaseException:
+            if self._tx_depth == 1:
+                self.connection.rollback()
+
+            raise
+        finally:
+            self._tx_depth -= 1
+
+            if self._tx_depth == 0:
+                callbacks = self._on_commit if committed else self._on_rollback
+                self._on_commit = []
+                self._on_rollback = []
+
+                for callback in callbacks:
+                    callback()
+
+    def on_commit(self, callback: Callable[[], None]):
+        """
+        Runs `callback` once the current transaction has been committed, or right away outside
+        a transaction. Use it to update in-memory state that must match the stored data.
+        """
+        if self._tx_depth == 0:
+            callback()
+        else:
+            self._on_commit.append(callback)
+
+    def on_rollback(self, callback: Callable[[], None]):
+        """Runs `callback` if the current transaction is rolled back. Does nothing outside a transaction."""
+        if self._tx_depth > 0:
+            self._on_rollback.append(callback)
+
     def execute_read_query(
         self, query: str, params: Tuple = None
     ) -> Tuple[int, str, List]:
@@ -118,3 +201,28 @@ class SQLiteConnector:
             return 0, "OK", result
         except Error as e:
             return 1, f'The error "{e}" occurred', []
+
+    def iter_read_query(
+        self, query: str, params: Tuple = None, chunk_size: int = 10000
+    ) -> Iterator[List]:
+        """
+        Execute a read query and yield the results in lists of at most `chunk_size` rows,
+        so that large results are never held in memory at once.
+
+        Raises:
+            sqlite3.Error: If the query fails.
+        """
+        cursor = self.connection.cursor()
+
+        try:
+            cursor.execute(query, params or ())
+
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+
+                if not rows:
+                    break
+
+                yield rows
+        finally:
+            cursor.close()
@@ -0,0 +1,306 @@
+from typing import Dict, Iterable, List, Tuple
+from collections import Counter
+from datetime import datetime
+import hashlib
+import re
+import unicodedata
+
+from db.sqlite_connector import QueryError
+from src.models import Msg
+
+_URL_RE = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class TextStats:
+    """
+    Word and bigram frequency index per chat, user and day.
+
+    Messages are tokenized in batches while `MsgController` saves them, and the counts are
+    added to the `term_counts` table; edited and deleted messages have their old counts
+    subtracted. Terms are stored once in the `terms` table under a 64-bit hash, so the
+    counts table only holds integers.
+
+    Attributes:
+        conn: The main database connection (`ConnectionManager` or `SQLiteConnector`).
+        enabled (bool): Whether saved messages are indexed.
+        lowercase (bool): Whether tokens are lowercased.
+        min_token_len (int): Minimum length of a token.
+        skip_numbers (bool): Whether tokens made of digits only are skipped.
+        bigrams (bool): Whether pairs of neighbouring tokens are counted too.
+        stop_words (set): Normalized tokens that are skipped.
+    """
+
+    UNIGRAM = 1
+    BIGRAM = 2
+
+    SCHEMA = (
+        """
+        create table if not exists terms (
+            term_id integer primary key,
+            term text not null,
+            n integer not null
+        )
+        """,
+        """
+        create table if not exists term_counts (
+            chat_id integer not null,
+            day text not null,
+            user_id integer not null,
+            term_id integer not null,
+            cnt integer not null,
+            primary key (chat_id, day, user_id, term_id)
+        ) without rowid
+        """,
+    )
+
+    def __init__(self, conn, params: Dict):
+        self.conn = conn
+        self.enabled = params["enabled"]
+        self.lowercase = params["lowercase"]
+        self.min_token_len = params["min_token_len"]
+        self.skip_numbers = params["skip_numbers"]
+        self.bigrams = params["bigrams"]
+        self.stop_words = set(
+            self.normalize(word) for word in params["stop_words"].split()
+        )
+
+        self._known_terms = set([])
+
+        if self.enabled:
+            status_code, status_message = self.create_tables()
+
+            if status_code != 0:
+                raise RuntimeError(status_message)
+
+    def create_tables(self) -> Tuple[int, str]:
+        """Creates the statistics tables in databases created before they were added."""
+        for query in self.SCHEMA:
+            status_code, status_message = self.conn.execute_query(query)
+
+            if status_code != 0:
+                return status_code, status_message
+
+        return 0, "OK"
+
+    def normalize(self, text: str) -> str:
+        text = unicodedata.normalize("NFKC", text)
+
+        return text.lower() if self.lowercase else text
+
+    def tokenize(self, text: str) -> List[str]:
+        """Splits a message text into normalized tokens, skipping links, stop words and short tokens."""
+        tokens = _TOKEN_RE.findall(self.normalize(_URL_RE.sub(" ", text)))
+
+        return [
+            token
+            for token in tokens
+            if len(token) >= self.min_token_len
+            and token not in self.stop_words
+            and not (self.skip_numbers and token.isdigit())
+        ]
+
+    def terms(self, text: str) -> Counter:
+        """Returns the unigram and bigram counts of a text keyed by (term, n)."""
+        tokens = self.tokenize(text)
+        counts = Counter((token, self.UNIGRAM) for token in tokens)
+
+        if self.bigrams:
+            counts.update(
+                (f"{first} {second}", self.BIGRAM)
+                for first, second in zip(tokens, tokens[1:])
+            )
+
+        return counts
+
+    def update(self, added: Iterable[Msg], removed: Iterable[Msg]) -> Tuple[int, str]:
+        """
+        Adds the counts of `added` messages and subtracts the counts of `removed` ones.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        deltas = Counter()
+        terms = {}
+
+        for messages, sign in ((added, 1), (removed, -1)):
+            for msg in messages:
+                day = msg.msg_dt.strftime("%Y-%m-%d")
+
+                for (term, n), cnt in self.terms(msg.msg_text).items():
+                    term_id = term_hash(term)
+                    terms[term_id] = (term, n)
+                    deltas[(msg.chat_id, day, msg.user_id, term_id)] += sign * cnt
+
+        new_terms = []
+
+        try:
+            with self.conn.transaction():
+                for term_id, (term, n) in terms.items():
+                    if term_id in self._known_terms:
+                        continue
+
+                    status_code, status_message = self.conn.execute_query(
+                        "insert or ignore into terms (term_id, term, n) values (?, ?, ?)",
+                        (term_id, term, n),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                    new_terms.append(term_id)
+
+                # Terms of a rolled back batch are not stored and have to be inserted again.
+                self.conn.on_commit(lambda: self._known_terms.update(new_terms))
+
+                for (chat_id, day, user_id, term_id), cnt in deltas.items():
+                    if cnt == 0:
+                        continue
+
+                    status_code, status_message = self.conn.execute_query(
+                        """
+                        insert into term_counts (chat_id, day, user_id, term_id, cnt)
+                        values (?, ?, ?, ?, ?)
+                        on conflict (chat_id, day, user_id, term_id) do update set cnt = cnt + excluded.cnt
+                        """,
+                        (chat_id, day, user_id, term_id, cnt),
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+
+                # Only counts that were decreased can have dropped to zero.
+                for key, cnt in deltas.items():
+                    if cnt >= 0:
+                        continue
+
+                    status_code, status_message = self.conn.execute_query(
+                        """
+                        delete from term_counts
+                        where chat_id = ? and day = ? and user_id = ? and term_id = ? and cnt <= 0
+                        """,
+                        key,
+                    )
+
+                    if status_code != 0:
+                        raise QueryError(status_message)
+        except QueryError as e:
+            return 1, str(e)
+
+        return 0, "OK"
+
+    def clear(self, chat_id: int) -> Tuple[int, str]:
+        """Deletes the counts of a chat, e.g. before rebuilding them."""
+        return self.conn.execute_query(
+            "delete from term_counts where chat_id = ?", (chat_id,)
+        )
+
+    def top_terms(
+        self,
+        chat_id: int,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        n: int = UNIGRAM,
+        user_id: int = None,
+        limit: int = 20,
+    ) -> List[Tuple[str, int]]:
+        """
+        Returns the most frequent terms of a chat between the dates (inclusive).
+
+        Args:
+            chat_id (int): The chat ID.
+            start_date (datetime, optional): The first day. Defaults to the beginning.
+            end_date (datetime, optional): The last day. Defaults to the end.
+            n (int, optional): 1 for words, 2 for bigrams. Defaults to 1.
+            user_id (int, optional): Count only the messages of this user. Defaults to all users.
+            limit (int, optional): Number of terms to return. Defaults to 20.
+
+        Returns:
+            List[Tuple[str, int]]: Terms with their counts, most frequent first.
+        """
+        query = """
+            select t.term, sum(c.cnt) as total
+            from term_counts c
+            join terms t on t.term_id = c.term_id
+            where c.chat_id = ?
+                and (? is null or c.day >= ?)
+                and (? is null or c.day <= ?)
+                and (? is null or c.user_id = ?)
+                and t.n = ?
+            group by t.term
+            order by total desc, t.term
+            limit ?
+        """
+
+        start_day = _day(start_date)
+        end_day = _day(end_date)
+
+        status_code, status_message, rows = self.conn.execute_read_query(
+            query,
+            (
+                chat_id,
+                start_day,
+                start_day,
+                end_day,
+                end_day,
+                user_id,
+                user_id,
+                n,
+                limit,
+            ),
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        return rows
+
+    def term_trends(
+        self, chat_id: int, n: int = UNIGRAM, limit: int = 20
+    ) -> List[Tuple[str, int, int, int]]:
+        """
+        Compares the term counts of yesterday with the day before yesterday.
+
+        Returns:
+            List[Tuple[str, int, int, int]]: Term, count yesterday, count the day before and the
+                                             difference, largest growth first.
+        """
+        # src.utils pulls in tqdm, so it is only imported when trends are requested.
+        from src.utils import get_last_two_days
+
+        before_start, _, yesterday_start, _ = get_last_two_days()
+
+        query = """
+            select t.term,
+                sum(case when c.day = ? then c.cnt else 0 end) as yesterday,
+                sum(case when c.day = ? then c.cnt else 0 end) as before
+            from term_counts c
+            join terms t on t.term_id = c.term_id
+            where c.chat_id = ? and c.day in (?, ?) and t.n = ?
+            group by t.term
+            order by yesterday - before desc, yesterday desc, t.term
+            limit ?
+        """
+
+        yesterday = _day(yesterday_start)
+        before = _day(before_start)
+
+        status_code, status_message, rows = self.conn.execute_read_query(
+            query, (yesterday, before, chat_id, yesterday, before, n, limit)
+        )
+
+        if status_code != 0:
+            raise RuntimeError(status_message)
+
+        return [(term, y, b, y - b) for term, y, b in rows]
+
+
+def term_hash(term: str) -> int:
+    """Returns a stable signed 64-bit ID of a term."""
+    digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def _day(dt: datetime) -> str:
+    return dt.strftime("%Y-%m-%d") if dt is not None else None
@@ -6,7 +6,11 @@ export PYTHONPATH=$(pwd)
 DROP_DB_IF_EXISTS=True
 
 # Init database
-python db/init_db.py "$DROP_DB_IF_EXISTS"
+if [ "$DROP_DB_IF_EXISTS" = "True" ]; then
+    python -m src.cli init --drop
+else
+    python -m src.cli init || exit 1
+fi
 
 # Telegram parameters
 API_ID=""
@@ -22,5 +26,16 @@ SAVE_PICKLE=True
 MSG_PKL_FILE=""
 USR_PKL_FILE=""
 
-# export Telegram messages and store them in database
-python src/export.py "$API_ID" "$API_HASH" "$CHAT_ID" "$SESSION_NAME" "$SAVE_PICKLE" "$MSG_PKL_FILE" "$USR_PKL_FILE"
\ No newline at end of file
+if [ -n "$MSG_PKL_FILE" ] && [ -n "$USR_PKL_FILE" ]; then
+    # store already exported messages in database
+    python -m src.cli replay --messages "$MSG_PKL_FILE" --users "$USR_PKL_FILE"
+else
+    # export Telegram messages and store them in database
+    SAVE_PICKLE_FLAG=""
+    if [ "$SAVE_PICKLE" = "True" ]; then
+        SAVE_PICKLE_FLAG="--save-pickle"
+    fi
+
+    python -m src.cli export --api-id "$API_ID" --api-hash "$API_HASH" --chat-id "$CHAT_ID" \
+        --session-name "$SESSION_NAME" $SAVE_PICKLE_FLAG
+fi
@@ -0,0 +1,792 @@
+"""
+Command line interface of the exporter.
+
+Usage:
+    python -m src.cli [--config tgexport.ini] <command> [options]
+
+Commands:
+    init         Create the database.
+    export       Export a chat from Telegram and store it in the database.
+    tail         Follow a chat and store updates as they happen.
+    replay       Store messages and users from previously saved pickle files.
+    stats        Show per-chat totals of the database.
+    maintenance  Run database maintenance.
+    shards       List, seal or back up shards, or move unsharded messages into them.
+    compress     Compress (or restore) the message texts already stored.
+    text-stats   Show the most frequent words of a chat or rebuild its word index.
+    interactions Show who interacts with whom in a chat.
+    loadtest     Export a synthetic or recorded chat from a local Telegram stand-in with injected faults.
+
+Only the standard library is imported at module level. Heavy dependencies such as Telethon
+and tqdm are imported inside the commands that need them, so that database-only commands
+start fast.
+"""
+
+from typing import List, Optional, Tuple
+from datetime import datetime
+import argparse
+import configparser
+import os
+import sqlite3
+import sys
+
+DEFAULT_CONFIG_FILE = "tgexport.ini"
+
+
+def load_config(path: Optional[str]) -> configparser.ConfigParser:
+    """
+    Loads the config file and applies its `[db]`, `[live]`, `[compression]`, `[maintenance]`,
+    `[text_stats]`, `[interactions]` and `[query_cache]` sections to `config.py`.
+
+    Args:
+        path (Optional[str]): Path to the config file. If None, `tgexport.ini` is used when it exists.
+
+    Returns:
+        configparser.ConfigParser: The parsed config.
+    """
+    import config
+
+    parser = configparser.ConfigParser()
+
+    if path is None:
+        path = DEFAULT_CONFIG_FILE if os.path.exists(DEFAULT_CONFIG_FILE) else None
+    elif not os.path.exists(path):
+        raise FileNotFoundError(f"Config file `{path}` not found.")
+
+    if path is not None:
+        parser.read(path)
+
+    sections = (
+        ("db", config.db_params),
+        ("live", config.live_params),
+        ("compression", config.compression_params),
+        ("maintenance", config.maintenance_params),
+        ("text_stats", config.text_stats_params),
+        ("interactions", config.interaction_params),
+        ("query_cache", config.query_cache_params),
+    )
+
+    for section, params in sections:
+        if parser.has_section(section):
+            for key, value in parser.items(section):
+                default = params.get(key)
+                params[key] = (
+                    _cast(value, type(default)) if default is not None else value
+                )
+
+    return parser
+
+
+def _cast(value: str, value_type: type):
+    """Casts a config value to the type of its default."""
+    if value_type is bool:
+        return value.lower() in ("1", "true", "yes", "on")
+
+    if value_type is dict:
+        # Retention rules: `<chat_id>:<months>, <chat_id>:<months>`.
+        return dict(_retention_rule(item) for item in value.split(",") if item.strip())
+
+    return value_type(value)
+
+
+def _telegram_param(
+    args: argparse.Namespace, cfg: configparser.ConfigParser, name: str
+):
+    """Returns a Telegram parameter from the command line, falling back to the `[telegram]` section."""
+    value = getattr(args, name)
+
+    if value is None:
+        value = cfg.get("telegram", name, fallback=None)
+
+    if value is None or value == "":
+        raise ValueError(f"Missing Telegram parameter `{name}`.")
+
+    return value
+
+
+def _require_database():
+    """
+    Raises FileNotFoundError if the database has not been created yet. Opening a missing
+    database would create an empty file without tables, which `init` then refuses to replace.
+    """
+    import config
+
+    db_file = config.db_params["db_file"]
+
+    if not os.path.exists(db_file):
+        raise FileNotFoundError(
+            f"Database `{db_file}` not found. Create it with `init` first."
+        )
+
+
+def _make_client(args: argparse.Namespace, cfg: configparser.ConfigParser):
+    api_id = _telegram_param(args, cfg, "api_id")
+    api_hash = _telegram_param(args, cfg, "api_hash")
+    session_name = _telegram_param(args, cfg, "session_name")
+
+    from src.tg_client import TgClient
+
+    return TgClient(api_id, api_hash, session_name)
+
+
+def cmd_init(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    from db.init_db import create_database
+
+    return create_database(args.drop)
+
+
+def cmd_export(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import asyncio
+    from src.export import export, save
+
+    _require_database()
+
+    client = _make_client(args, cfg)
+
+    result, messages, users = asyncio.run(
+        export(
+            client=client,
+            chat_id=args.chat_id,
+            start_date=args.start_date,
+            end_date=args.end_date,
+            save_pkl=args.save_pickle,
+        )
+    )
+
+    if result != 0:
+        return result
+
+    status_code, _ = save(messages, users)
+
+    return status_code
+
+
+def cmd_tail(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import asyncio
+    import config
+    from src.export import tail
+
+    _require_database()
+
+    client = _make_client(args, cfg)
+
+    status_code, _ = asyncio.run(
+        tail(
+            client,
+            args.chat_id,
+            flush_interval=args.flush_interval or config.live_params["flush_interval"],
+            flush_size=args.flush_size or config.live_params["flush_size"],
+        )
+    )
+
+    return status_code
+
+
+def cmd_replay(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    from src.export import load_pickles, save
+
+    _require_database()
+
+    messages, users = load_pickles(args.messages, args.users)
+    status_code, _ = save(messages, users)
+
+    return status_code
+
+
+def cmd_stats(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    from db.controller import MsgController
+
+    _require_database()
+
+    controller = MsgController()
+
+    try:
+        rows = controller.get_stats(args.chat_id)
+    finally:
+        controller.close()
+
+    print(
+        f"{'chat_id':>16} {'messages':>10} {'authors':>8} {'reactions':>10}  first / last message"
+    )
+
+    for chat_id, messages, authors, reactions, first_dt, last_dt in rows:
+        print(
+            f"{chat_id:>16} {messages:>10} {authors:>8} {reactions:>10}  {first_dt} / {last_dt}"
+        )
+
+    return 0
+
+
+def cmd_maintenance(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import config
+    from db.archive import ArchiveStore
+    from db.compression import TextCompressor
+    from db.maintenance import Maintenance, log_result
+    from db.query_cache import create_versions_table
+    from db.shards import ShardRouter
+    from db.sqlite_connector import SQLiteConnector
+
+    _require_database()
+
+    params = config.maintenance_params
+    conn = SQLiteConnector(
+        config.db_params["db_file"], timeout=config.db_params["busy_timeout"]
+    )
+    status_code, status_message = conn.connect()
+
+    if status_code != 0:
+        print(status_message, file=sys.stderr)
+        return status_code
+
+    status_code, status_message = create_versions_table(conn)
+
+    if status_code != 0:
+        print(status_message, file=sys.stderr)
+        return status_code
+
+    router = None
+    connections = [conn]
+
+    if config.db_params["sharding"]:
+        router = ShardRouter(
+            config.db_params["shard_dir"],
+            config.db_params["sharding"],
+            config.db_params["init_script"],
+        )
+        connections = [
+            router.connection(shard.path)
+            for shard in router.list_shards()
+            if not shard.read_only
+        ]
+
+    maintenance = Maintenance(
+        conn,
+        args.time_budget or params["time_budget"],
+        params["batch_size"],
+    )
+    rules = dict(params["retention"])
+    rules.update(args.retention or [])
+    result = 0
+
+    try:
+        if args.enable_incremental_vacuum:
+            result |= log_result("vacuum", maintenance.enable_incremental_vacuum())
+
+        result |= log_result("reactions", maintenance.dedupe_reactions(connections))
+
+        if rules:
+            compressor = TextCompressor(conn, config.compression_params)
+            archive = ArchiveStore(
+                params["archive_dir"],
+                config.db_params["init_script"],
+                config.compression_params,
+            )
+
+            try:
+                result |= log_result(
+                    "retention",
+                    maintenance.apply_retention(
+                        connections, compressor, archive, rules
+                    ),
+                )
+            finally:
+                archive.close()
+
+        result |= log_result(
+            "vacuum", maintenance.incremental_vacuum(params["vacuum_pages"])
+        )
+        result |= log_result(
+            "optimize",
+            maintenance.optimize(
+                [conn] + [c for c in connections if c is not conn], full=args.analyze
+            ),
+        )
+
+        if router is not None:
+            for shard in router.list_shards():
+                if shard.read_only:
+                    result |= log_result("optimize", router.analyze_sealed(shard))
+    finally:
+        conn.close()
+
+        if router is not None:
+            router.close()
+
+    return result
+
+
+def _retention_rule(value: str) -> Tuple[int, int]:
+    chat_id, months = value.rsplit(":", 1)
+
+    return int(chat_id), int(months)
+
+
+def cmd_shards(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import config
+    from db.query_cache import create_versions_table
+    from db.shards import ShardRouter
+    from db.sqlite_connector import SQLiteConnector
+
+    if not config.db_params["sharding"]:
+        print("Sharding is not enabled.", file=sys.stderr)
+        return 1
+
+    router = ShardRouter(
+        config.db_params["shard_dir"],
+        config.db_params["sharding"],
+        config.db_params["init_script"],
+    )
+
+    result = 0
+
+    try:
+        if args.migrate:
+            _require_database()
+
+            conn = SQLiteConnector(
+                config.db_params["db_file"], timeout=config.db_params["busy_timeout"]
+            )
+            status_code, status_message = conn.connect()
+
+            if status_code == 0:
+                status_code, status_message = create_versions_table(conn)
+
+            if status_code == 0:
+                status_code, status_message = router.migrate(conn, args.batch_size)
+
+            conn.close()
+            print(status_message, file=sys.stderr if status_code else sys.stdout)
+
+            if status_code != 0:
+                return status_code
+
+        for shard in router.list_shards(args.chat_id):
+            status_code, status_message = 0, ""
+            actions = []
+
+            if args.seal_before and shard.month and shard.month < args.seal_before:
+                if not shard.read_only:
+                    status_code, status_message = router.seal(shard)
+                    actions.append("sealed")
+
+            if status_code == 0 and args.backup_dir:
+                status_code, status_message = router.backup(shard, args.backup_dir)
+                actions.append("backed up")
+
+            if status_code != 0:
+                print(status_message, file=sys.stderr)
+                result = status_code
+                continue
+
+            size = os.path.getsize(shard.path) // 1024
+            mode = "ro" if shard.read_only else "rw"
+            print(f"{shard.path}  {mode}  {size} KiB  {', '.join(actions)}")
+    finally:
+        router.close()
+
+    return result
+
+
+def cmd_compress(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    from db.controller import MsgController
+    from db.compression import migrate
+
+    _require_database()
+
+    controller = MsgController()
+
+    try:
+        if controller.router is None:
+            connections = [controller.conn]
+        else:
+            connections = [
+                controller.router.connection(shard.path)
+                for shard in controller.router.list_shards(args.chat_id)
+                if not shard.read_only
+            ]
+
+        status_code, status_message = migrate(
+            controller.compressor,
+            connections,
+            chat_id=args.chat_id,
+            decompress=args.decompress,
+            batch_size=args.batch_size,
+        )
+    finally:
+        controller.close()
+
+    print(status_message, file=sys.stderr if status_code else sys.stdout)
+
+    return status_code
+
+
+def cmd_text_stats(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    from db.controller import MsgController
+
+    _require_database()
+
+    controller = MsgController()
+    text_stats = controller.text_stats
+    n = text_stats.BIGRAM if args.bigrams else text_stats.UNIGRAM
+
+    try:
+        if args.rebuild:
+            status_code, status_message = text_stats.create_tables()
+
+            if status_code == 0:
+                status_code, status_message = text_stats.clear(args.chat_id)
+
+            if status_code == 0:
+                messages = controller.get_messages(args.chat_id)
+                status_code, status_message = text_stats.update(messages, [])
+
+            if status_code != 0:
+                print(status_message, file=sys.stderr)
+                return status_code
+
+            print(f"Indexed {len(messages)} messages.")
+
+        if args.trends:
+            print(f"{'term':<32} {'yesterday':>10} {'before':>10} {'delta':>8}")
+
+            for term, yesterday, before, delta in text_stats.term_trends(
+                args.chat_id, n, args.limit
+            ):
+                print(f"{term:<32} {yesterday:>10} {before:>10} {delta:>+8}")
+        else:
+            print(f"{'term':<32} {'count':>10}")
+
+            for term, count in text_stats.top_terms(
+                args.chat_id,
+                args.start_date,
+                args.end_date,
+                n,
+                args.user_id,
+                args.limit,
+            ):
+                print(f"{term:<32} {count:>10}")
+    finally:
+        controller.close()
+
+    return 0
+
+
+def cmd_interactions(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import config
+    from db.controller import MsgController
+    from src.interactions import InteractionAnalytics
+
+    _require_database()
+
+    controller = MsgController()
+
+    try:
+        analytics = InteractionAnalytics(controller, config.interaction_params)
+        graph = analytics.graph(args.chat_id, args.start_date, args.end_date)
+        degrees = graph.degrees()
+
+        print(f"Users: {len(graph.users)}, reciprocity: {graph.reciprocity():.3f}")
+
+        print(f"\n{'from':>16} {'to':>16} {'weight':>10}")
+
+        for source, target, weight in graph.top_pairs(args.limit, args.mutual):
+            print(f"{source:>16} {target:>16} {weight:>10g}")
+
+        print(f"\n{'user_id':>16} {'pagerank':>10} {'in':>8} {'out':>8}")
+
+        index = {user_id: i for i, user_id in enumerate(graph.users.tolist())}
+
+        for user_id, score in graph.top_users(graph.pagerank(), args.limit):
+            i = index[user_id]
+            print(
+                f"{user_id:>16} {score:>10.5f} "
+                f"{degrees['in_degree'][i]:>8} {degrees['out_degree'][i]:>8}"
+            )
+    finally:
+        controller.close()
+
+    return 0
+
+
+def cmd_loadtest(args: argparse.Namespace, cfg: configparser.ConfigParser) -> int:
+    import config
+    from src.fake_telegram import SCENARIOS, FakeChat
+    from src.loadtest import format_reports, run_scenario
+
+    if args.messages_file or args.users_file:
+        if not (args.messages_file and args.users_file):
+            raise ValueError("Both --messages-file and --users-file are required.")
+
+        chat = FakeChat.from_pickles(args.messages_file, args.users_file, args.chat_id)
+    else:
+        chat = FakeChat.synthetic(
+            args.chat_id or -1, args.messages, args.users, seed=args.seed
+        )
+
+    names = args.scenario or list(SCENARIOS)
+    params = dict(config.client_params)
+
+    if args.retry_delay is not None:
+        params["retry_delay"] = args.retry_delay
+
+    reports = [run_scenario(SCENARIOS[name], chat, params=params) for name in names]
+
+    print(format_reports(reports))
+
+    return max(report["status"] for report in reports)
+
+
+def _month(value: str) -> str:
+    return datetime.strptime(value, "%Y-%m").strftime("%Y-%m")
+
+
+def _date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def _add_telegram_args(parser: argparse.ArgumentParser):
+    group = parser.add_argument_group(
+        "telegram", "Defaults are read from the [telegram] section of the config file."
+    )
+    group.add_argument("--api-id", dest="api_id", type=int)
+    group.add_argument("--api-hash", dest="api_hash")
+    group.add_argument("--session-name", dest="session_name")
+    parser.add_argument("--chat-id", dest="chat_id", type=int, required=True)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="tgexport", description="Telegram group message exporter."
+    )
+    parser.add_argument(
+        "--config",
+        help=f"Path to an INI config file. Defaults to `{DEFAULT_CONFIG_FILE}` if it exists.",
+    )
+
+    commands = parser.add_subparsers(dest="command", metavar="command", required=True)
+
+    p = commands.add_parser("init", help="Create the database.")
+    p.add_argument(
+        "--drop", action="store_true", help="Drop the database if it already exists."
+    )
+    p.set_defaults(func=cmd_init)
+
+    p = commands.add_parser(
+        "export", help="Export a chat from Telegram and store it in the database."
+    )
+    _add_telegram_args(p)
+    p.add_argument(
+        "--start-date", dest="start_date", type=_date, help="ISO date or datetime."
+    )
+    p.add_argument(
+        "--end-date", dest="end_date", type=_date, help="ISO date or datetime."
+    )
+    p.add_argument(
+        "--save-pickle",
+        dest="save_pickle",
+        action="store_true",
+        help="Also save the data to pickle files.",
+    )
+    p.set_defaults(func=cmd_export)
+
+    p = commands.add_parser(
+        "tail", help="Follow a chat and store updates as they happen."
+    )
+    _add_telegram_args(p)
+    p.add_argument(
+        "--flush-interval",
+        dest="flush_interval",
+        type=float,
+        help="Maximum age of a batch in seconds.",
+    )
+    p.add_argument(
+        "--flush-size",
+        dest="flush_size",
+        type=int,
+        help="Maximum number of updates in a batch.",
+    )
+    p.set_defaults(func=cmd_tail)
+
+    p = commands.add_parser(
+        "replay", help="Store messages and users from pickle files."
+    )
+    p.add_argument("--messages", required=True, help="Path to the message pickle file.")
+    p.add_argument("--users", required=True, help="Path to the user pickle file.")
+    p.set_defaults(func=cmd_replay)
+
+    p = commands.add_parser("stats", help="Show per-chat totals of the database.")
+    p.add_argument("--chat-id", dest="chat_id", type=int)
+    p.set_defaults(func=cmd_stats)
+
+    p = commands.add_parser(
+        "maintenance",
+        help="Run online database maintenance in bounded time.",
+        description="Removes duplicate reactions, moves messages past their retention "
+        "period to archive files, reclaims free pages with incremental vacuum and "
+        "refreshes the planner statistics. Works in short transactions, so it can run "
+        "while ingest continues.",
+    )
+    p.add_argument(
+        "--time-budget",
+        dest="time_budget",
+        type=float,
+        help="Seconds to spend on batched tasks.",
+    )
+    p.add_argument(
+        "--retention",
+        action="append",
+        type=_retention_rule,
+        metavar="CHAT_ID:MONTHS",
+        help="Archive messages of the chat older than MONTHS months. May be repeated.",
+    )
+    p.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Run a full ANALYZE instead of `pragma optimize`.",
+    )
+    p.add_argument(
+        "--enable-incremental-vacuum",
+        dest="enable_incremental_vacuum",
+        action="store_true",
+        help="Switch an existing database to incremental vacuum (one blocking VACUUM).",
+    )
+    p.set_defaults(func=cmd_maintenance)
+
+    p = commands.add_parser(
+        "shards", help="List, seal or back up shards of a sharded database."
+    )
+    p.add_argument("--chat-id", dest="chat_id", type=int)
+    p.add_argument(
+        "--seal-before",
+        dest="seal_before",
+        type=_month,
+        help="Compact and make read-only the month shards before this month (YYYY-MM).",
+    )
+    p.add_argument(
+        "--backup-dir", dest="backup_dir", help="Copy the shards into this directory."
+    )
+    p.add_argument(
+        "--migrate",
+        action="store_true",
+        help="First move the messages stored in the main database before sharding was "
+        "enabled into the shards.",
+    )
+    p.add_argument("--batch-size", dest="batch_size", type=int, default=1000)
+    p.set_defaults(func=cmd_shards)
+
+    p = commands.add_parser(
+        "compress", help="Compress (or restore) the message texts already stored."
+    )
+    p.add_argument("--chat-id", dest="chat_id", type=int)
+    p.add_argument(
+        "--decompress", action="store_true", help="Store all texts uncompressed."
+    )
+    p.add_argument("--batch-size", dest="batch_size", type=int, default=1000)
+    p.set_defaults(func=cmd_compress)
+
+    p = commands.add_parser(
+        "text-stats",
+        help="Show the most frequent words of a chat or rebuild its word index.",
+        description="Reads the word and bigram counts kept per chat, user and day. "
+        "Counts are updated on ingest when [text_stats] enabled is set; "
+        "--rebuild indexes the messages already stored.",
+    )
+    p.add_argument("--chat-id", dest="chat_id", type=int, required=True)
+    p.add_argument(
+        "--start-date", dest="start_date", type=_date, help="ISO date, inclusive."
+    )
+    p.add_argument(
+        "--end-date", dest="end_date", type=_date, help="ISO date, inclusive."
+    )
+    p.add_argument("--user-id", dest="user_id", type=int)
+    p.add_argument("--bigrams", action="store_true", help="Show word pairs.")
+    p.add_argument(
+        "--trends",
+        action="store_true",
+        help="Compare yesterday with the day before yesterday.",
+    )
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Recount the stored messages of the chat first.",
+    )
+    p.set_defaults(func=cmd_text_stats)
+
+    p = commands.add_parser(
+        "interactions",
+        help="Show who interacts with whom in a chat.",
+        description="Builds the user interaction graph of a chat from replies and "
+        "reactions and shows the top pairs, reciprocity and the most central users.",
+    )
+    p.add_argument("--chat-id", dest="chat_id", type=int, required=True)
+    p.add_argument(
+        "--start-date", dest="start_date", type=_date, help="ISO date or datetime."
+    )
+    p.add_argument(
+        "--end-date", dest="end_date", type=_date, help="ISO date or datetime."
+    )
+    p.add_argument(
+        "--mutual",
+        action="store_true",
+        help="Count both directions of a pair together.",
+    )
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_interactions)
+
+    p = commands.add_parser(
+        "loadtest",
+        help="Export a chat from a local Telegram stand-in with injected faults.",
+        description="Runs export() through MsgController against a local stand-in of "
+        "Telegram for each scenario (latency, flood waits, disconnects, missing users, "
+        "deleted messages) and reports throughput, retries and completeness.",
+    )
+    p.add_argument(
+        "--scenario",
+        action="append",
+        choices=["ideal", "slow", "flood", "flaky", "hostile"],
+        help="Scenario to run. May be repeated. Defaults to all scenarios.",
+    )
+    p.add_argument("--chat-id", dest="chat_id", type=int)
+    p.add_argument(
+        "--messages", type=int, default=5000, help="Messages of the synthetic chat."
+    )
+    p.add_argument(
+        "--users", type=int, default=100, help="Users of the synthetic chat."
+    )
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument(
+        "--messages-file",
+        dest="messages_file",
+        help="Replay a recorded chat from a message pickle file.",
+    )
+    p.add_argument(
+        "--users-file", dest="users_file", help="User pickle file of the recorded chat."
+    )
+    p.add_argument(
+        "--retry-delay",
+        dest="retry_delay",
+        type=float,
+        help="Delay before the first reconnect in seconds.",
+    )
+    p.set_defaults(func=cmd_loadtest)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+
+    try:
+        cfg = load_config(args.config)
+        return args.func(args, cfg)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    except (RuntimeError, sqlite3.Error) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
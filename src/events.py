@@ -0,0 +1,370 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+import asyncio
+import time
+from loguru import logger
+
+from src.models import Msg, MsgReaction, User
+
+
+class ChatEvent:
+    """Represents a single live update for a chat."""
+
+    NEW = "new"
+    EDIT = "edit"
+    DELETE = "delete"
+    REACTIONS = "reactions"
+
+    KINDS = (NEW, EDIT, DELETE, REACTIONS)
+
+    def __init__(
+        self,
+        kind: str,
+        chat_id: int,
+        msg: Optional[Msg] = None,
+        msg_ids: Optional[List[int]] = None,
+        reactions: Optional[List[MsgReaction]] = None,
+    ):
+        """
+        Initializes a ChatEvent instance.
+
+        Args:
+            kind (str): One of `new`, `edit`, `delete` or `reactions`.
+            chat_id (int): The ID of the chat the event belongs to.
+            msg (Optional[Msg]): The new or edited message (`new` and `edit` events).
+            msg_ids (Optional[List[int]]): IDs of the affected messages (`delete` and `reactions` events).
+            reactions (Optional[List[MsgReaction]]): The current reactions of the message (`reactions` event).
+        """
+        self.kind = kind
+        self.chat_id = chat_id
+        self.msg = msg
+        self.msg_ids = msg_ids if msg_ids is not None else []
+        self.reactions = reactions if reactions is not None else []
+
+        self._validate()
+
+    def _validate(self):
+        """Validates the event data."""
+        if self.kind not in self.KINDS:
+            raise ValueError(f"Invalid event kind: {self.kind}")
+
+        if not isinstance(self.chat_id, int):
+            raise ValueError("Invalid chat Id")
+
+        if self.kind in (self.NEW, self.EDIT) and not isinstance(self.msg, Msg):
+            raise ValueError("Invalid message object")
+
+        if self.kind == self.REACTIONS and len(self.msg_ids) != 1:
+            raise ValueError("Reactions event must refer to exactly one message")
+
+
+class EventSource:
+    """
+    Base class for live event sources.
+
+    A source pushes `ChatEvent` objects into the queue passed to `start` and puts
+    `None` into it when the stream is over.
+    """
+
+    async def start(self, chat_id: int, queue: asyncio.Queue):
+        """Starts delivering events for the chat into the queue."""
+        raise NotImplementedError
+
+    async def stop(self):
+        """Stops delivering events."""
+        raise NotImplementedError
+
+
+class QueueEventSource(EventSource):
+    """
+    An event source fed by hand. Useful for tests and for replaying recorded updates.
+
+    Example of usage:
+        >>> source = QueueEventSource()
+        >>> source.push(ChatEvent(ChatEvent.DELETE, chat_id, msg_ids=[42]))
+        >>> source.close()
+        >>> await client.tail(controller, chat_id, source=source, catch_up=False)
+    """
+
+    def __init__(self, events: Iterable[ChatEvent] = ()):
+        self.queue = None
+        self._pending = list(events)
+        self._closed = False
+
+    async def start(self, chat_id: int, queue: asyncio.Queue):
+        self.queue = queue
+
+        for event in self._pending:
+            queue.put_nowait(event)
+
+        self._pending = []
+
+        if self._closed:
+            queue.put_nowait(None)
+
+    async def stop(self):
+        self.close()
+
+    def push(self, event: ChatEvent):
+        """Queues an event for delivery."""
+        if self.queue is None:
+            self._pending.append(event)
+        else:
+            self.queue.put_nowait(event)
+
+    def close(self):
+        """Ends the event stream."""
+        if self._closed:
+            return
+
+        self._closed = True
+
+        if self.queue is not None:
+            self.queue.put_nowait(None)
+
+
+class EventBatcher:
+    """
+    Collects live events and flushes them into `MsgController` in micro-batches.
+
+    Events are folded as they arrive, so that a message created, edited and deleted within
+    one batch costs a single `delete`. New and edited messages are saved together with their
+    reactions by one `save_data` call; reaction updates of other messages are replaced by one
+    `replace_reactions` call. A batch is flushed when it holds `flush_size` events or when
+    `flush_interval` seconds have passed since its first event.
+
+    A batch is cleared only once all of its writes have succeeded. If a write fails, the batch
+    is kept, further events are folded into it, and the flush is retried after `retry_delay`
+    seconds, doubled on every further failure, up to `max_retries` times. The writes are
+    idempotent, so repeating the ones that had already succeeded is harmless.
+
+    Attributes:
+        controller (MsgController): The controller used to store the data.
+        chat_id (int): The ID of the chat being tailed.
+        flush_interval (float): Maximum age of a batch in seconds.
+        flush_size (int): Maximum number of events in a batch.
+        resolve_users (Callable): Coroutine returning `User` objects for a set of user IDs.
+        max_retries (int): Number of times a failed flush is retried before the tail stops.
+        retry_delay (float): Delay before the first retry of a failed flush in seconds.
+    """
+
+    def __init__(
+        self,
+        controller,
+        chat_id: int,
+        flush_interval: float,
+        flush_size: int,
+        resolve_users: Callable[[int, Set[int]], Awaitable[List[User]]] = None,
+        max_retries: int = 5,
+        retry_delay: float = 1.0,
+    ):
+        self.controller = controller
+        self.chat_id = chat_id
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.resolve_users = resolve_users
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.known_users = set([])
+        self.flushes = 0
+        self.events = 0
+        self.failures = 0
+
+        self._reset()
+
+    def _reset(self):
+        self._upserts: Dict[int, Msg] = {}
+        self._reactions: Dict[int, List[MsgReaction]] = {}
+        self._deletes: Set[int] = set([])
+        self._size = 0
+        self._started = None
+        self._retry_at = None
+
+    def add(self, event: ChatEvent):
+        """Folds an event into the current batch."""
+        if self._started is None:
+            self._started = time.monotonic()
+
+        self._size += 1
+        self.events += 1
+
+        if event.kind in (ChatEvent.NEW, ChatEvent.EDIT):
+            msg = event.msg
+            self._deletes.discard(msg.msg_id)
+            self._upserts[msg.msg_id] = msg
+            # The reactions of the message are saved with it and supersede an earlier update.
+            self._reactions.pop(msg.msg_id, None)
+
+        elif event.kind == ChatEvent.DELETE:
+            for msg_id in event.msg_ids:
+                self._upserts.pop(msg_id, None)
+                self._reactions.pop(msg_id, None)
+                self._deletes.add(msg_id)
+
+        elif event.kind == ChatEvent.REACTIONS:
+            msg_id = event.msg_ids[0]
+
+            if msg_id not in self._deletes:
+                self._reactions[msg_id] = event.reactions
+
+    def is_due(self) -> bool:
+        """Checks whether the current batch should be flushed."""
+        if self._size == 0:
+            return False
+
+        if self._retry_at is not None:
+            return time.monotonic() >= self._retry_at
+
+        if self._size >= self.flush_size:
+            return True
+
+        return time.monotonic() - self._started >= self.flush_interval
+
+    def time_left(self) -> Optional[float]:
+        """Returns the number of seconds until the current batch is due, or None if it is empty."""
+        if self._started is None:
+            return None
+
+        if self._retry_at is not None:
+            return max(0.0, self._retry_at - time.monotonic())
+
+        return max(0.0, self.flush_interval - (time.monotonic() - self._started))
+
+    async def flush(self) -> Tuple[int, str]:
+        """
+        Writes the current batch to the database. The batch is cleared only if all writes
+        succeed, otherwise it is kept for the next attempt.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        if self._size == 0:
+            return 0, "OK"
+
+        messages = list(self._upserts.values())
+        reactions = self._reactions
+        deletes = self._deletes
+        size = self._size
+
+        user_ids = set([msg.user_id for msg in messages])
+
+        for msg in messages:
+            user_ids.update([r.user_id for r in msg.reactions])
+
+        for msg_reactions in reactions.values():
+            user_ids.update([r.user_id for r in msg_reactions])
+
+        users = []
+        new_user_ids = user_ids - self.known_users
+
+        if new_user_ids and self.resolve_users is not None:
+            users = await self.resolve_users(self.chat_id, new_user_ids)
+
+        status_code, status_message = self.controller.save_data(
+            messages, users, progress=False
+        )
+
+        if status_code != 0:
+            return status_code, status_message
+
+        self.known_users.update(new_user_ids)
+
+        if reactions:
+            status_code, status_message = self.controller.replace_reactions(
+                self.chat_id, reactions
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+        if deletes:
+            status_code, status_message = self.controller.delete_messages(
+                self.chat_id, sorted(deletes)
+            )
+
+            if status_code != 0:
+                return status_code, status_message
+
+        self._reset()
+        self.flushes += 1
+
+        logger.info(
+            f"Flushed {size} events: {len(messages)} upserts, "
+            f"{len(reactions)} reaction updates, {len(deletes)} deletes."
+        )
+
+        return 0, "OK"
+
+    async def run(self, queue: asyncio.Queue) -> Tuple[int, str]:
+        """
+        Consumes events from the queue until the source ends the stream.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        while True:
+            timeout = self.time_left()
+
+            try:
+                if timeout is None:
+                    event = await queue.get()
+                else:
+                    event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                event = False
+
+            if event is None:
+                break
+
+            if event:
+                if event.chat_id != self.chat_id:
+                    continue
+
+                self.add(event)
+
+            if self.is_due():
+                status_code, status_message = await self._flush_or_retry()
+
+                if status_code != 0:
+                    return status_code, status_message
+
+        while self._size:
+            if self._retry_at is not None:
+                await asyncio.sleep(max(0.0, self._retry_at - time.monotonic()))
+
+            status_code, status_message = await self._flush_or_retry()
+
+            if status_code != 0:
+                return status_code, status_message
+
+        return 0, f"Live tail finished: {self.events} events in {self.flushes} batches."
+
+    async def _flush_or_retry(self) -> Tuple[int, str]:
+        """
+        Flushes the batch. A failed flush keeps the batch and schedules a retry, until
+        `max_retries` retries have failed.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        status_code, status_message = await self.flush()
+
+        if status_code == 0:
+            self.failures = 0
+            return 0, "OK"
+
+        self.failures += 1
+
+        if self.failures > self.max_retries:
+            logger.error(f"Flush failed {self.failures} times, giving up.")
+            return status_code, status_message
+
+        delay = self.retry_delay * 2 ** (self.failures - 1)
+        self._retry_at = time.monotonic() + delay
+
+        logger.warning(
+            f"Flush failed: {status_message}. Batch of {self._size} events kept, "
+            f"retrying in {delay:.1f} s."
+        )
+
+        return 0, "OK"
@@ -1,21 +1,27 @@
-from typing import Tuple, List
+from typing import TYPE_CHECKING, Tuple, List
 from datetime import datetime
+import os
 import sys
 import asyncio
 import pickle
 from loguru import logger
 
-from src.tg_client import TgClient
-from src.models import Msg
+from src.models import Msg, User
 from db.controller import MsgController
+from config import db_params, live_params
+
+# Telethon is heavy to import, so TgClient is only loaded where a client is created.
+if TYPE_CHECKING:
+    from src.tg_client import TgClient
 
 
 async def export(
-    client: TgClient,
+    client: "TgClient",
     chat_id: int,
     start_date: datetime = None,
     end_date: datetime = None,
     save_pkl: bool = True,
+    db_file: str = None,
 ) -> Tuple[List[Msg]]:
     """
     Exports messages from a specified Telegram chat using the provided TgClient.
@@ -25,6 +31,8 @@ async def export(
         chat_id (int): The ID of the chat from which to export messages.
         start_date (datetime, optional): The start date for message export. Defaults to None.
         end_date (datetime, optional): The end date for message export. Defaults to None.
+        db_file (str, optional): The database whose stored user profiles are reused
+                                 instead of being fetched again. Defaults to `db_params["db_file"]`.
 
     Returns:
         Tuple[int, List[Msg]]:
@@ -39,6 +47,18 @@ async def export(
     users = []
 
     try:
+        # Profiles fetched by earlier runs are not fetched again until they expire. Opening
+        # the controller would create the database file, which `init` then refuses to overwrite.
+        db_file = db_file or db_params["db_file"]
+
+        if os.path.exists(db_file):
+            controller = MsgController(db_file)
+
+            try:
+                client.profiles.update(controller.get_profiles(client.profile_ttl))
+            finally:
+                controller.close()
+
         await client.connect()
 
         x, messages, users = await client.export_messages(
@@ -50,6 +70,7 @@ async def export(
         else:
             logger.error(f"Export finished with errors. Error code: {x}")
     except Exception as e:
+        x = 1
         logger.exception(f"Exception during `export_messages`: {e}")
     finally:
         await client.disconnect()
@@ -57,11 +78,99 @@ async def export(
     return x, messages, users
 
 
+def load_pickles(
+    msg_pickle_file: str, usr_pickle_file: str
+) -> Tuple[List[Msg], List[User]]:
+    """
+    Loads previously exported messages and users from pickle files.
+
+    Args:
+        msg_pickle_file (str): Path to the message pickle file.
+        usr_pickle_file (str): Path to the user pickle file.
+
+    Returns:
+        Tuple[List[Msg], List[User]]: The messages and the users.
+    """
+    with open(msg_pickle_file, "rb") as file:
+        messages = pickle.load(file)
+
+    with open(usr_pickle_file, "rb") as file:
+        users = pickle.load(file)
+
+    return messages, users
+
+
+def save(messages: List[Msg], users: List[User]) -> Tuple[int, str]:
+    """
+    Saves messages and users to the database.
+
+    Returns:
+        Tuple[int, str]: A tuple containing a status code and a message.
+    """
+    logger.info("Saving messages to the database ...")
+
+    controller = MsgController()
+
+    try:
+        status_code, status_message = controller.save_data(messages, users)
+    finally:
+        controller.close()
+
+    if status_code == 0:
+        logger.info(status_message)
+    else:
+        logger.error(status_message)
+
+    return status_code, status_message
+
+
+async def tail(
+    client: "TgClient",
+    chat_id: int,
+    flush_interval: float = live_params["flush_interval"],
+    flush_size: int = live_params["flush_size"],
+) -> Tuple[int, str]:
+    """
+    Follows a Telegram chat and stores new messages, edits, deletions and reactions as they happen.
+
+    Args:
+        client (TgClient): An instance of TgClient to interact with the Telegram API.
+        chat_id (int): The ID of the chat to follow.
+        flush_interval (float, optional): Maximum age of a batch of updates in seconds.
+        flush_size (int, optional): Maximum number of updates in a batch.
+
+    Returns:
+        Tuple[int, str]: A tuple containing a status code and a message.
+    """
+    logger.info("Live tail of Telegram messages started ...")
+
+    result = (1, "Live tail was not started")
+    controller = MsgController()
+
+    try:
+        status_code, status_message = await client.connect()
+
+        if status_code != 0:
+            return status_code, status_message
+
+        result = await client.tail(
+            controller, chat_id, flush_interval=flush_interval, flush_size=flush_size
+        )
+    except Exception as e:
+        logger.exception(f"Exception during `tail`: {e}")
+    finally:
+        await client.disconnect()
+        controller.close()
+
+    return result
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 8:
         raise RuntimeError(
             "Incorrect usage. Please provide all required arguments.\n"
             "Usage: python export.py <api_id> <api_hash> <chat_id> <session_name> <save_pickle> <msg_pickle_file> <usr_pickle_file>\n"
+            "Consider `python -m src.cli export` instead.\n"
         )
 
     (
@@ -78,27 +187,21 @@ if __name__ == "__main__":
     if msg_pickle_file and usr_pickle_file:
         ### use already exported messages/users
         result = 0
-
-        with open(msg_pickle_file, "rb") as file:
-            messages = pickle.load(file)
-
-        with open(usr_pickle_file, "rb") as file:
-            users = pickle.load(file)
+        messages, users = load_pickles(msg_pickle_file, usr_pickle_file)
     else:
         ### export messages
+        from src.tg_client import TgClient
+
         tg_client = TgClient(api_id, api_hash, session_name)
 
         result, messages, users = asyncio.run(
-            export(client=tg_client, chat_id=int(chat_id), save_pkl=bool(save_pickle))
+            export(
+                client=tg_client,
+                chat_id=int(chat_id),
+                save_pkl=save_pickle.lower() in ("1", "true", "yes"),
+            )
         )
 
     ## save messages
     if result == 0:
-        logger.info("Saving messages to the database ...")
-
-        controller = MsgController()
-
-        status_code, status_message = controller.save_data(messages, users)
-
-        if status_code == 0:
-            logger.info(status_message)
+        save(messages, users)
@@ -0,0 +1,536 @@
+"""
+Local stand-in for Telegram, used to test exports under controlled latency and faults.
+
+`FakeTelegram` serves one or more `FakeChat`s and is passed to `TgClient` as its session
+factory; every session it creates answers the `TelegramClient` calls used by `TgClient`
+with Telethon objects, after a delay drawn from the latency distribution of a `Scenario`,
+and injects the faults of the scenario: flood wait bursts, dropped connections, users
+whose entity cannot be resolved and deleted messages.
+
+Example of usage:
+    >>> chat = FakeChat.synthetic(chat_id=-100123, n_messages=10000, n_users=200)
+    >>> telegram = FakeTelegram([chat], SCENARIOS["flaky"])
+    >>> client = TgClient(0, "", "loadtest", session_factory=telegram)
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate
+import asyncio
+import pickle
+import random
+
+from telethon.errors import FloodWaitError
+from telethon.tl.types import (
+    MessagePeerReaction,
+    MessageReactions,
+    MessageReplyHeader,
+    PeerUser,
+    ReactionEmoji,
+    User as TlUser,
+)
+
+from src.models import Msg, User
+
+EMOTICONS = ("👍", "❤", "🔥", "😁", "🤔", "👎")
+
+
+class Scenario:
+    """
+    Latency and fault settings of a `FakeTelegram`.
+
+    Latency is given as a distribution name and its parameters, in seconds:
+        ("fixed", delay)
+        ("uniform", low, high)
+        ("exponential", mean)
+        ("lognormal", median, sigma)
+
+    Attributes:
+        name (str): The scenario name.
+        latency (Tuple): The latency distribution of a request.
+        flood_rate (float): Probability that a request starts a burst of flood wait errors.
+        flood_burst (int): Number of consecutive requests rejected in a burst.
+        flood_wait (int): Seconds to wait demanded by a flood wait error.
+        disconnect_rate (float): Probability that the connection drops during a request.
+        missing_user_ratio (float): Share of users whose entity cannot be resolved.
+        deleted_ratio (float): Share of messages deleted from the history.
+        seed (int): Seed of the random generator, so that runs are repeatable.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        latency: Tuple = ("fixed", 0.0),
+        flood_rate: float = 0.0,
+        flood_burst: int = 1,
+        flood_wait: int = 1,
+        disconnect_rate: float = 0.0,
+        missing_user_ratio: float = 0.0,
+        deleted_ratio: float = 0.0,
+        seed: int = 0,
+    ):
+        self.name = name
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.flood_burst = flood_burst
+        self.flood_wait = flood_wait
+        self.disconnect_rate = disconnect_rate
+        self.missing_user_ratio = missing_user_ratio
+        self.deleted_ratio = deleted_ratio
+        self.seed = seed
+
+    def delay(self, rng: random.Random) -> float:
+        """Draws the latency of a request."""
+        kind, *args = self.latency
+
+        if kind == "fixed":
+            return args[0]
+
+        if kind == "uniform":
+            return rng.uniform(args[0], args[1])
+
+        if kind == "exponential":
+            return rng.expovariate(1.0 / args[0]) if args[0] > 0 else 0.0
+
+        if kind == "lognormal":
+            median, sigma = args
+            return median * rng.lognormvariate(0.0, sigma)
+
+        raise ValueError(f"Unknown latency distribution: {kind}")
+
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario("ideal"),
+        Scenario("slow", latency=("lognormal", 0.05, 0.8)),
+        Scenario(
+            "flood",
+            latency=("uniform", 0.0, 0.01),
+            flood_rate=0.03,
+            flood_burst=3,
+            flood_wait=1,
+        ),
+        Scenario("flaky", latency=("exponential", 0.005), disconnect_rate=0.05),
+        Scenario(
+            "hostile",
+            latency=("lognormal", 0.01, 1.0),
+            flood_rate=0.02,
+            flood_burst=2,
+            flood_wait=1,
+            disconnect_rate=0.03,
+            missing_user_ratio=0.05,
+            deleted_ratio=0.05,
+        ),
+    )
+}
+
+
+class FakeMessage:
+    """The attributes of a Telethon message that `TgClient` reads."""
+
+    def __init__(
+        self,
+        id: int,
+        text: str,
+        date: datetime,
+        from_id: Optional[PeerUser],
+        reply_to: Optional[MessageReplyHeader] = None,
+        reactions: Optional[MessageReactions] = None,
+    ):
+        self.id = id
+        self.text = text
+        self.date = date
+        self.from_id = from_id
+        self.reply_to = reply_to
+        self.reactions = reactions
+
+
+class FakeChat:
+    """
+    The history and the members of a chat served by `FakeTelegram`.
+
+    Attributes:
+        chat_id (int): The chat ID.
+        messages (List[FakeMessage]): The messages ordered by ID.
+        users (Dict[int, TlUser]): The member entities by user ID.
+    """
+
+    def __init__(
+        self, chat_id: int, messages: List[FakeMessage], users: Dict[int, TlUser]
+    ):
+        self.chat_id = chat_id
+        self.messages = sorted(messages, key=lambda msg: msg.id)
+        self.users = users
+
+    @classmethod
+    def synthetic(
+        cls,
+        chat_id: int,
+        n_messages: int,
+        n_users: int,
+        start_date: datetime = datetime(2024, 1, 1, tzinfo=timezone.utc),
+        interval: timedelta = timedelta(minutes=1),
+        reply_ratio: float = 0.2,
+        reaction_ratio: float = 0.3,
+        service_ratio: float = 0.02,
+        seed: int = 0,
+    ) -> "FakeChat":
+        """
+        Generates a chat with a few very active users and many quiet ones.
+
+        Args:
+            chat_id (int): The chat ID.
+            n_messages (int): Number of messages.
+            n_users (int): Number of members.
+            start_date (datetime, optional): Date of the first message.
+            interval (timedelta, optional): Time between two messages.
+            reply_ratio (float, optional): Share of messages that reply to an earlier one.
+            reaction_ratio (float, optional): Share of messages that have reactions.
+            service_ratio (float, optional): Share of service messages without text.
+            seed (int, optional): Seed of the random generator.
+        """
+        rng = random.Random(seed)
+        user_ids = [1000 + i for i in range(n_users)]
+        cum_weights = list(accumulate(1.0 / (rank + 1) for rank in range(n_users)))
+        words = ["lorem", "ipsum", "dolor", "sit", "amet", "export", "chat", "data"]
+        messages = []
+
+        for msg_id in range(1, n_messages + 1):
+            date = start_date + interval * (msg_id - 1)
+            author = rng.choices(user_ids, cum_weights=cum_weights)[0]
+            reply_to = None
+            reactions = None
+
+            if rng.random() < service_ratio:
+                messages.append(FakeMessage(msg_id, "", date, PeerUser(author)))
+                continue
+
+            if msg_id > 1 and rng.random() < reply_ratio:
+                reply_to = MessageReplyHeader(
+                    reply_to_msg_id=rng.randint(max(1, msg_id - 50), msg_id - 1)
+                )
+
+            if rng.random() < reaction_ratio:
+                reactors = rng.sample(user_ids, min(n_users, rng.randint(1, 3)))
+                reactions = MessageReactions(
+                    results=[],
+                    recent_reactions=[
+                        MessagePeerReaction(
+                            peer_id=PeerUser(reactor),
+                            date=date,
+                            reaction=ReactionEmoji(rng.choice(EMOTICONS)),
+                        )
+                        for reactor in reactors
+                    ],
+                )
+
+            text = " ".join(rng.choices(words, k=rng.randint(1, 12)))
+            messages.append(
+                FakeMessage(msg_id, text, date, PeerUser(author), reply_to, reactions)
+            )
+
+        users = {
+            user_id: TlUser(
+                id=user_id,
+                username=f"user{user_id}",
+                first_name=f"First{user_id}",
+                last_name=f"Last{user_id}",
+            )
+            for user_id in user_ids
+        }
+
+        return cls(chat_id, messages, users)
+
+    @classmethod
+    def recorded(
+        cls, messages: List[Msg], users: List[User], chat_id: int = None
+    ) -> "FakeChat":
+        """Builds a chat from previously exported messages and users, e.g. loaded from pickle files."""
+        messages = [
+            msg for msg in messages if chat_id is None or msg.chat_id == chat_id
+        ]
+
+        if chat_id is None:
+            chat_id = messages[0].chat_id if messages else 0
+
+        fake_messages = [
+            FakeMessage(
+                msg.msg_id,
+                msg.msg_text,
+                msg.msg_dt.astimezone(timezone.utc),
+                PeerUser(msg.user_id),
+                (
+                    MessageReplyHeader(reply_to_msg_id=msg.reply_to_msg_id)
+                    if msg.reply_to_msg_id
+                    else None
+                ),
+                (
+                    MessageReactions(
+                        results=[],
+                        recent_reactions=[
+                            MessagePeerReaction(
+                                peer_id=PeerUser(mr.user_id),
+                                date=mr.dt.astimezone(timezone.utc),
+                                reaction=ReactionEmoji(mr.emoticon),
+                            )
+                            for mr in msg.reactions
+                        ],
+                    )
+                    if msg.reactions
+                    else None
+                ),
+            )
+            for msg in messages
+        ]
+
+        tl_users = {
+            user.user_id: TlUser(
+                id=user.user_id,
+                username=user.user_name,
+                first_name=user.first_name,
+                last_name=user.last_name,
+            )
+            for user in users
+            if user.chat_id == chat_id
+        }
+
+        return cls(chat_id, fake_messages, tl_users)
+
+    @classmethod
+    def from_pickles(
+        cls, msg_pickle_file: str, usr_pickle_file: str, chat_id: int = None
+    ) -> "FakeChat":
+        """Builds a chat from the pickle files saved by `export_messages`."""
+        with open(msg_pickle_file, "rb") as file:
+            messages = pickle.load(file)
+
+        with open(usr_pickle_file, "rb") as file:
+            users = pickle.load(file)
+
+        return cls.recorded(messages, users, chat_id)
+
+
+class FakeTelegram:
+    """
+    Serves chats to the sessions it creates. Pass an instance as `session_factory` of `TgClient`.
+
+    Deleted messages and unresolvable users are chosen once per instance, so every session
+    sees the same chat. `stats` counts the requests served and the faults injected.
+    """
+
+    def __init__(self, chats: List[FakeChat], scenario: Scenario):
+        self.chats = {chat.chat_id: chat for chat in chats}
+        self.scenario = scenario
+        self.rng = random.Random(scenario.seed)
+
+        self.deleted: Dict[int, Set[int]] = {}
+        self.missing_users: Set[int] = set([])
+
+        for chat in chats:
+            self.deleted[chat.chat_id] = set(
+                msg.id
+                for msg in chat.messages
+                if self.rng.random() < scenario.deleted_ratio
+            )
+            self.missing_users.update(
+                user_id
+                for user_id in chat.users
+                if self.rng.random() < scenario.missing_user_ratio
+            )
+
+        self._flood_left = 0
+
+        self.stats = {
+            "requests": 0,
+            "latency": 0.0,
+            "flood_waits": 0,
+            "disconnects": 0,
+            "connects": 0,
+        }
+
+    def __call__(self, session_name: str, api_id, api_hash) -> "FakeSession":
+        return FakeSession(self)
+
+    def history(self, chat_id: int) -> List[FakeMessage]:
+        """Returns the messages of a chat that are not deleted, ordered by ID."""
+        if chat_id not in self.chats:
+            raise ValueError(f"Cannot find any entity corresponding to {chat_id}")
+
+        deleted = self.deleted[chat_id]
+
+        return [msg for msg in self.chats[chat_id].messages if msg.id not in deleted]
+
+    def expected(self, chat_id: int) -> Dict[str, int]:
+        """
+        Returns the number of messages, reactions and users a complete export of the chat
+        stores: text messages that are not deleted, their reactions, and the resolvable users
+        among their authors and reactors.
+        """
+        messages = 0
+        reactions = 0
+        user_ids = set([])
+
+        for msg in self.history(chat_id):
+            if not msg.text:
+                continue
+
+            messages += 1
+            user_ids.add(msg.from_id.user_id)
+
+            if msg.reactions and msg.reactions.recent_reactions:
+                for reaction in msg.reactions.recent_reactions:
+                    reactions += 1
+                    user_ids.add(reaction.peer_id.user_id)
+
+        users = self.chats[chat_id].users
+
+        return {
+            "messages": messages,
+            "reactions": reactions,
+            "users": len(
+                [
+                    user_id
+                    for user_id in user_ids
+                    if user_id in users and user_id not in self.missing_users
+                ]
+            ),
+        }
+
+    async def serve(self, session: "FakeSession"):
+        """Delays a request and injects the faults of the scenario."""
+        if not session.connected:
+            raise ConnectionError("Cannot send requests while disconnected")
+
+        self.stats["requests"] += 1
+
+        delay = self.scenario.delay(self.rng)
+        self.stats["latency"] += delay
+
+        await asyncio.sleep(delay)
+
+        if self._flood_left == 0 and self.rng.random() < self.scenario.flood_rate:
+            self._flood_left = self.scenario.flood_burst
+
+        if self._flood_left > 0:
+            self._flood_left -= 1
+            self.stats["flood_waits"] += 1
+            raise FloodWaitError(request=None, capture=self.scenario.flood_wait)
+
+        if self.rng.random() < self.scenario.disconnect_rate:
+            # A dropped request, `TgClient` reconnects; `disconnected` stays pending.
+            self.stats["disconnects"] += 1
+            session.connected = False
+            raise ConnectionError("Connection to Telegram lost")
+
+
+class FakeSession:
+    """Implements the `TelegramClient` methods used by `TgClient` against a `FakeTelegram`."""
+
+    def __init__(self, telegram: FakeTelegram):
+        self.telegram = telegram
+        self.connected = False
+        self._handlers = []
+        self._disconnected = None
+
+    @property
+    def disconnected(self) -> asyncio.Future:
+        """Like `TelegramClient.disconnected`: resolved once the session is disconnected for good."""
+        if self._disconnected is None:
+            self._disconnected = asyncio.get_running_loop().create_future()
+
+            if not self.connected:
+                self._disconnected.set_result(None)
+
+        return self._disconnected
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    async def connect(self):
+        self.telegram.stats["connects"] += 1
+        self.connected = True
+
+        if self._disconnected is not None and self._disconnected.done():
+            self._disconnected = None
+
+    async def disconnect(self):
+        self.drop()
+
+    def drop(self):
+        """
+        Scripts a connection lost for good, e.g. a revoked session: resolves `disconnected`
+        like Telethon does once it gives up reconnecting.
+        """
+        self.connected = False
+
+        if self._disconnected is not None and not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def start(self):
+        pass
+
+    def add_event_handler(self, callback, event):
+        self._handlers.append((callback, event))
+
+    def remove_event_handler(self, callback, event):
+        if (callback, event) in self._handlers:
+            self._handlers.remove((callback, event))
+
+    async def get_messages(
+        self,
+        entity: int,
+        limit: int = None,
+        offset_date: datetime = None,
+        offset_id: int = 0,
+        min_id: int = 0,
+        max_id: int = 0,
+        reverse: bool = False,
+    ) -> List[FakeMessage]:
+        """
+        Returns messages like `TelegramClient.get_messages`: newest first, or oldest first
+        with `reverse`. `min_id` and `max_id` are exclusive bounds, `offset_id` and
+        `offset_date` are where the reading starts.
+        """
+        await self.telegram.serve(self)
+
+        if offset_date is not None and offset_date.tzinfo is None:
+            # Telethon reads naive dates as UTC.
+            offset_date = offset_date.replace(tzinfo=timezone.utc)
+
+        messages = [
+            msg
+            for msg in self.telegram.history(entity)
+            if msg.id > min_id
+            and (not max_id or msg.id < max_id)
+            and (
+                not offset_id or (msg.id > offset_id if reverse else msg.id < offset_id)
+            )
+            and (
+                offset_date is None
+                or (msg.date >= offset_date if reverse else msg.date < offset_date)
+            )
+        ]
+
+        if not reverse:
+            messages.reverse()
+
+        return messages if limit is None else messages[:limit]
+
+    async def get_entity(self, peer: PeerUser) -> TlUser:
+        await self.telegram.serve(self)
+
+        user = None
+
+        for chat in self.telegram.chats.values():
+            user = user or chat.users.get(peer.user_id)
+
+        if user is None or peer.user_id in self.telegram.missing_users:
+            raise ValueError(
+                f"Could not find the input entity for PeerUser(user_id={peer.user_id})"
+            )
+
+        return user
@@ -0,0 +1,122 @@
+from typing import Dict, List
+import asyncio
+import os
+import tempfile
+import time
+from loguru import logger
+
+from config import client_params, db_params
+from db.controller import MsgController
+from db.init_db import init_schema
+from src.export import export
+from src.fake_telegram import FakeChat, FakeTelegram, Scenario
+from src.tg_client import TgClient
+
+
+def run_scenario(
+    scenario: Scenario,
+    chat: FakeChat,
+    db_file: str = None,
+    params: Dict = client_params,
+) -> Dict:
+    """
+    Exports a chat from a `FakeTelegram` running the scenario and stores it through `MsgController`.
+
+    Args:
+        scenario (Scenario): Latency and faults of the stand-in.
+        chat (FakeChat): The chat to export.
+        db_file (str, optional): A new database file to store the chat in. Defaults to a
+                                 temporary file that is removed afterwards. Shards and
+                                 archives are kept next to it, never in the configured directories.
+        params (Dict, optional): Paging and retry parameters of the client. Defaults to `client_params`.
+
+    Returns:
+        Dict: The report: status, timings, throughput, client and server counters and the
+              stored share of the messages, reactions and users a complete export stores.
+    """
+    if db_file is None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            return run_scenario(
+                scenario, chat, os.path.join(tmp_dir, "loadtest.db"), params
+            )
+
+    if init_schema(db_file, db_params["init_script"]) != 0:
+        raise RuntimeError(f"Database `{db_file}` could not be created.")
+
+    telegram = FakeTelegram([chat], scenario)
+    client = TgClient(0, "", "loadtest", session_factory=telegram, params=params)
+
+    started = time.monotonic()
+    status_code, messages, users = asyncio.run(
+        export(client, chat.chat_id, save_pkl=False, db_file=db_file)
+    )
+    export_time = time.monotonic() - started
+
+    base = os.path.splitext(db_file)[0]
+    controller = MsgController(db_file, f"{base}_shards", f"{base}_archive")
+
+    try:
+        if status_code == 0:
+            status_code, status_message = controller.save_data(
+                messages, users, progress=False
+            )
+
+            if status_code != 0:
+                logger.error(status_message)
+
+        total_time = time.monotonic() - started
+
+        stats = controller.get_stats(chat.chat_id)
+        _, stored_messages, _, stored_reactions, _, _ = (
+            stats[0] if stats else (0, 0, 0, 0, None, None)
+        )
+        _, _, rows = controller.execute_read_query(
+            "select count(*) from users where chat_id = ?", (chat.chat_id,)
+        )
+        stored_users = rows[0][0] if rows else 0
+    finally:
+        controller.close()
+
+    expected = telegram.expected(chat.chat_id)
+
+    return {
+        "scenario": scenario.name,
+        "status": status_code,
+        "export_time": export_time,
+        "total_time": total_time,
+        "throughput": len(messages) / export_time if export_time else 0.0,
+        "client": dict(client.stats),
+        "server": dict(telegram.stats),
+        "completeness": {
+            "messages": _share(stored_messages, expected["messages"]),
+            "reactions": _share(stored_reactions, expected["reactions"]),
+            "users": _share(stored_users, expected["users"]),
+        },
+        "expected": expected,
+    }
+
+
+def format_reports(reports: List[Dict]) -> str:
+    """Formats scenario reports as a table."""
+    lines = [
+        f"{'scenario':<10} {'status':>6} {'time, s':>8} {'msg/s':>9} {'requests':>8} "
+        f"{'retries':>7} {'floods':>6} {'reconn.':>7} {'messages':>9} {'reactions':>9} {'users':>7}"
+    ]
+
+    for report in reports:
+        client = report["client"]
+        completeness = report["completeness"]
+
+        lines.append(
+            f"{report['scenario']:<10} {report['status']:>6} {report['total_time']:>8.2f} "
+            f"{report['throughput']:>9.0f} {client['requests']:>8} {client['retries']:>7} "
+            f"{client['flood_waits']:>6} {client['reconnects']:>7} "
+            f"{completeness['messages']:>9.1%} {completeness['reactions']:>9.1%} "
+            f"{completeness['users']:>7.1%}"
+        )
+
+    return "\n".join(lines)
+
+
+def _share(stored: int, expected: int) -> float:
+    return stored / expected if expected else 1.0
@@ -113,15 +113,21 @@ class User:
         user_name: str,
         first_name: str,
         last_name: str,
+        updated_at: Optional[datetime] = None,
     ):
         """
         Initializes a User instance.
+
+        Args:
+            updated_at (Optional[datetime]): When the profile was fetched from Telegram,
+                                             for profiles reused from the database. None means now.
         """
         self.chat_id = chat_id
         self.user_id = user_id
         self.user_name = user_name
         self.first_name = first_name
         self.last_name = last_name
+        self.updated_at = updated_at
 
         self._validate()
 
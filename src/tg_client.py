@@ -1,30 +1,45 @@
-from typing import List, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
 from datetime import datetime
+import asyncio
+import time
 import pickle
-import sys
 import os
 
 from loguru import logger
 from dateutil import tz
 
-from telethon import TelegramClient
-from telethon.tl.types import PeerUser
-from telethon.errors import ApiIdInvalidError
+from telethon import TelegramClient, events
+from telethon import utils as tl_utils
+from telethon.tl.types import PeerUser, UpdateMessageReactions
+from telethon.errors import ApiIdInvalidError, FloodWaitError
 
-from models import Msg, MsgReaction, User
+from config import client_params, live_params
+from src.models import Msg, MsgReaction, User
+from src.events import ChatEvent, EventSource, EventBatcher
 
 
 class TgClient:
     """
     A client to interact with Telegram using Telethon library.
 
+    Requests are retried after flood waits and lost connections; `stats` counts the requests,
+    retries and skipped data of the client.
+
     Attributes:
         api_id (str): The API ID for Telegram.
         api_hash (str): The API hash for Telegram.
         session_name (str): The name of the session.
+        session_factory (Callable): Creates the session from session name, API ID and API hash.
     """
 
-    def __init__(self, api_id: str, api_hash: str, session_name: str):
+    def __init__(
+        self,
+        api_id: str,
+        api_hash: str,
+        session_name: str,
+        session_factory: Callable = TelegramClient,
+        params: Dict = client_params,
+    ):
         """
         Initializes the TgClient with API ID, API hash, and session name.
 
@@ -32,12 +47,37 @@ class TgClient:
             api_id (str): The API ID for Telegram.
             api_hash (str): The API hash for Telegram.
             session_name (str): The name of the session.
+            session_factory (Callable, optional): Creates the session, called with the session name,
+                                                  API ID and API hash. Defaults to `TelegramClient`;
+                                                  `src.fake_telegram` provides a local stand-in.
+            params (Dict, optional): Paging and retry parameters. Defaults to `client_params`.
         """
         self.api_id = api_id
         self.api_hash = api_hash
         self.session_name = session_name
+        self.session_factory = session_factory
         self.session = None
 
+        self.page_size = params["page_size"]
+        self.max_retries = params["max_retries"]
+        self.retry_delay = params["retry_delay"]
+        self.max_flood_wait = params["max_flood_wait"]
+        self.profile_ttl = params["profile_ttl"]
+
+        # user_id -> (user name, first name, last name, fetch time), None if the user cannot be resolved
+        self.profiles: Dict[int, Optional[Tuple[str, str, str, datetime]]] = {}
+
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "flood_waits": 0,
+            "flood_wait_time": 0.0,
+            "reconnects": 0,
+            "missing_users": 0,
+            "profile_hits": 0,
+            "skipped_messages": 0,
+        }
+
     async def connect(self):
         """
         Connects to the Telegram session.
@@ -50,7 +90,9 @@ class TgClient:
                     2 and an error message for any other exception.
         """
         try:
-            self.session = TelegramClient(self.session_name, self.api_id, self.api_hash)
+            self.session = self.session_factory(
+                self.session_name, self.api_id, self.api_hash
+            )
 
             if not self.session.is_connected():
                 await self.session.connect()
@@ -75,6 +117,7 @@ class TgClient:
         start_date: datetime = None,
         end_date: datetime = None,
         save_pkl: bool = False,
+        min_id: int = 0,
     ) -> Tuple[int, List[Msg], List[User]]:
         """
         Exports messages from a Telegram chat.
@@ -84,6 +127,7 @@ class TgClient:
             start_date (datetime, optional): The start date for message export. Defaults to None.
             end_date (datetime, optional): The end date for message export. Defaults to None.
             save_pkl (bool, optional): Whether to save the messages to a pickle file. Defaults to False.
+            min_id (int, optional): Export only messages newer than this ID. Ignored if `start_date` is set.
 
         Returns:
         """
@@ -94,16 +138,19 @@ class TgClient:
         if not self.session.is_connected():
             return 1, messages, users
 
-        min_id = 0
         first_message = []
 
         if start_date:
-            pre_first_msg = await self.session.get_messages(
-                chat_id, offset_date=start_date, limit=1
+            pre_first_msg = await self._request(
+                self.session.get_messages, chat_id, offset_date=start_date, limit=1
             )
 
-            first_msg = await self.session.get_messages(
-                chat_id, min_id=pre_first_msg[0].id, limit=1, reverse=True
+            first_msg = await self._request(
+                self.session.get_messages,
+                chat_id,
+                min_id=pre_first_msg[0].id,
+                limit=1,
+                reverse=True,
             )
 
             min_id = first_msg[0].id
@@ -113,84 +160,52 @@ class TgClient:
         last_message = []
 
         if end_date:
-            last_msg = await self.session.get_messages(
-                chat_id, offset_date=end_date, limit=1
+            last_msg = await self._request(
+                self.session.get_messages, chat_id, offset_date=end_date, limit=1
             )
 
             max_id = last_msg[0].id
             last_message = [last_msg[0]]
 
-        raw_messages = (
-            await self.session.get_messages(chat_id, min_id=min_id, max_id=max_id)
-            + first_message
-            + last_message
-        )
+        raw_messages = first_message + last_message
 
-        for msg in raw_messages:
-            if (
-                msg
-                and msg.id
-                and msg.text
-                and msg.date
-                and isinstance(msg.from_id, PeerUser)
-            ):
-                users_set.add(msg.from_id.user_id)
-
-                reply_to_msg_id = (
-                    None if msg.reply_to is None else msg.reply_to.reply_to_msg_id
-                )
+        # History is read page by page from the newest message down, so a failed request
+        # is repeated for its page only.
+        offset_id = max_id
 
-                reactions = []
-
-                if msg.reactions and msg.reactions.recent_reactions:
-                    for reaction in msg.reactions.recent_reactions:
-                        if hasattr(reaction.reaction, "emoticon"):
-                            users_set.add(reaction.peer_id.user_id)
-
-                            mr = MsgReaction(
-                                chat_id=chat_id,
-                                msg_id=msg.id,
-                                user_id=reaction.peer_id.user_id,
-                                dt=reaction.date.astimezone(tz.tzlocal()),
-                                emoticon=reaction.reaction.emoticon,
-                            )
-                            reactions.append(mr)
-
-                message = Msg(
-                    chat_id,
-                    msg.from_id.user_id,
-                    msg.id,
-                    msg.text,
-                    msg.date.astimezone(tz.tzlocal()),
-                    reply_to_msg_id,
-                    reactions,
-                )
-                messages.append(message)
+        while True:
+            page = await self._request(
+                self.session.get_messages,
+                chat_id,
+                limit=self.page_size,
+                offset_id=offset_id,
+                min_id=min_id,
+                max_id=max_id,
+            )
 
-        for user_id in users_set:
-            try:
-                user_entity = await self.session.get_entity(PeerUser(user_id))
+            if not page:
+                break
 
-                first_name = user_entity.first_name if user_entity.first_name else ""
-                last_name = user_entity.last_name if user_entity.last_name else ""
+            raw_messages.extend(page)
+            offset_id = page[-1].id
 
-                user = User(
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    user_name=user_entity.username,
-                    first_name=first_name,
-                    last_name=last_name,
-                )
+        for msg in raw_messages:
+            message = self._to_msg(chat_id, msg, users_set)
 
-                users.append(user)
-            except ValueError:
-                pass
+            if message is not None:
+                messages.append(message)
+            else:
+                self.stats["skipped_messages"] += 1
+
+        users = await self.get_users(chat_id, users_set)
 
         if save_pkl:
             messages_pkl_file = f'{self.session_name}_messages_{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}.pkl'
             users_pkl_file = f'{self.session_name}_users_{datetime.now().strftime("%Y-%m-%d_%H:%M:%S")}.pkl'
 
-            pkl_dir = os.path.join(os.path.dirname(sys.path[0]), "pkl")
+            pkl_dir = os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pkl"
+            )
             pkl_messages_path = os.path.join(pkl_dir, messages_pkl_file)
             pkl_users_path = os.path.join(pkl_dir, users_pkl_file)
 
@@ -200,9 +215,309 @@ class TgClient:
                 pickle.dump(messages, f)
 
             with open(pkl_users_path, "wb") as f:
-                pickle.dump(messages, f)
+                pickle.dump(users, f)
 
             logger.info(f"File `{messages_pkl_file}` saved successfully.")
             logger.info(f"File `{users_pkl_file}` saved successfully.")
 
         return 0, messages, users
+
+    async def get_users(self, chat_id: int, user_ids: Set[int]) -> List[User]:
+        """
+        Fetches the profiles of the given users. Users that cannot be resolved are skipped.
+
+        Every user is fetched at most once per client, whatever the chat: profiles are kept
+        in `profiles`, which can also be seeded with profiles stored by earlier runs.
+
+        Args:
+            chat_id (int): The ID of the chat the users belong to.
+            user_ids (Set[int]): The IDs of the users to fetch.
+
+        Returns:
+            List[User]: The resolved users.
+        """
+        users = []
+
+        for user_id in user_ids:
+            if user_id in self.profiles:
+                self.stats["profile_hits"] += 1
+            else:
+                try:
+                    user_entity = await self._request(
+                        self.session.get_entity, PeerUser(user_id)
+                    )
+
+                    self.profiles[user_id] = (
+                        user_entity.username,
+                        user_entity.first_name if user_entity.first_name else "",
+                        user_entity.last_name if user_entity.last_name else "",
+                        datetime.now(),
+                    )
+                except ValueError:
+                    # Unresolvable users are not asked for again.
+                    self.profiles[user_id] = None
+
+            profile = self.profiles[user_id]
+
+            try:
+                if profile is None:
+                    raise ValueError("Unknown user")
+
+                user_name, first_name, last_name, updated_at = profile
+                users.append(
+                    User(chat_id, user_id, user_name, first_name, last_name, updated_at)
+                )
+            except ValueError:
+                self.stats["missing_users"] += 1
+
+        return users
+
+    async def _request(self, method: Callable, *args, **kwargs):
+        """
+        Calls a session method, sitting out flood waits and reconnecting after a lost connection.
+
+        Raises:
+            FloodWaitError: If the required wait is longer than `max_flood_wait`.
+            ConnectionError: If the request still fails after `max_retries` retries.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.stats["requests"] += 1
+
+            try:
+                return await method(*args, **kwargs)
+            except FloodWaitError as e:
+                if attempt == self.max_retries or e.seconds > self.max_flood_wait:
+                    raise
+
+                logger.warning(f"Flood wait of {e.seconds} seconds.")
+
+                started = time.monotonic()
+                await asyncio.sleep(e.seconds)
+
+                self.stats["flood_waits"] += 1
+                self.stats["flood_wait_time"] += time.monotonic() - started
+            except ConnectionError as e:
+                if attempt == self.max_retries:
+                    raise
+
+                delay = self.retry_delay * 2**attempt
+                logger.warning(
+                    f"Connection lost ({e}), reconnecting in {delay} seconds."
+                )
+
+                await asyncio.sleep(delay)
+
+                try:
+                    await self.session.connect()
+                    self.stats["reconnects"] += 1
+                except ConnectionError as e:
+                    # The next attempt fails again and waits longer.
+                    logger.warning(f"Reconnect failed: {e}")
+
+            self.stats["retries"] += 1
+
+    async def tail(
+        self,
+        controller,
+        chat_id: int,
+        source: EventSource = None,
+        flush_interval: float = 5.0,
+        flush_size: int = 500,
+        catch_up: bool = True,
+    ) -> Tuple[int, str]:
+        """
+        Keeps the database in sync with a chat by ingesting live updates.
+
+        The event source is started first, so that nothing is lost while the history
+        newer than the stored watermark is being caught up. Events are then saved
+        in micro-batches until the source ends the stream.
+
+        Args:
+            controller (MsgController): The controller used to store the data.
+            chat_id (int): The ID of the chat to follow.
+            source (EventSource, optional): The source of live events. Defaults to Telegram updates.
+            flush_interval (float, optional): Maximum age of a batch in seconds. Defaults to 5.0.
+            flush_size (int, optional): Maximum number of events in a batch. Defaults to 500.
+            catch_up (bool, optional): Whether to export messages newer than the watermark first.
+
+        Returns:
+            Tuple[int, str]: A tuple containing a status code and a message.
+        """
+        if source is None:
+            source = TelethonEventSource(self)
+
+        queue = asyncio.Queue()
+        batcher = EventBatcher(
+            controller,
+            chat_id,
+            flush_interval,
+            flush_size,
+            self.get_users,
+            live_params["max_retries"],
+            live_params["retry_delay"],
+        )
+
+        self.profiles.update(controller.get_profiles(self.profile_ttl))
+
+        await source.start(chat_id, queue)
+
+        try:
+            if catch_up:
+                watermark = controller.get_watermark(chat_id)
+                logger.info(f"Catching up chat {chat_id} from message {watermark} ...")
+
+                status_code, messages, users = await self.export_messages(
+                    chat_id, min_id=watermark
+                )
+
+                if status_code != 0:
+                    return status_code, "Catch-up export failed"
+
+                status_code, status_message = controller.save_data(messages, users)
+
+                if status_code != 0:
+                    return status_code, status_message
+
+                batcher.known_users.update([user.user_id for user in users])
+                logger.info(status_message)
+
+            return await batcher.run(queue)
+        finally:
+            await source.stop()
+            await batcher.flush()
+
+    def _to_msg(self, chat_id: int, msg, users_set: Set[int]):
+        """
+        Converts a Telethon message to `Msg`, collecting the IDs of the users involved.
+
+        Returns:
+            Optional[Msg]: The message, or None for service and non-text messages.
+        """
+        if not (
+            msg
+            and msg.id
+            and msg.text
+            and msg.date
+            and isinstance(msg.from_id, PeerUser)
+        ):
+            return None
+
+        users_set.add(msg.from_id.user_id)
+
+        reply_to_msg_id = None if msg.reply_to is None else msg.reply_to.reply_to_msg_id
+
+        reactions = self._to_reactions(chat_id, msg.id, msg.reactions, users_set)
+
+        return Msg(
+            chat_id,
+            msg.from_id.user_id,
+            msg.id,
+            msg.text,
+            msg.date.astimezone(tz.tzlocal()),
+            reply_to_msg_id,
+            reactions,
+        )
+
+    def _to_reactions(
+        self, chat_id: int, msg_id: int, msg_reactions, users_set: Set[int]
+    ) -> List[MsgReaction]:
+        """Converts Telethon message reactions to a list of `MsgReaction`."""
+        reactions = []
+
+        if msg_reactions and msg_reactions.recent_reactions:
+            for reaction in msg_reactions.recent_reactions:
+                if hasattr(reaction.reaction, "emoticon") and isinstance(
+                    reaction.peer_id, PeerUser
+                ):
+                    users_set.add(reaction.peer_id.user_id)
+
+                    mr = MsgReaction(
+                        chat_id=chat_id,
+                        msg_id=msg_id,
+                        user_id=reaction.peer_id.user_id,
+                        dt=reaction.date.astimezone(tz.tzlocal()),
+                        emoticon=reaction.reaction.emoticon,
+                    )
+                    reactions.append(mr)
+
+        return reactions
+
+
+class TelethonEventSource(EventSource):
+    """
+    Delivers new-message, edit, delete and reaction updates of a chat from a connected `TgClient`.
+    """
+
+    def __init__(self, client: TgClient):
+        self.client = client
+        self.chat_id = None
+        self.queue = None
+        self._handlers = []
+        self._watcher = None
+
+    async def start(self, chat_id: int, queue: asyncio.Queue):
+        session = self.client.session
+        self.chat_id = chat_id
+        self.queue = queue
+
+        self._handlers = [
+            (self._on_new_message, events.NewMessage(chats=chat_id)),
+            (self._on_edited_message, events.MessageEdited(chats=chat_id)),
+            (self._on_deleted_message, events.MessageDeleted(chats=chat_id)),
+            (self._on_reactions, events.Raw(UpdateMessageReactions)),
+        ]
+
+        for callback, event in self._handlers:
+            session.add_event_handler(callback, event)
+
+        self._watcher = asyncio.ensure_future(self._watch_disconnect())
+
+    async def stop(self):
+        session = self.client.session
+
+        for callback, event in self._handlers:
+            session.remove_event_handler(callback, event)
+
+        self._handlers = []
+
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch_disconnect(self):
+        await self.client.session.disconnected
+        self.queue.put_nowait(None)
+
+    def _push_message(self, kind: str, msg):
+        message = self.client._to_msg(self.chat_id, msg, set([]))
+
+        if message is not None:
+            self.queue.put_nowait(ChatEvent(kind, self.chat_id, msg=message))
+
+    async def _on_new_message(self, event):
+        self._push_message(ChatEvent.NEW, event.message)
+
+    async def _on_edited_message(self, event):
+        self._push_message(ChatEvent.EDIT, event.message)
+
+    async def _on_deleted_message(self, event):
+        self.queue.put_nowait(
+            ChatEvent(ChatEvent.DELETE, self.chat_id, msg_ids=list(event.deleted_ids))
+        )
+
+    async def _on_reactions(self, update):
+        if tl_utils.get_peer_id(update.peer) != self.chat_id:
+            return
+
+        reactions = self.client._to_reactions(
+            self.chat_id, update.msg_id, update.reactions, set([])
+        )
+
+        self.queue.put_nowait(
+            ChatEvent(
+                ChatEvent.REACTIONS,
+                self.chat_id,
+                msg_ids=[update.msg_id],
+                reactions=reactions,
+            )
+        )
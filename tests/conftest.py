@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+import config
+from db.controller import MsgController
+from db.init_db import init_schema
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(autouse=True)
+def params(monkeypatch):
+    """Runs every test with the default settings and an absolute path to the schema."""
+    monkeypatch.setitem(
+        config.db_params, "init_script", os.path.join(ROOT, "db", "init_db.sql")
+    )
+    monkeypatch.setitem(config.db_params, "sharding", "")
+    monkeypatch.setitem(config.compression_params, "enabled", False)
+    monkeypatch.setitem(config.text_stats_params, "enabled", False)
+    monkeypatch.setitem(config.query_cache_params, "enabled", True)
+
+
+@pytest.fixture
+def db_file(tmp_path) -> str:
+    path = str(tmp_path / "messages.db")
+    assert init_schema(path, config.db_params["init_script"]) == 0
+
+    return path
+
+
+@pytest.fixture
+def controller(db_file, tmp_path):
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+    yield controller
+    controller.close()
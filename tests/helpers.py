@@ -0,0 +1,33 @@
+from datetime import datetime
+
+from src.models import Msg, MsgReaction, User
+
+DT = datetime(2024, 1, 1, 12, 0)
+
+
+def make_msg(chat_id: int, msg_id: int, text: str = None, **kwargs) -> Msg:
+    return Msg(
+        chat_id,
+        kwargs.get("user_id", 7),
+        msg_id,
+        text if text is not None else f"message {msg_id}",
+        kwargs.get("msg_dt", DT),
+        kwargs.get("reply_to_msg_id"),
+        kwargs.get("reactions", []),
+    )
+
+
+def make_reaction(chat_id: int, msg_id: int, user_id: int = 8, emoticon: str = "👍"):
+    return MsgReaction(chat_id, msg_id, user_id, DT, emoticon)
+
+
+def make_user(chat_id: int, user_id: int = 7, first_name: str = "First") -> User:
+    return User(chat_id, user_id, f"user{user_id}", first_name, "Last")
+
+
+def bad_reaction(chat_id: int, msg_id: int) -> MsgReaction:
+    """A reaction that passes validation but cannot be bound as a query parameter."""
+    reaction = make_reaction(chat_id, msg_id)
+    reaction.emoticon = ["not", "a", "string"]
+
+    return reaction
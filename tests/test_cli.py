@@ -0,0 +1,74 @@
+import os
+import pickle
+
+import pytest
+
+import config
+from src.cli import main
+from tests.helpers import make_msg, make_user
+
+CHAT_ID = -100
+
+
+@pytest.fixture
+def missing_db(tmp_path, monkeypatch) -> str:
+    """Points the CLI to a database that has not been created yet."""
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / "messages.db")
+    monkeypatch.setitem(config.db_params, "db_file", path)
+
+    return path
+
+
+@pytest.mark.parametrize(
+    "argv",
+    [
+        ["stats"],
+        ["maintenance"],
+        ["compress"],
+        ["text-stats", "--chat-id", str(CHAT_ID)],
+        ["interactions", "--chat-id", str(CHAT_ID)],
+        ["replay", "--messages", "m.pkl", "--users", "u.pkl"],
+        ["export", "--chat-id", str(CHAT_ID), "--api-id", "1"],
+        ["tail", "--chat-id", str(CHAT_ID), "--api-id", "1"],
+    ],
+)
+def test_commands_do_not_create_a_missing_database(missing_db, argv, capsys):
+    assert main(argv) == 2
+    assert "init" in capsys.readouterr().err
+    assert os.listdir(os.path.dirname(missing_db)) == []
+
+    # The database can still be created afterwards.
+    assert main(["init"]) == 0
+    assert main(["stats"]) == 0
+
+
+def test_replay_stores_pickled_data(missing_db, capsys):
+    assert main(["init"]) == 0
+
+    with open("m.pkl", "wb") as file:
+        pickle.dump([make_msg(CHAT_ID, 1), make_msg(CHAT_ID, 2)], file)
+
+    with open("u.pkl", "wb") as file:
+        pickle.dump([make_user(CHAT_ID)], file)
+
+    assert main(["replay", "--messages", "m.pkl", "--users", "u.pkl"]) == 0
+    assert main(["stats", "--chat-id", str(CHAT_ID)]) == 0
+    assert f"{CHAT_ID:>16} {2:>10}" in capsys.readouterr().out
+
+
+def test_database_errors_are_reported(missing_db, capsys):
+    with open(missing_db, "wb") as file:
+        file.write(b"this is not a database" * 100)
+
+    assert main(["stats"]) == 1
+    assert capsys.readouterr().err.startswith("Error: ")
+
+
+def test_missing_config_and_telegram_params_are_reported(missing_db, capsys):
+    assert main(["--config", "missing.ini", "stats"]) == 2
+    assert "missing.ini" in capsys.readouterr().err
+
+    assert main(["init"]) == 0
+    assert main(["export", "--chat-id", str(CHAT_ID)]) == 2
+    assert "api_id" in capsys.readouterr().err
@@ -0,0 +1,149 @@
+import pytest
+
+import config
+from db.compression import TextCompressor, migrate, train_dictionary
+from db.controller import MsgController
+from tests.helpers import bad_reaction, make_msg, make_user
+
+CHAT_ID = -100
+
+TEXTS = [
+    f"good morning everyone, the meeting about release {i} starts at ten in the big room"
+    for i in range(40)
+]
+
+
+@pytest.fixture
+def compression(monkeypatch):
+    monkeypatch.setitem(config.compression_params, "enabled", True)
+    monkeypatch.setitem(config.compression_params, "train_threshold", 20)
+
+
+def open_controller(db_file, tmp_path) -> MsgController:
+    return MsgController(db_file, str(tmp_path / "shards"), str(tmp_path / "archive"))
+
+
+def save_texts(controller, texts, first_msg_id: int = 1, reactions=()):
+    messages = [
+        make_msg(CHAT_ID, msg_id, text)
+        for msg_id, text in enumerate(texts, start=first_msg_id)
+    ]
+    messages[-1].reactions = list(reactions)
+
+    return controller.save_data(messages, [make_user(CHAT_ID)], progress=False)
+
+
+def stored_types(controller):
+    _, _, rows = controller.execute_read_query(
+        "select typeof(msg_text), count(*) from messages group by 1", cached=False
+    )
+
+    return dict(rows)
+
+
+def test_encode_decode_round_trip(controller):
+    compressor = TextCompressor(
+        controller.conn, dict(config.compression_params, enabled=True)
+    )
+    assert compressor.train(CHAT_ID, TEXTS) == (0, "OK")
+
+    for text in TEXTS + ["", "совсем другой текст 🙂"]:
+        value = compressor.encode(CHAT_ID, text)
+
+        if isinstance(value, bytes):
+            assert len(value) < len(text.encode("utf-8"))
+
+        assert compressor.decode(CHAT_ID, value) == text
+
+    assert isinstance(compressor.encode(CHAT_ID, TEXTS[0]), bytes)
+    # Chats without a dictionary keep their texts plain.
+    assert compressor.encode(CHAT_ID + 1, TEXTS[0]) == TEXTS[0]
+
+
+def test_train_dictionary_needs_repeated_content():
+    assert train_dictionary(["abc", "xyz"], 1024) == b""
+    assert 0 < len(train_dictionary(TEXTS, 256)) <= 256
+
+
+def test_saved_texts_are_compressed_and_read_back(compression, db_file, tmp_path):
+    controller = open_controller(db_file, tmp_path)
+    assert save_texts(controller, TEXTS)[0] == 0
+    controller.close()
+
+    controller = open_controller(db_file, tmp_path)
+    assert controller.compressor.dictionary(CHAT_ID) is not None
+    assert stored_types(controller).get("blob", 0) > 0
+
+    messages = controller.get_messages(CHAT_ID)
+    assert [msg.msg_text for msg in messages] == TEXTS
+    assert controller.get_message(CHAT_ID, 40).msg_text == TEXTS[-1]
+    controller.close()
+
+
+def test_migrate_compresses_and_restores(db_file, tmp_path, monkeypatch):
+    controller = open_controller(db_file, tmp_path)
+    assert save_texts(controller, TEXTS)[0] == 0
+    assert stored_types(controller) == {"text": 40}
+    controller.close()
+
+    monkeypatch.setitem(config.compression_params, "enabled", True)
+    controller = open_controller(db_file, tmp_path)
+
+    status_code, _ = migrate(controller.compressor, [controller.conn], batch_size=7)
+    assert status_code == 0
+    assert stored_types(controller).get("blob", 0) > 0
+    assert [msg.msg_text for msg in controller.get_messages(CHAT_ID)] == TEXTS
+
+    status_code, _ = migrate(
+        controller.compressor, [controller.conn], decompress=True, batch_size=7
+    )
+    assert status_code == 0
+    assert stored_types(controller) == {"text": 40}
+    assert [msg.msg_text for msg in controller.get_messages(CHAT_ID)] == TEXTS
+    controller.close()
+
+
+def test_dictionary_is_kept_when_its_batch_fails(compression, db_file, tmp_path):
+    controller = open_controller(db_file, tmp_path)
+
+    # The batch trains the dictionary and then fails on its last reaction.
+    status_code, _ = save_texts(
+        controller, TEXTS, reactions=[bad_reaction(CHAT_ID, len(TEXTS))]
+    )
+
+    assert status_code != 0
+    assert controller.get_messages(CHAT_ID) == []
+
+    # The dictionary was committed before the batch and stays in use.
+    version = controller.compressor.dictionary(CHAT_ID)[0]
+    _, _, rows = controller.execute_read_query(
+        "select chat_id, dict_version from text_dicts", cached=False
+    )
+    assert rows == [(CHAT_ID, version)]
+
+    assert save_texts(controller, TEXTS)[0] == 0
+    assert controller.compressor.dictionary(CHAT_ID)[0] == version
+    controller.close()
+
+    controller = open_controller(db_file, tmp_path)
+    assert [msg.msg_text for msg in controller.get_messages(CHAT_ID)] == TEXTS
+    controller.close()
+
+
+def test_sharded_texts_are_compressed_with_a_stored_dictionary(
+    compression, db_file, tmp_path, monkeypatch
+):
+    monkeypatch.setitem(config.db_params, "sharding", "chat_month")
+    controller = open_controller(db_file, tmp_path)
+    assert save_texts(controller, TEXTS)[0] == 0
+    controller.close()
+
+    # The dictionary is read from the main database, the texts from the shard.
+    controller = open_controller(db_file, tmp_path)
+    shard = controller.router.connection(controller.router.list_shards(CHAT_ID)[0].path)
+    _, _, rows = shard.execute_read_query(
+        "select count(*) from messages where typeof(msg_text) = 'blob'"
+    )
+    assert rows[0][0] > 0
+    assert [msg.msg_text for msg in controller.get_messages(CHAT_ID)] == TEXTS
+    controller.close()
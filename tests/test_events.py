@@ -0,0 +1,267 @@
+import asyncio
+
+from src.events import ChatEvent, EventBatcher, QueueEventSource
+from tests.helpers import make_msg, make_reaction, make_user
+
+CHAT_ID = -100
+
+
+def reactions_of(controller, msg_id: int):
+    _, _, rows = controller.execute_read_query(
+        "select user_id, emoticon from reactions where chat_id = ? and msg_id = ? order by user_id",
+        (CHAT_ID, msg_id),
+        cached=False,
+    )
+
+    return rows
+
+
+async def resolve_users(chat_id, user_ids):
+    return [make_user(chat_id, user_id) for user_id in sorted(user_ids)]
+
+
+def make_batcher(controller) -> EventBatcher:
+    return EventBatcher(controller, CHAT_ID, 60.0, 1000, resolve_users)
+
+
+def test_new_edit_delete_in_one_batch_is_a_delete(controller):
+    batcher = make_batcher(controller)
+    assert (
+        asyncio.run(_save(batcher, [make_msg(CHAT_ID, 1), make_msg(CHAT_ID, 2)])) == 0
+    )
+
+    batcher.add(ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, 3)))
+    batcher.add(ChatEvent(ChatEvent.EDIT, CHAT_ID, msg=make_msg(CHAT_ID, 3, "edited")))
+    batcher.add(
+        ChatEvent(
+            ChatEvent.REACTIONS,
+            CHAT_ID,
+            msg_ids=[3],
+            reactions=[make_reaction(CHAT_ID, 3)],
+        )
+    )
+    batcher.add(ChatEvent(ChatEvent.DELETE, CHAT_ID, msg_ids=[2, 3]))
+
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1]
+    assert reactions_of(controller, 3) == []
+
+
+def test_edit_supersedes_earlier_reaction_update(controller):
+    batcher = make_batcher(controller)
+
+    batcher.add(ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, 1)))
+    batcher.add(
+        ChatEvent(
+            ChatEvent.REACTIONS,
+            CHAT_ID,
+            msg_ids=[1],
+            reactions=[make_reaction(CHAT_ID, 1, user_id=8)],
+        )
+    )
+    edited = make_msg(
+        CHAT_ID,
+        1,
+        "edited",
+        reactions=[make_reaction(CHAT_ID, 1, user_id=9, emoticon="🔥")],
+    )
+    batcher.add(ChatEvent(ChatEvent.EDIT, CHAT_ID, msg=edited))
+
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+
+    assert controller.get_message(CHAT_ID, 1).msg_text == "edited"
+    assert reactions_of(controller, 1) == [(9, "🔥")]
+    # Authors of messages and reactions are resolved once.
+    assert batcher.known_users == {7, 9}
+
+
+def test_edits_replace_stored_reactions(controller):
+    batcher = make_batcher(controller)
+
+    for emoticon in ("👍", "❤"):
+        msg = make_msg(
+            CHAT_ID, 5, reactions=[make_reaction(CHAT_ID, 5, emoticon=emoticon)]
+        )
+        batcher.add(ChatEvent(ChatEvent.EDIT, CHAT_ID, msg=msg))
+        assert asyncio.run(batcher.flush()) == (0, "OK")
+        assert reactions_of(controller, 5) == [(8, emoticon)]
+
+    batcher.add(ChatEvent(ChatEvent.EDIT, CHAT_ID, msg=make_msg(CHAT_ID, 5)))
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+    assert reactions_of(controller, 5) == []
+
+
+def test_reactions_of_stored_messages_are_replaced_in_one_write(controller):
+    batcher = make_batcher(controller)
+    assert (
+        asyncio.run(_save(batcher, [make_msg(CHAT_ID, 1), make_msg(CHAT_ID, 2)])) == 0
+    )
+    version = controller.get_chat_version(CHAT_ID)
+
+    for msg_id in (1, 2):
+        batcher.add(
+            ChatEvent(
+                ChatEvent.REACTIONS,
+                CHAT_ID,
+                msg_ids=[msg_id],
+                reactions=[make_reaction(CHAT_ID, msg_id, user_id=8)],
+            )
+        )
+
+    batcher.add(
+        ChatEvent(
+            ChatEvent.REACTIONS,
+            CHAT_ID,
+            msg_ids=[2],
+            reactions=[make_reaction(CHAT_ID, 2, user_id=9, emoticon="🔥")],
+        )
+    )
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+
+    assert reactions_of(controller, 1) == [(8, "👍")]
+    assert reactions_of(controller, 2) == [(9, "🔥")]
+    # One save, one reaction replacement and no deletes: two bumps at most.
+    assert controller.get_chat_version(CHAT_ID) - version <= 2
+
+
+def test_reactions_after_delete_are_ignored(controller):
+    batcher = make_batcher(controller)
+    assert asyncio.run(_save(batcher, [make_msg(CHAT_ID, 1)])) == 0
+
+    batcher.add(ChatEvent(ChatEvent.DELETE, CHAT_ID, msg_ids=[1]))
+    batcher.add(
+        ChatEvent(
+            ChatEvent.REACTIONS,
+            CHAT_ID,
+            msg_ids=[1],
+            reactions=[make_reaction(CHAT_ID, 1)],
+        )
+    )
+
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+    assert controller.get_messages(CHAT_ID) == []
+    assert reactions_of(controller, 1) == []
+
+
+def test_run_consumes_queue_event_source(controller):
+    source = QueueEventSource(
+        [
+            ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, i))
+            for i in range(1, 6)
+        ]
+    )
+    source.push(ChatEvent(ChatEvent.NEW, CHAT_ID + 1, msg=make_msg(CHAT_ID + 1, 1)))
+    source.push(ChatEvent(ChatEvent.EDIT, CHAT_ID, msg=make_msg(CHAT_ID, 2, "edited")))
+    source.push(ChatEvent(ChatEvent.DELETE, CHAT_ID, msg_ids=[5]))
+    source.close()
+
+    batcher = EventBatcher(controller, CHAT_ID, 60.0, 3, resolve_users)
+
+    async def tail():
+        queue = asyncio.Queue()
+        await source.start(CHAT_ID, queue)
+
+        return await batcher.run(queue)
+
+    status_code, _ = asyncio.run(tail())
+
+    assert status_code == 0
+    assert batcher.events == 7
+    assert batcher.flushes == 3
+
+    messages = controller.get_messages(CHAT_ID)
+    assert [msg.msg_id for msg in messages] == [1, 2, 3, 4]
+    assert messages[1].msg_text == "edited"
+    # Events of other chats are not stored.
+    assert controller.get_messages(CHAT_ID + 1) == []
+
+
+class FailingController:
+    """Delegates to a controller, failing the first `failures` writes of each kind."""
+
+    def __init__(self, controller, failures: int):
+        self.controller = controller
+        self.failures = {"save_data": failures, "delete_messages": failures}
+
+    def __getattr__(self, name):
+        method = getattr(self.controller, name)
+
+        def call(*args, **kwargs):
+            if self.failures.get(name, 0) > 0:
+                self.failures[name] -= 1
+                return 1, "database is locked"
+
+            return method(*args, **kwargs)
+
+        return call
+
+
+def test_failed_flush_keeps_the_batch_and_retries(controller):
+    source = QueueEventSource(
+        [
+            ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, 1)),
+            ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, 2)),
+            ChatEvent(ChatEvent.DELETE, CHAT_ID, msg_ids=[1]),
+        ]
+    )
+    source.close()
+
+    batcher = EventBatcher(
+        FailingController(controller, 1),
+        CHAT_ID,
+        60.0,
+        2,
+        resolve_users,
+        max_retries=3,
+        retry_delay=0.01,
+    )
+
+    async def tail():
+        queue = asyncio.Queue()
+        await source.start(CHAT_ID, queue)
+
+        return await batcher.run(queue)
+
+    status_code, _ = asyncio.run(tail())
+
+    assert status_code == 0
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [2]
+
+
+def test_batch_is_kept_when_retries_are_exhausted(controller):
+    batcher = EventBatcher(
+        FailingController(controller, 10),
+        CHAT_ID,
+        60.0,
+        1000,
+        resolve_users,
+        max_retries=1,
+        retry_delay=0.01,
+    )
+    source = QueueEventSource(
+        [ChatEvent(ChatEvent.NEW, CHAT_ID, msg=make_msg(CHAT_ID, 1))]
+    )
+    source.close()
+
+    async def tail():
+        queue = asyncio.Queue()
+        await source.start(CHAT_ID, queue)
+
+        return await batcher.run(queue)
+
+    assert asyncio.run(tail()) == (1, "database is locked")
+    assert controller.get_messages(CHAT_ID) == []
+
+    # The events are still there for a later flush.
+    batcher.controller = controller
+    assert asyncio.run(batcher.flush()) == (0, "OK")
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1]
+
+
+async def _save(batcher: EventBatcher, messages) -> int:
+    for msg in messages:
+        batcher.add(ChatEvent(ChatEvent.NEW, CHAT_ID, msg=msg))
+
+    status_code, _ = await batcher.flush()
+
+    return status_code
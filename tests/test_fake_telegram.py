@@ -0,0 +1,48 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import asyncio
+
+from telethon import events
+from telethon.tl.types import PeerUser
+
+from src.fake_telegram import FakeChat, FakeMessage, FakeTelegram, SCENARIOS
+from src.tg_client import TgClient
+
+CHAT_ID = -100
+
+
+def test_tail_ends_when_the_session_is_dropped(controller):
+    telegram = FakeTelegram([FakeChat.synthetic(CHAT_ID, 50, 5)], SCENARIOS["ideal"])
+    client = TgClient("1", "hash", "session", session_factory=telegram)
+    expected = telegram.expected(CHAT_ID)
+    last_msg_id = max(msg.id for msg in telegram.history(CHAT_ID) if msg.text)
+
+    async def follow():
+        await client.connect()
+        task = asyncio.ensure_future(
+            client.tail(controller, CHAT_ID, flush_interval=0.01)
+        )
+
+        # Wait for the catch-up export, then deliver a live message.
+        while controller.get_watermark(CHAT_ID) < last_msg_id:
+            await asyncio.sleep(0.01)
+
+        session = client.session
+        on_new_message = next(
+            callback
+            for callback, event in session._handlers
+            if isinstance(event, events.NewMessage)
+        )
+        message = FakeMessage(51, "live", datetime.now(timezone.utc), PeerUser(1000))
+        await on_new_message(SimpleNamespace(message=message))
+
+        session.drop()
+
+        return await asyncio.wait_for(task, timeout=5)
+
+    status_code, _ = asyncio.run(follow())
+
+    assert status_code == 0
+    assert len(controller.get_messages(CHAT_ID)) == expected["messages"] + 1
+    assert controller.get_message(CHAT_ID, 51).msg_text == "live"
+    assert client.session._handlers == []
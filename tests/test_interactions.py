@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+import sqlite3
+
+import pytest
+
+import config
+from db.controller import MsgController
+from src.interactions import InteractionAnalytics
+from tests.helpers import DT, make_msg, make_reaction, make_user
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+
+
+def conversation(chat_id: int):
+    """User 7 writes, 8 replies twice, 7 and 9 react, 7 replies to 8 and to its own reply."""
+    return [
+        make_msg(chat_id, 1, user_id=7, reactions=[make_reaction(chat_id, 1, 9)]),
+        make_msg(chat_id, 2, user_id=8, reply_to_msg_id=1),
+        make_msg(
+            chat_id,
+            3,
+            user_id=8,
+            reply_to_msg_id=1,
+            reactions=[make_reaction(chat_id, 3, 7)],
+        ),
+        make_msg(chat_id, 4, user_id=7, reply_to_msg_id=2),
+        make_msg(chat_id, 5, user_id=7, reply_to_msg_id=4),
+    ]
+
+
+def save(controller, messages):
+    users = [
+        make_user(msg.chat_id, user_id) for msg in messages[:1] for user_id in (7, 8, 9)
+    ]
+
+    return controller.save_data(messages, users, progress=False)
+
+
+@pytest.fixture
+def analytics(controller):
+    assert save(controller, conversation(CHAT_ID))[0] == 0
+    assert save(controller, conversation(OTHER_CHAT_ID))[0] == 0
+
+    return InteractionAnalytics(controller, config.interaction_params)
+
+
+def test_graph_counts_replies_and_reactions(analytics):
+    graph = analytics.graph(CHAT_ID)
+
+    assert list(graph.users) == [7, 8, 9]
+    # Self replies are not interactions.
+    assert graph.replies.sum() == 3
+    assert graph.reactions.sum() == 2
+    assert graph.top_pairs(2) == [(7, 8, 2.0), (8, 7, 2.0)]
+    assert graph.top_pairs(1, mutual=True) == [(7, 8, 4.0)]
+    assert graph.reciprocity() == pytest.approx(2 / 3)
+    assert list(graph.degrees()["in_degree"]) == [2, 1, 0]
+    assert graph.top_users(graph.pagerank(), 1)[0][0] == 7
+
+
+def test_period_keeps_replies_to_older_messages(analytics, controller):
+    later = DT + timedelta(days=1)
+    assert (
+        save(
+            controller,
+            [make_msg(CHAT_ID, 6, user_id=9, reply_to_msg_id=1, msg_dt=later)],
+        )[0]
+        == 0
+    )
+
+    graph = analytics.graph(CHAT_ID, start_date=later)
+
+    assert graph.top_pairs() == [(9, 7, 1.0)]
+
+
+def test_cached_graph_is_dropped_when_its_chat_changes(analytics, controller):
+    first = analytics.graph(CHAT_ID)
+    other = analytics.graph(OTHER_CHAT_ID)
+
+    assert analytics.graph(CHAT_ID) is first
+    assert analytics.cache_info() == {"hits": 1, "misses": 2, "size": 2}
+
+    # A new reaction changes the graph of its chat only.
+    message = conversation(CHAT_ID)[1]
+    message.reactions = [make_reaction(CHAT_ID, 2, 9)]
+    assert save(controller, [message])[0] == 0
+
+    graph = analytics.graph(CHAT_ID)
+    assert graph is not first
+    assert graph.reactions.sum() == 3
+    assert analytics.graph(OTHER_CHAT_ID) is other
+
+    # So does a delete, which also drops the replies to the deleted message.
+    assert controller.delete_messages(CHAT_ID, [2])[0] == 0
+    assert analytics.graph(CHAT_ID).replies.sum() == 1
+    assert analytics.cache_info()["misses"] == 4
+
+
+def test_commit_of_another_process_invalidates(analytics, db_file):
+    first = analytics.graph(CHAT_ID)
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("delete from reactions where chat_id = ?", (CHAT_ID,))
+    conn.execute(
+        "update chat_versions set version = version + 1 where chat_id = ?", (CHAT_ID,)
+    )
+    conn.commit()
+    conn.close()
+
+    graph = analytics.graph(CHAT_ID)
+    assert graph is not first
+    assert graph.reactions.sum() == 0
+
+
+def test_least_recently_used_graphs_are_evicted(controller, monkeypatch):
+    assert save(controller, conversation(CHAT_ID))[0] == 0
+    monkeypatch.setitem(config.interaction_params, "cache_size", 2)
+    analytics = InteractionAnalytics(controller, config.interaction_params)
+
+    days = [DT + timedelta(days=i) for i in range(3)]
+
+    for day in days:
+        analytics.graph(CHAT_ID, end_date=day)
+
+    analytics.graph(CHAT_ID, end_date=days[2])
+    analytics.graph(CHAT_ID, end_date=days[0])
+
+    assert analytics.cache_info() == {"hits": 1, "misses": 4, "size": 2}
+
+
+def test_replies_across_shards_are_resolved(db_file, tmp_path, monkeypatch):
+    monkeypatch.setitem(config.db_params, "sharding", "chat_month")
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+    messages = [
+        make_msg(CHAT_ID, 1, user_id=7, msg_dt=datetime(2024, 1, 31)),
+        make_msg(CHAT_ID, 2, user_id=8, reply_to_msg_id=1, msg_dt=datetime(2024, 2, 1)),
+    ]
+    messages[0].reactions = [make_reaction(CHAT_ID, 1, 9)]
+    assert save(controller, messages)[0] == 0
+
+    analytics = InteractionAnalytics(controller, config.interaction_params)
+    graph = analytics.graph(CHAT_ID, start_date=datetime(2024, 2, 1))
+
+    assert graph.top_pairs() == [(8, 7, 1.0)]
+    assert analytics.graph(CHAT_ID).reactions.sum() == 1
+    controller.close()
@@ -0,0 +1,184 @@
+from datetime import datetime, timedelta
+import os
+import sqlite3
+
+import pytest
+
+import config
+from db.controller import MsgController
+from db.maintenance import Maintenance
+from db.shards import ShardRouter
+from db.sqlite_connector import SQLiteConnector
+from src.cli import main
+from tests.helpers import make_msg, make_reaction, make_user
+
+CHAT_ID = -100
+
+
+@pytest.fixture
+def conn(db_file):
+    conn = SQLiteConnector(db_file)
+    assert conn.connect()[0] == 0
+    yield conn
+    conn.close()
+
+
+def save(controller, messages):
+    return controller.save_data(messages, [make_user(CHAT_ID)], progress=False)
+
+
+def stat_tables(conn):
+    _, _, rows = conn.execute_read_query("select distinct tbl from sqlite_stat1")
+
+    return set(row[0] for row in rows)
+
+
+def test_dedupe_reactions(controller, db_file, conn):
+    assert save(controller, [make_msg(CHAT_ID, 1), make_msg(CHAT_ID, 2)])[0] == 0
+    version = controller.get_chat_version(CHAT_ID)
+
+    # Databases created before the unique index could hold duplicates.
+    raw = sqlite3.connect(db_file)
+    raw.execute("drop index reactions_uniq_idx")
+    raw.executemany(
+        "insert into reactions (chat_id, msg_id, user_id, emoticon) values (?, ?, ?, ?)",
+        [(CHAT_ID, 1, 8, "👍")] * 3 + [(CHAT_ID, 2, 8, "👍"), (CHAT_ID, 2, 9, "👍")],
+    )
+    raw.commit()
+    raw.close()
+
+    status_code, status_message = Maintenance(conn, 60, batch_size=1).dedupe_reactions(
+        [conn]
+    )
+
+    assert (status_code, status_message) == (0, "Deleted 2 duplicate reactions.")
+    _, _, rows = conn.execute_read_query(
+        "select msg_id, user_id from reactions order by msg_id, user_id"
+    )
+    assert rows == [(1, 8), (2, 8), (2, 9)]
+    _, _, rows = conn.execute_read_query(
+        "select 1 from sqlite_master where name = 'reactions_uniq_idx'"
+    )
+    assert rows == [(1,)]
+    assert controller.get_chat_version(CHAT_ID) == version + 2
+
+
+def test_retention_moves_old_messages_to_the_archive(
+    controller, db_file, tmp_path, monkeypatch
+):
+    old = datetime.now() - timedelta(days=800)
+    messages = [
+        make_msg(CHAT_ID, 1, msg_dt=old, reactions=[make_reaction(CHAT_ID, 1)]),
+        make_msg(CHAT_ID, 2, msg_dt=old + timedelta(days=1)),
+        make_msg(CHAT_ID, 3, msg_dt=datetime.now() - timedelta(days=1)),
+        make_msg(-200, 1, msg_dt=old),
+    ]
+    assert save(controller, messages)[0] == 0
+    assert len(controller.get_messages(CHAT_ID)) == 3
+
+    monkeypatch.setitem(config.db_params, "db_file", db_file)
+    monkeypatch.setitem(
+        config.maintenance_params, "archive_dir", str(tmp_path / "archive")
+    )
+    assert main(["maintenance", f"--retention={CHAT_ID}:12"]) == 0
+
+    # The cached result is dropped, the retention commit bumped the chat version.
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [3]
+    assert [
+        msg.msg_id for msg in controller.get_messages(CHAT_ID, include_archive=True)
+    ] == [1, 2, 3]
+    _, _, rows = controller.execute_read_query(
+        "select count(*) from reactions", cached=False
+    )
+    assert rows == [(0,)]
+    # Chats without a rule are kept.
+    assert len(controller.get_messages(-200)) == 1
+
+
+def test_incremental_vacuum_frees_pages(controller, conn):
+    texts = ["x" * 2000] * 200
+    messages = [make_msg(CHAT_ID, i, text) for i, text in enumerate(texts, start=1)]
+    assert save(controller, messages)[0] == 0
+    assert controller.delete_messages(CHAT_ID, list(range(1, 201)))[0] == 0
+
+    _, _, rows = conn.execute_read_query("pragma freelist_count")
+    assert rows[0][0] > 0
+
+    status_code, _ = Maintenance(conn, 60).incremental_vacuum(pages_per_step=16)
+
+    assert status_code == 0
+    _, _, rows = conn.execute_read_query("pragma freelist_count")
+    assert rows == [(0,)]
+
+
+def test_incremental_vacuum_is_skipped_on_old_databases(conn):
+    for query in ("pragma auto_vacuum = none", "vacuum"):
+        assert conn.execute_query(query)[0] == 0
+
+    maintenance = Maintenance(conn, 60)
+    assert maintenance.incremental_vacuum() == (
+        0,
+        "Skipped, incremental vacuum is not enabled.",
+    )
+
+    assert maintenance.enable_incremental_vacuum()[0] == 0
+    _, _, rows = conn.execute_read_query("pragma auto_vacuum")
+    assert rows == [(2,)]
+
+
+def test_optimize_analyzes_tables_without_statistics(controller, conn):
+    messages = [
+        make_msg(CHAT_ID, i, reactions=[make_reaction(CHAT_ID, i)])
+        for i in range(1, 20)
+    ]
+    assert save(controller, messages)[0] == 0
+
+    # A fresh connection that has not queried anything.
+    status_code, _ = Maintenance(conn, 60).optimize([conn])
+
+    assert status_code == 0
+    assert {"messages", "reactions", "profiles"} <= stat_tables(conn)
+
+    # Tables that already have statistics are not analyzed again, only empty ones are.
+    remaining = Maintenance(conn, 60)._tables_without_stats(conn)[2]
+    assert ("messages",) not in remaining
+    assert Maintenance(conn, 60).optimize([conn]) == (
+        0,
+        f"Planner statistics updated, {len(remaining)} tables analyzed.",
+    )
+
+
+def test_optimize_covers_shards_and_sealed_shards(db_file, tmp_path, monkeypatch):
+    monkeypatch.setitem(config.db_params, "sharding", "month")
+    monkeypatch.setitem(config.db_params, "db_file", db_file)
+    monkeypatch.setitem(config.db_params, "shard_dir", str(tmp_path / "shards"))
+    controller = MsgController()
+    messages = [
+        make_msg(CHAT_ID, i, msg_dt=datetime(2024, i % 3 + 1, 1)) for i in range(1, 20)
+    ]
+    assert save(controller, messages)[0] == 0
+    controller.close()
+
+    router = ShardRouter(
+        str(tmp_path / "shards"), "month", config.db_params["init_script"]
+    )
+    january, february, march = router.list_shards()
+    assert router.seal(january)[0] == 0
+
+    # A shard sealed before `seal` analyzed it.
+    os.chmod(february.path, 0o644)
+    raw = sqlite3.connect(february.path)
+    raw.execute("pragma journal_mode = delete")
+    raw.close()
+    os.chmod(february.path, 0o444)
+    router.close()
+
+    assert main(["maintenance"]) == 0
+
+    for shard in (january, february, march):
+        conn = SQLiteConnector(f"file:{shard.path}?mode=ro", uri=True)
+        assert conn.connect()[0] == 0
+        assert "messages" in stat_tables(conn)
+        conn.close()
+
+    assert february.read_only
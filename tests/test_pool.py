@@ -0,0 +1,69 @@
+import pytest
+
+from db.pool import ConnectionManager
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ConnectionManager(str(tmp_path / "pool.db"), pool_size=2, timeout=1)
+    assert manager.connect()[0] == 0
+    assert manager.execute_query("create table t (x integer)")[0] == 0
+    assert manager.execute_query("insert into t values (1)")[0] == 0
+    yield manager
+    manager.close()
+
+
+def count(conn) -> int:
+    status_code, _, rows = conn.execute_read_query("select count(*) from t")
+    assert status_code == 0
+
+    return rows[0][0]
+
+
+def test_reader_sees_one_snapshot_while_the_writer_commits(manager):
+    with manager.reader() as conn:
+        assert count(conn) == 1
+
+        with manager.transaction():
+            assert manager.execute_query("insert into t values (2)")[0] == 0
+            assert manager.execute_query("insert into t values (3)")[0] == 0
+
+        # The commit is not visible within the snapshot, but to new reads.
+        assert count(conn) == 1
+        assert count(manager) == 3
+
+    with manager.reader() as conn:
+        assert count(conn) == 3
+
+    assert manager.stats()["in_use"] == 0
+
+
+def test_reader_errors_are_returned(tmp_path):
+    manager = ConnectionManager(str(tmp_path / "missing.db"))
+
+    status_code, status_message, rows = manager.execute_read_query("select 1")
+
+    assert status_code == 1
+    assert "unable to open" in status_message
+    assert rows == []
+    assert manager.stats()["readers"] == 0
+
+
+def test_pool_timeout_is_returned(manager):
+    with manager.reader(), manager.reader():
+        status_code, status_message, _ = manager.execute_read_query("select 1")
+
+    assert status_code == 1
+    assert "No free read connection" in status_message
+    assert manager.stats()["timeouts"] == 1
+
+
+def test_readers_borrowed_during_close_are_closed_on_return(manager):
+    with manager.reader() as conn:
+        manager.close()
+
+        # The borrowed reader stays usable until it is returned.
+        assert count(conn) == 1
+
+    assert conn.connection is None
+    assert manager.stats()["readers"] == 0
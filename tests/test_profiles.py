@@ -0,0 +1,181 @@
+from datetime import datetime, timedelta
+import sqlite3
+
+import config
+from db.controller import MsgController
+from src.cli import main
+from tests.helpers import DT, make_msg, make_user
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+
+# Schema of databases created before profiles were shared between chats.
+OLD_SCHEMA = """
+create table users (
+    chat_id integer not null default (0),
+    user_id integer not null default (0),
+    user_name text not null default (''),
+    first_name text not null default (''),
+    last_name text not null default (''),
+    primary key (chat_id, user_id)
+);
+
+create table messages (
+    chat_id integer not null default 0,
+    user_id integer not null default 0,
+    msg_id integer not null default 0,
+    msg_text text not null default '',
+    msg_dt timestamp not null default current_timestamp,
+    reply_to_msg_id integer,
+    primary key (chat_id, msg_id),
+    constraint messages_fk foreign key (chat_id, user_id) references users(chat_id, user_id)
+);
+
+create index messages_chat_id_idx on messages (chat_id);
+create index messages_comp_idx2 on messages (chat_id, user_id);
+create index messages_comp_idx3 on messages (chat_id, msg_dt);
+
+create table reactions (
+    id integer primary key autoincrement,
+    chat_id integer not null default 0,
+    user_id integer not null default 0,
+    msg_id integer not null default 0,
+    emoticon text not null default '',
+    constraint reactions_fk1 foreign key (chat_id, msg_id) references messages(chat_id, msg_id)
+    constraint reactions_fk2 foreign key (chat_id, user_id) references users(chat_id, user_id)
+);
+
+create index reactions_comp_idx on reactions (chat_id, msg_id);
+"""
+
+
+def create_old_database(path: str):
+    conn = sqlite3.connect(path)
+    conn.executescript(OLD_SCHEMA)
+    conn.executemany(
+        "insert into users values (?, ?, ?, ?, ?)",
+        [
+            (CHAT_ID, 7, "user7", "Old", "Name"),
+            (OTHER_CHAT_ID, 7, "user7", "New", "Name"),
+            (CHAT_ID, 8, "user8", "Silent", "Reader"),
+        ],
+    )
+    conn.executemany(
+        "insert into messages (chat_id, user_id, msg_id, msg_text, msg_dt) values (?, ?, ?, ?, ?)",
+        [
+            (CHAT_ID, 7, 1, "first", DT),
+            (CHAT_ID, 7, 2, "second", DT + timedelta(days=3)),
+            (OTHER_CHAT_ID, 7, 1, "elsewhere", DT + timedelta(days=1)),
+        ],
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_users_table_is_migrated_to_profiles(tmp_path):
+    db_file = str(tmp_path / "old.db")
+    create_old_database(db_file)
+
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+
+    _, _, rows = controller.execute_read_query(
+        "select type from sqlite_master where name = 'users'"
+    )
+    assert rows == [("view",)]
+
+    _, _, rows = controller.execute_read_query(
+        "select user_id, first_name from profiles order by user_id"
+    )
+    # The copy of a user written last wins.
+    assert rows == [(7, "New"), (8, "Silent")]
+
+    _, _, rows = controller.execute_read_query(
+        "select chat_id, user_id, first_seen, last_seen from chat_members order by chat_id, user_id"
+    )
+    assert rows == [
+        (OTHER_CHAT_ID, 7, str(DT + timedelta(days=1)), str(DT + timedelta(days=1))),
+        (CHAT_ID, 7, str(DT), str(DT + timedelta(days=3))),
+        (CHAT_ID, 8, None, None),
+    ]
+
+    _, _, rows = controller.execute_read_query(
+        "select chat_id, user_id, first_name from users where chat_id = ? order by user_id",
+        (CHAT_ID,),
+    )
+    assert rows == [(CHAT_ID, 7, "New"), (CHAT_ID, 8, "Silent")]
+
+    # The migrated database takes new data, and reopening it does not migrate again.
+    status_code, _ = controller.save_data(
+        [make_msg(CHAT_ID, 3, user_id=9)], [make_user(CHAT_ID, 9)], progress=False
+    )
+    assert status_code == 0
+    controller.close()
+
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1, 2, 3]
+    assert 9 in controller.get_profiles()
+    controller.close()
+
+
+def test_reused_profile_keeps_its_fetch_time(controller):
+    fetched_at = datetime.now() - timedelta(days=3)
+
+    user = make_user(CHAT_ID, 7, "Old")
+    user.updated_at = fetched_at
+    assert controller.save_data([], [user], progress=False)[0] == 0
+
+    # A profile reused from the database is stored again with its original fetch time.
+    reused = make_user(OTHER_CHAT_ID, 7, "Old")
+    reused.updated_at = fetched_at
+    assert controller.save_data([], [reused], progress=False)[0] == 0
+
+    assert controller.get_profiles()[7] == ("user7", "Old", "Last", fetched_at)
+    assert 7 not in controller.get_profiles(max_age=24 * 3600)
+
+    # A freshly fetched profile replaces it, an older copy does not.
+    assert (
+        controller.save_data([], [make_user(CHAT_ID, 7, "New")], progress=False)[0] == 0
+    )
+    stale = make_user(CHAT_ID, 7, "Stale")
+    stale.updated_at = fetched_at
+    assert controller.save_data([], [stale], progress=False)[0] == 0
+
+    assert controller.get_profiles(max_age=24 * 3600)[7][1] == "New"
+
+    _, _, rows = controller.execute_read_query(
+        "select chat_id from chat_members where user_id = 7 order by chat_id"
+    )
+    assert rows == [(OTHER_CHAT_ID,), (CHAT_ID,)]
+
+
+def test_users_are_migrated_with_activity_from_the_shards(
+    tmp_path, monkeypatch, capsys
+):
+    db_file = str(tmp_path / "old.db")
+    create_old_database(db_file)
+
+    monkeypatch.setitem(config.db_params, "sharding", "chat_month")
+    monkeypatch.setitem(config.db_params, "db_file", db_file)
+    monkeypatch.setitem(config.db_params, "shard_dir", str(tmp_path / "shards"))
+    monkeypatch.setitem(
+        config.maintenance_params, "archive_dir", str(tmp_path / "archive")
+    )
+
+    # The messages are moved into the shards first, the users then read from there.
+    assert main(["shards", "--migrate"]) == 0
+    assert "Moved 3 messages" in capsys.readouterr().out
+
+    controller = MsgController()
+    _, _, rows = controller.execute_read_query(
+        "select chat_id, user_id, first_seen, last_seen from chat_members order by chat_id, user_id"
+    )
+    assert rows == [
+        (OTHER_CHAT_ID, 7, str(DT + timedelta(days=1)), str(DT + timedelta(days=1))),
+        (CHAT_ID, 7, str(DT), str(DT + timedelta(days=3))),
+        (CHAT_ID, 8, None, None),
+    ]
+    controller.close()
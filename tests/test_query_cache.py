@@ -0,0 +1,122 @@
+import sqlite3
+
+from db.query_cache import QueryCache, _estimate_size, make_key
+from tests.helpers import bad_reaction, make_msg, make_user
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+
+
+def save(controller, chat_id: int, msg_ids, **kwargs):
+    messages = [make_msg(chat_id, msg_id, **kwargs) for msg_id in msg_ids]
+
+    return controller.save_data(messages, [make_user(chat_id)], progress=False)
+
+
+def test_repeated_read_is_a_hit(controller):
+    assert save(controller, CHAT_ID, [1, 2])[0] == 0
+
+    first = controller.get_messages(CHAT_ID)
+    second = controller.get_messages(CHAT_ID)
+
+    assert [msg.msg_id for msg in first] == [msg.msg_id for msg in second] == [1, 2]
+    assert controller.cache.stats()["hits"] == 1
+
+
+def test_write_invalidates_only_its_chat(controller):
+    assert save(controller, CHAT_ID, [1])[0] == 0
+    assert save(controller, OTHER_CHAT_ID, [1])[0] == 0
+
+    controller.get_messages(CHAT_ID)
+    controller.get_messages(OTHER_CHAT_ID)
+    assert save(controller, CHAT_ID, [2])[0] == 0
+
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1, 2]
+    assert [msg.msg_id for msg in controller.get_messages(OTHER_CHAT_ID)] == [1]
+
+    stats = controller.cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+
+
+def test_commit_of_another_connection_invalidates(controller, db_file):
+    assert save(controller, CHAT_ID, [1, 2])[0] == 0
+    assert len(controller.get_messages(CHAT_ID)) == 2
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("delete from messages where chat_id = ? and msg_id = 2", (CHAT_ID,))
+    conn.execute(
+        "update chat_versions set version = version + 1 where chat_id = ?", (CHAT_ID,)
+    )
+    conn.commit()
+    conn.close()
+
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1]
+
+
+def test_failed_write_keeps_cache_and_version(controller):
+    assert save(controller, CHAT_ID, [1])[0] == 0
+    version = controller.get_chat_version(CHAT_ID)
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1]
+
+    status_code, _ = save(
+        controller, CHAT_ID, [2], reactions=[bad_reaction(CHAT_ID, 2)]
+    )
+
+    assert status_code != 0
+    # The message written before the failing reaction was rolled back with the batch.
+    assert controller.get_message(CHAT_ID, 2) is None
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1]
+    assert controller.get_chat_version(CHAT_ID) == version
+
+    assert save(controller, CHAT_ID, [2])[0] == 0
+    assert [msg.msg_id for msg in controller.get_messages(CHAT_ID)] == [1, 2]
+    assert controller.get_chat_version(CHAT_ID) == version + 1
+
+
+def test_least_recently_used_results_are_evicted(db_file):
+    rows = [("x" * 100,)] * 5
+    size = _estimate_size(rows)
+
+    cache = QueryCache(db_file, max_bytes=3 * size, max_entry_bytes=2 * size)
+    assert cache.connect()[0] == 0
+
+    for key in ("a", "b", "c"):
+        cache.execute(make_key(key), CHAT_ID, lambda: rows)
+
+    cache.execute(make_key("a"), CHAT_ID, lambda: rows)
+    cache.execute(make_key("d"), CHAT_ID, lambda: rows)
+
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] == 3 * size
+
+    # "a" was used last before "d" was added, so "b" went first.
+    cache.execute(make_key("a"), CHAT_ID, lambda: rows)
+    assert cache.stats()["hits"] == 2
+
+    cache.execute(make_key("big"), CHAT_ID, lambda: rows * 3)
+    assert cache.stats()["uncacheable"] == 1
+
+    cache.close()
+
+
+def test_result_racing_an_invalidation_is_not_stored(db_file):
+    cache = QueryCache(db_file, max_bytes=2**20)
+    assert cache.connect()[0] == 0
+
+    def run():
+        cache.invalidate(CHAT_ID)
+        return [(1,)]
+
+    assert cache.execute(make_key("q"), CHAT_ID, run) == [(1,)]
+    assert cache.stats()["discarded"] == 1
+    assert cache.stats()["entries"] == 0
+
+    cache.close()
+
+
+def test_make_key_normalizes_whitespace_outside_literals():
+    assert make_key("select  *\n  from t", (1,)) == make_key("select * from t", (1,))
+    assert make_key("select 'a  b'") != make_key("select 'a b'")
+    assert make_key("q", [1, 2]) == make_key("q", (1, 2))
@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
+
+import pytest
+
+import config
+from db.controller import MsgController
+from tests.helpers import make_msg, make_reaction, make_user
+
+CHAT_ID = -100
+OTHER_CHAT_ID = -200
+
+
+@pytest.fixture
+def sharded(db_file, tmp_path, monkeypatch):
+    monkeypatch.setitem(config.db_params, "sharding", "chat_month")
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+    yield controller
+    controller.close()
+
+
+def month_msg(chat_id: int, msg_id: int, month: int, **kwargs):
+    return make_msg(chat_id, msg_id, msg_dt=datetime(2024, month, 1, 12, 0), **kwargs)
+
+
+def shard_files(path):
+    return sorted(name for name in os.listdir(path) if name.endswith(".db"))
+
+
+def test_save_data_from_worker_threads(sharded):
+    def save(chat_id: int):
+        messages = [month_msg(chat_id, i, i % 3 + 1) for i in range(1, 31)]
+
+        return sharded.save_data(messages, [make_user(chat_id)], progress=False)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(save, [CHAT_ID, OTHER_CHAT_ID, -300, -400]))
+
+    assert [status_code for status_code, _ in results] == [0, 0, 0, 0]
+
+    # The shard writers opened by the worker threads keep working from this one.
+    assert sharded.save_data([month_msg(CHAT_ID, 31, 1)], [], progress=False)[0] == 0
+
+    for chat_id in (CHAT_ID, OTHER_CHAT_ID, -300, -400):
+        assert len(sharded.get_messages(chat_id)) == (31 if chat_id == CHAT_ID else 30)
+
+
+def test_messages_are_routed_to_chat_month_shards(sharded, tmp_path):
+    messages = [
+        month_msg(CHAT_ID, 1, 1),
+        month_msg(CHAT_ID, 2, 2, reactions=[make_reaction(CHAT_ID, 2)]),
+        month_msg(CHAT_ID, 3, 3),
+        month_msg(OTHER_CHAT_ID, 1, 2),
+    ]
+    assert sharded.save_data(messages, [make_user(CHAT_ID)], progress=False)[0] == 0
+
+    shard_dir = tmp_path / "shards"
+    assert shard_files(shard_dir / f"chat_{CHAT_ID}") == [
+        "2024-01.db",
+        "2024-02.db",
+        "2024-03.db",
+    ]
+    assert shard_files(shard_dir / f"chat_{OTHER_CHAT_ID}") == ["2024-02.db"]
+    assert os.path.exists(tmp_path / "messages.db")
+
+    # Reads combine the shards of the chat that overlap the date range.
+    assert [msg.msg_id for msg in sharded.get_messages(CHAT_ID)] == [1, 2, 3]
+    assert [
+        msg.msg_id
+        for msg in sharded.get_messages(
+            CHAT_ID, datetime(2024, 2, 1), datetime(2024, 3, 31)
+        )
+    ] == [2, 3]
+    assert sharded.get_message(CHAT_ID, 2).msg_dt == datetime(2024, 2, 1, 12, 0)
+    assert sharded.get_watermark(CHAT_ID) == 3
+
+    stats = {row[0]: row[1:4] for row in sharded.get_stats()}
+    assert stats[CHAT_ID] == (3, 1, 1)
+    assert stats[OTHER_CHAT_ID] == (1, 1, 0)
+
+    # Deletes and edits reach the shard holding the message.
+    assert sharded.delete_messages(CHAT_ID, [2])[0] == 0
+    assert [msg.msg_id for msg in sharded.get_messages(CHAT_ID)] == [1, 3]
+    assert sharded.save_data([month_msg(CHAT_ID, 3, 3, text="edited")], [])[0] == 0
+    assert sharded.get_message(CHAT_ID, 3).msg_text == "edited"
+
+
+def test_sharding_an_unsharded_database_requires_migration(
+    controller, db_file, tmp_path, monkeypatch, capsys
+):
+    messages = [
+        month_msg(CHAT_ID, i, i % 2 + 1, reactions=[make_reaction(CHAT_ID, i)])
+        for i in range(1, 6)
+    ]
+    assert controller.save_data(messages, [make_user(CHAT_ID)], progress=False)[0] == 0
+    controller.close()
+
+    monkeypatch.setitem(config.db_params, "sharding", "chat_month")
+    monkeypatch.setitem(config.db_params, "db_file", db_file)
+    monkeypatch.setitem(config.db_params, "shard_dir", str(tmp_path / "shards"))
+
+    with pytest.raises(RuntimeError, match="shards --migrate"):
+        MsgController()
+
+    from src.cli import main
+
+    assert main(["shards", "--migrate", "--batch-size", "2"]) == 0
+    assert "Moved 5 messages" in capsys.readouterr().out
+
+    sharded = MsgController()
+
+    try:
+        assert [msg.msg_id for msg in sharded.get_messages(CHAT_ID)] == [1, 2, 3, 4, 5]
+        assert sharded.get_stats()[0][1:4] == (5, 1, 5)
+        assert sharded.get_watermark(CHAT_ID) == 5
+    finally:
+        sharded.close()
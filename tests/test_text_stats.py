@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import config
+from db.controller import MsgController
+from src.cli import main
+from tests.helpers import DT, bad_reaction, make_msg, make_user
+
+CHAT_ID = -100
+
+
+@pytest.fixture
+def indexed(db_file, tmp_path, monkeypatch):
+    monkeypatch.setitem(config.text_stats_params, "enabled", True)
+    controller = MsgController(
+        db_file, str(tmp_path / "shards"), str(tmp_path / "archive")
+    )
+    yield controller
+    controller.close()
+
+
+def save(controller, messages):
+    return controller.save_data(messages, [make_user(CHAT_ID)], progress=False)
+
+
+def term_rows(controller):
+    _, _, rows = controller.execute_read_query(
+        """
+        select t.term, c.day, c.user_id, c.cnt from term_counts c
+        join terms t on t.term_id = c.term_id
+        order by t.term, c.day, c.user_id
+        """,
+        cached=False,
+    )
+
+    return rows
+
+
+def test_tokenize_skips_links_numbers_stop_words_and_short_tokens(indexed):
+    tokens = indexed.text_stats.tokenize(
+        "The RELEASE is at https://example.com/x 2024, see ｒｅｌｅａｓｅ notes a b"
+    )
+
+    assert tokens == ["release", "see", "release", "notes"]
+
+    terms = indexed.text_stats.terms("release notes release")
+    assert terms[("release", 1)] == 2
+    assert terms[("release notes", 2)] == terms[("notes release", 2)] == 1
+
+
+def test_counts_follow_saves_edits_and_deletes(indexed):
+    messages = [
+        make_msg(CHAT_ID, 1, "release notes ready"),
+        make_msg(CHAT_ID, 2, "release ready", user_id=8),
+        make_msg(CHAT_ID, 3, "release party", msg_dt=DT + timedelta(days=1)),
+    ]
+    assert save(indexed, messages)[0] == 0
+
+    stats = indexed.text_stats
+    assert stats.top_terms(CHAT_ID, limit=2) == [("release", 3), ("ready", 2)]
+    assert stats.top_terms(CHAT_ID, end_date=DT) == [
+        ("ready", 2),
+        ("release", 2),
+        ("notes", 1),
+    ]
+    assert stats.top_terms(CHAT_ID, user_id=8) == [("ready", 1), ("release", 1)]
+    assert stats.top_terms(
+        CHAT_ID, n=stats.BIGRAM, start_date=DT + timedelta(days=1)
+    ) == [("release party", 1)]
+
+    # Saving the same message again, e.g. on a re-export, does not count it twice.
+    assert save(indexed, [make_msg(CHAT_ID, 1, "release notes ready")])[0] == 0
+    assert stats.top_terms(CHAT_ID, limit=1) == [("release", 3)]
+
+    # An edit replaces the old counts, a delete removes them and their rows.
+    assert save(indexed, [make_msg(CHAT_ID, 1, "draft notes")])[0] == 0
+    assert indexed.delete_messages(CHAT_ID, [2, 3])[0] == 0
+
+    assert term_rows(indexed) == [
+        ("draft", DT.strftime("%Y-%m-%d"), 7, 1),
+        ("draft notes", DT.strftime("%Y-%m-%d"), 7, 1),
+        ("notes", DT.strftime("%Y-%m-%d"), 7, 1),
+    ]
+
+
+def test_failed_batch_keeps_the_counts(indexed):
+    assert save(indexed, [make_msg(CHAT_ID, 1, "release notes")])[0] == 0
+
+    messages = [
+        make_msg(CHAT_ID, 1, "other words"),
+        make_msg(CHAT_ID, 2, "brand new", reactions=[bad_reaction(CHAT_ID, 2)]),
+    ]
+    assert save(indexed, messages)[0] != 0
+    assert indexed.text_stats.top_terms(CHAT_ID) == [("notes", 1), ("release", 1)]
+
+    # The terms of the rolled back batch are stored when it is written again.
+    messages[1].reactions = []
+    assert save(indexed, messages)[0] == 0
+    assert [term for term, _ in indexed.text_stats.top_terms(CHAT_ID)] == [
+        "brand",
+        "new",
+        "other",
+        "words",
+    ]
+
+
+def test_trends_compare_yesterday_with_the_day_before(indexed):
+    today = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+    messages = [
+        make_msg(CHAT_ID, 1, "deploy", msg_dt=today - timedelta(days=2)),
+        make_msg(CHAT_ID, 2, "deploy rollback", msg_dt=today - timedelta(days=1)),
+        make_msg(CHAT_ID, 3, "rollback again", msg_dt=today - timedelta(days=1)),
+        make_msg(CHAT_ID, 4, "rollback", msg_dt=today),
+    ]
+    assert save(indexed, messages)[0] == 0
+
+    assert indexed.text_stats.term_trends(CHAT_ID, limit=3) == [
+        ("rollback", 2, 0, 2),
+        ("again", 1, 0, 1),
+        ("deploy", 1, 1, 0),
+    ]
+
+
+def test_rebuild_indexes_messages_stored_before(
+    controller, db_file, monkeypatch, capsys
+):
+    messages = [make_msg(CHAT_ID, 1, "old news"), make_msg(CHAT_ID, 2, "old times")]
+    assert save(controller, messages)[0] == 0
+
+    monkeypatch.setitem(config.db_params, "db_file", db_file)
+    monkeypatch.setitem(config.text_stats_params, "enabled", True)
+
+    args = ["text-stats", f"--chat-id={CHAT_ID}", "--limit", "1"]
+    assert main(args + ["--rebuild"]) == 0
+    assert "Indexed 2 messages." in capsys.readouterr().out
+
+    # Rebuilding again does not count the messages twice.
+    assert main(args + ["--rebuild"]) == 0
+    assert f"{'old':<32} {2:>10}" in capsys.readouterr().out